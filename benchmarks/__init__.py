@@ -0,0 +1,49 @@
+"""
+Performance benchmarks for the TripTuner API.
+
+Run a benchmark module with `python -m benchmarks.<module> --help`. Benchmarks that need data create
+a separate `test_` database for the configured Postgres server, and drop it afterwards unless `--keepdb` is given.
+"""
+
+import os
+import statistics
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "triptuner.settings")
+
+    import django
+
+    django.setup()
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(latencies):
+    """
+    Latency percentiles in milliseconds
+    """
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
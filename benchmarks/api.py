@@ -0,0 +1,216 @@
+"""
+Load benchmark of the main API endpoints over a synthetic data set.
+
+Seeds destinations and itineraries (with a random number of stops each), then requests every scenario in turn and
+reports throughput, p50/p95/p99 latency and database queries per request. Weather scenarios run against a local
+Open-Meteo stub with injected latency, starting from an empty forecast cache. Results are saved as JSON, and with
+`--baseline` the run fails when a scenario regressed (see `benchmarks.results`).
+
+    python -m benchmarks.api --destinations 1000000 --itineraries 100000 --requests 200 \\
+        --output results.json --baseline baseline.json
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+from benchmarks import benchmark_database, setup_django, summarize
+from benchmarks.nearby import seed_destinations
+from benchmarks.results import gate, load_results, save_results
+from benchmarks.stub_server import StubForecastServer
+
+FIRST_START_DATE = datetime.date(2025, 1, 1)
+START_DATE_DAYS = 730
+
+
+def seed_itineraries(count, min_stops, max_stops, batch_size=5000, seed=0):
+    from django.db.models import Max, Min
+
+    from triptuner.models import Destination, Itinerary, ItineraryDestination
+
+    rng = random.Random(seed)
+    bounds = Destination.objects.aggregate(first=Min("id"), last=Max("id"))
+    for start in range(0, count, batch_size):
+        itineraries = []
+        for index in range(start, min(start + batch_size, count)):
+            start_date = FIRST_START_DATE + datetime.timedelta(days=rng.randrange(START_DATE_DAYS))
+            end_date = start_date + datetime.timedelta(days=rng.randint(1, 14))
+            itineraries.append(Itinerary(name=f"Trip {index}", start_date=start_date, end_date=end_date))
+        itineraries = Itinerary.objects.bulk_create(itineraries)
+        ItineraryDestination.objects.bulk_create(
+            [
+                ItineraryDestination(
+                    itinerary=itinerary,
+                    destination_id=rng.randint(bounds["first"], bounds["last"]),
+                    visit_order=visit_order,
+                )
+                for itinerary in itineraries
+                for visit_order in range(1, rng.randint(min_stops, max_stops) + 1)
+            ],
+            batch_size=10000,
+        )
+
+
+def build_scenarios(rng):
+    """
+    Scenario name -> function returning the (method, path, data) of a random request
+    """
+    from django.db.models import Max, Min
+
+    from triptuner.models import Destination, Itinerary
+    from triptuner.pagination import KeysetPagination
+
+    destinations = Destination.objects.aggregate(first=Min("id"), last=Max("id"))
+    itineraries = Itinerary.objects.aggregate(first=Min("id"), last=Max("id"))
+    cursor = KeysetPagination().encode_cursor
+
+    def destination_id():
+        return rng.randint(destinations["first"], destinations["last"])
+
+    def itinerary_id():
+        return rng.randint(itineraries["first"], itineraries["last"])
+
+    def start_date():
+        return (FIRST_START_DATE + datetime.timedelta(days=rng.randrange(START_DATE_DAYS))).isoformat()
+
+    def bounding_box():
+        longitude, latitude = rng.uniform(-180, 170), rng.uniform(-60, 60)
+        return f"{longitude:.2f},{latitude:.2f},{longitude + 10:.2f},{latitude + 10:.2f}"
+
+    def new_itinerary():
+        stops = [{"destination": destination_id()} for _ in range(10)]
+        return {"name": "Benchmark trip", "start_date": "2025-06-01", "end_date": "2025-06-10", "destinations": stops}
+
+    return {
+        "destination_list": lambda: (
+            "get",
+            f"/api/destinations/?page_size=100&cursor={cursor([destination_id()], False)}",
+            None,
+        ),
+        "destination_filter": lambda: (
+            "get",
+            f"/api/destinations/?type={rng.choice(['country', 'city', 'poi'])}&page_size=100"
+            f"&cursor={cursor([destination_id()], False)}",
+            None,
+        ),
+        "itinerary_list": lambda: ("get", f"/api/itineraries/?page_size=50&cursor={cursor([start_date(), 0], False)}", None),
+        "itinerary_route_distance": lambda: (
+            "get",
+            f"/api/itineraries/?route_distance_km__lte={rng.randint(50_000, 150_000)}&ordering=-route_distance_km"
+            "&page_size=50",
+            None,
+        ),
+        "itinerary_bounding_box": lambda: ("get", f"/api/itineraries/?bbox={bounding_box()}&page_size=50", None),
+        "itinerary_create": lambda: ("post", "/api/itineraries/", new_itinerary()),
+        "itinerary_weather": lambda: ("get", f"/api/itineraries/{itinerary_id()}/weather/", None),
+        "destination_weather": lambda: ("get", f"/api/itineraries/{itinerary_id()}/1/weather/", None),
+    }
+
+
+def run_scenario(client, request, count, warmup):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    for _ in range(warmup):
+        method, path, data = request()
+        getattr(client, method)(path, data=data, format="json")
+
+    latencies, queries, errors = [], 0, 0
+    started = time.perf_counter()
+    for _ in range(count):
+        method, path, data = request()
+        with CaptureQueriesContext(connection) as captured:
+            request_started = time.perf_counter()
+            response = getattr(client, method)(path, data=data, format="json")
+            latencies.append(time.perf_counter() - request_started)
+        queries += len(captured)
+        errors += response.status_code >= 400
+    wall_time = time.perf_counter() - started
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": count / wall_time,
+        **summarize(latencies),
+        "queries_per_request": queries / count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--destinations", type=int, default=1_000_000)
+    parser.add_argument("--itineraries", type=int, default=100_000)
+    parser.add_argument("--min-stops", type=int, default=5)
+    parser.add_argument("--max-stops", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per scenario")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds of latency injected by the stub")
+    parser.add_argument("--scenarios", nargs="+", help="only run these scenarios")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="fail if the results regressed from this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change in latency/throughput")
+    parser.add_argument("--keepdb", action="store_true", help="keep (and reuse) the seeded benchmark database")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import override_settings
+    from rest_framework.test import APIClient
+
+    from triptuner.models import Destination, Forecast, Itinerary
+    from triptuner.weather import forecast_cache
+
+    with benchmark_database(keepdb=args.keepdb), StubForecastServer(latency=args.latency) as server:
+        if Destination.objects.count() != args.destinations or Itinerary.objects.count() != args.itineraries:
+            Itinerary.objects.all().delete()
+            Destination.objects.all().delete()
+            started = time.perf_counter()
+            seed_destinations(args.destinations)
+            seed_itineraries(args.itineraries, args.min_stops, args.max_stops)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            print(
+                f"seeded {args.destinations} destinations and {args.itineraries} itineraries "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+
+        # Weather scenarios start cold
+        Forecast.objects.all().delete()
+        cache.clear()
+        forecast_cache.clear()
+
+        client = APIClient()
+        client.force_authenticate(User.objects.get_or_create(username="benchmark", is_staff=True, is_superuser=True)[0])
+        scenarios = build_scenarios(random.Random(1))
+        names = args.scenarios or list(scenarios)
+
+        results = {}
+        # The stub is not rate limited, so neither are the calls to it
+        with override_settings(
+            WEATHER_HTTP_CLIENT={**settings.WEATHER_HTTP_CLIENT, "URL": server.url},
+            WEATHER_UPSTREAM={**settings.WEATHER_UPSTREAM, "RATE": None},
+        ):
+            for name in names:
+                results[name] = result = run_scenario(client, scenarios[name], args.requests, args.warmup)
+                print(
+                    f"{name}: {result['throughput_rps']:.0f} req/s, p50 {result['p50_ms']:.1f}ms, "
+                    f"p95 {result['p95_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms, "
+                    f"{result['queries_per_request']:.1f} queries/request, {result['errors']} errors"
+                )
+
+    parameters = {
+        name: getattr(args, name)
+        for name in ("destinations", "itineraries", "min_stops", "max_stops", "requests", "warmup", "latency")
+    }
+    current = save_results(args.output, parameters, results) if args.output else {"scenarios": results}
+    if args.baseline:
+        print()
+        gate(load_results(args.baseline), current, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Throughput of the bulk destination import and export (`triptuner/catalogue.py`) on a synthetic catalogue.
+
+Writes a file of random destinations, imports it into an empty table, imports it again (every row unchanged) and
+exports it, reporting rows per second for each.
+
+    python -m benchmarks.catalogue --rows 1000000 --format csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks import benchmark_database, setup_django
+
+
+def write_catalogue(path, rows, file_format, seed=0):
+    rng = random.Random(seed)
+    types = ["country", "city", "poi"]
+    with open(path, "w", encoding="utf-8", newline="") as output:
+        writer = csv.writer(output)
+        if file_format == "csv":
+            writer.writerow(["external_id", "name", "description", "type", "latitude", "longitude"])
+        for index in range(rows):
+            row = [
+                f"poi-{index}",
+                f"Destination {index}",
+                "Somewhere worth a visit",
+                types[index % 3],
+                round(rng.uniform(-60, 70), 6),
+                round(rng.uniform(-180, 180), 6),
+            ]
+            if file_format == "csv":
+                writer.writerow(row)
+            else:
+                keys = ["external_id", "name", "description", "type", "latitude", "longitude"]
+                output.write(json.dumps(dict(zip(keys, row))) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    setup_django()
+    from triptuner.catalogue import export_lines, import_destinations
+    from triptuner.models import Destination
+
+    with tempfile.TemporaryDirectory() as directory, benchmark_database():
+        path = os.path.join(directory, f"catalogue.{args.format}")
+        write_catalogue(path, args.rows, args.format)
+        print(f"{args.rows} rows, {os.path.getsize(path) / 1e6:.0f}MB of {args.format}")
+
+        for label in ("import", "re-import (unchanged)"):
+            started = time.perf_counter()
+            with open(path, encoding="utf-8", newline="") as stream:
+                summary = import_destinations(stream, args.format, args.chunk_size)
+            elapsed = time.perf_counter() - started
+            print(
+                f"{label}: {elapsed:.1f}s, {args.rows / elapsed:,.0f} rows/s "
+                f"({summary['inserted']} inserted, {summary['updated']} updated, {summary['unchanged']} unchanged)"
+            )
+
+        started = time.perf_counter()
+        size = sum(len(chunk) for chunk in export_lines(Destination.objects.all(), args.format))
+        elapsed = time.perf_counter() - started
+        print(f"export: {elapsed:.1f}s, {args.rows / elapsed:,.0f} rows/s, {size / 1e6:.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
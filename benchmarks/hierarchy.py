@@ -0,0 +1,144 @@
+"""
+Latency of destination hierarchy queries over a large synthetic catalogue of countries, cities and points of interest.
+
+Measures `/api/destinations/?within=` for countries and cities, `/api/destinations/<id>/ancestors/`,
+`/api/itineraries/?visits=` and moving a city (with its points of interest) to another country.
+
+    python -m benchmarks.hierarchy --pois 2000000 --countries 50 --cities 5000 --itineraries 20000
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks import benchmark_database, setup_django, summarize
+from benchmarks.api import seed_itineraries
+
+
+def seed_hierarchy(countries, cities, pois, batch_size=10000, seed=0):
+    """
+    Countries, cities spread over them and points of interest spread over the cities, inserted a level at a time.
+    Returns the ids of the countries and cities.
+    """
+    from triptuner.models import Destination
+
+    rng = random.Random(seed)
+    country_ids = [
+        destination.id
+        for destination in Destination.objects.bulk_create(
+            [Destination(name=f"Country {index}", type="country") for index in range(countries)]
+        )
+    ]
+    city_ids = []
+    for start in range(0, cities, batch_size):
+        created = Destination.objects.bulk_create(
+            [
+                Destination(name=f"City {index}", type="city", parent_id=rng.choice(country_ids))
+                for index in range(start, min(start + batch_size, cities))
+            ]
+        )
+        city_ids.extend(destination.id for destination in created)
+    for start in range(0, pois, batch_size):
+        Destination.objects.bulk_create(
+            [
+                Destination(
+                    name=f"Point of interest {index}",
+                    type="poi",
+                    parent_id=rng.choice(city_ids),
+                    latitude=round(rng.uniform(-60, 70), 6),
+                    longitude=round(rng.uniform(-180, 180), 6),
+                )
+                for index in range(start, min(start + batch_size, pois))
+            ]
+        )
+    return country_ids, city_ids
+
+
+def measure(client, paths, method="get"):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    latencies, queries = [], 0
+    for path, data in paths:
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data)
+            latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, (path, response.status_code)
+        queries += len(captured)
+    return {**summarize(latencies), "queries_per_request": queries / len(paths)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--countries", type=int, default=50)
+    parser.add_argument("--cities", type=int, default=5000)
+    parser.add_argument("--pois", type=int, default=2_000_000)
+    parser.add_argument("--itineraries", type=int, default=20_000)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--moves", type=int, default=50, help="cities moved to another country")
+    parser.add_argument("--keepdb", action="store_true", help="keep (and reuse) the seeded benchmark database")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from rest_framework.test import APIClient
+
+    from triptuner.models import Destination, DestinationClosure, Itinerary
+
+    total = args.countries + args.cities + args.pois
+    with benchmark_database(keepdb=args.keepdb):
+        if Destination.objects.count() != total or Itinerary.objects.count() != args.itineraries:
+            with connection.cursor() as cursor:
+                cursor.execute("TRUNCATE triptuner_itinerary, triptuner_destination CASCADE")
+            started = time.perf_counter()
+            seed_hierarchy(args.countries, args.cities, args.pois)
+            print(f"seeded {total} destinations in {time.perf_counter() - started:.1f}s")
+            seed_itineraries(args.itineraries, 5, 20)
+            # Vacuumed too, so subtrees are read with index-only scans
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM ANALYZE")
+        print(f"{DestinationClosure.objects.count()} closure rows")
+
+        country_ids = list(Destination.objects.filter(type="country").values_list("id", flat=True))
+        city_ids = list(Destination.objects.filter(type="city").values_list("id", flat=True))
+        poi_ids = Destination.objects.filter(type="poi").values_list("id", flat=True)
+        rng = random.Random(1)
+        sample = [poi_ids[rng.randrange(args.pois)] for _ in range(args.requests)]
+
+        client = APIClient()
+        scenarios = {
+            "within_country": [("/api/destinations/", {"within": rng.choice(country_ids)}) for _ in range(args.requests)],
+            "within_country_cities": [
+                ("/api/destinations/", {"within": rng.choice(country_ids), "type": "city"}) for _ in range(args.requests)
+            ],
+            "within_city": [("/api/destinations/", {"within": rng.choice(city_ids)}) for _ in range(args.requests)],
+            "ancestors": [(f"/api/destinations/{pk}/ancestors/", None) for pk in sample],
+            "itineraries_visiting_country": [
+                ("/api/itineraries/", {"visits": rng.choice(country_ids)}) for _ in range(args.requests)
+            ],
+            "itineraries_visiting_city": [
+                ("/api/itineraries/", {"visits": rng.choice(city_ids)}) for _ in range(args.requests)
+            ],
+        }
+        for name, paths in scenarios.items():
+            result = measure(client, paths)
+            print(
+                f"{name}: p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms, "
+                f"{result['queries_per_request']:.1f} queries/request"
+            )
+
+        client.force_authenticate(User.objects.get_or_create(username="benchmark", is_staff=True, is_superuser=True)[0])
+        moves = [
+            (f"/api/destinations/{rng.choice(city_ids)}/", {"parent": rng.choice(country_ids)}) for _ in range(args.moves)
+        ]
+        result = measure(client, moves, method="patch")
+        print(
+            f"move_city ({args.pois / args.cities:.0f} points of interest per city on average): "
+            f"p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
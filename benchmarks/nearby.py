@@ -0,0 +1,80 @@
+"""
+Latency of `/api/destinations/nearby/` over a large synthetic destination catalogue.
+
+    python -m benchmarks.nearby --destinations 1000000 --queries 500 --radius 25
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks import benchmark_database, setup_django, summarize
+
+
+def seed_destinations(count, batch_size=10000, seed=0):
+    from triptuner.models import Destination
+
+    rng = random.Random(seed)
+    types = ["country", "city", "poi"]
+    for start in range(0, count, batch_size):
+        Destination.objects.bulk_create(
+            [
+                Destination(
+                    name=f"Destination {index}",
+                    type=types[index % 3],
+                    latitude=round(rng.uniform(-60, 70), 6),
+                    longitude=round(rng.uniform(-180, 180), 6),
+                )
+                for index in range(start, min(start + batch_size, count))
+            ]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--destinations", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--radius", type=float, default=25, help="search radius in km")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--keepdb", action="store_true", help="keep (and reuse) the seeded benchmark database")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.test import Client
+
+    from triptuner.models import Destination
+
+    with benchmark_database(keepdb=args.keepdb):
+        if Destination.objects.count() != args.destinations:
+            Destination.objects.all().delete()
+            started = time.perf_counter()
+            seed_destinations(args.destinations)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE triptuner_destination")
+            print(f"seeded {args.destinations} destinations in {time.perf_counter() - started:.1f}s")
+
+        client = Client()
+        rng = random.Random(1)
+        latencies, results = [], 0
+        for _ in range(args.queries):
+            params = {
+                "lat": rng.uniform(-60, 70),
+                "lon": rng.uniform(-180, 180),
+                "radius_km": args.radius,
+                "limit": args.limit,
+            }
+            started = time.perf_counter()
+            response = client.get("/api/destinations/nearby/", query_params=params)
+            latencies.append(time.perf_counter() - started)
+            results += len(response.json())
+
+        summary = summarize(latencies)
+        print(
+            f"{args.queries} nearby queries, radius {args.radius}km, {results / args.queries:.1f} results on average: "
+            f"p50 {summary['p50_ms']:.1f}ms, p95 {summary['p95_ms']:.1f}ms, p99 {summary['p99_ms']:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
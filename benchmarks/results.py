@@ -0,0 +1,92 @@
+"""
+Save benchmark results as JSON, and compare a run against a baseline.
+
+A scenario regresses when its p95 latency grows, or its throughput drops, by more than the tolerance, or when it
+makes more database queries per request than the baseline.
+
+    python -m benchmarks.results baseline.json current.json --tolerance 0.2
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, parameters, scenarios):
+    results = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": parameters,
+        "scenarios": scenarios,
+    }
+    with open(path, "w") as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+        output.write("\n")
+    return results
+
+
+def load_results(path):
+    with open(path) as results:
+        return json.load(results)
+
+
+def compare_results(baseline, current, tolerance=0.2):
+    """
+    Lines comparing the scenarios of two runs, and the regressions found
+    """
+    lines, regressions = [], []
+    for name, result in sorted(current["scenarios"].items()):
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            lines.append(f"{name}: new scenario")
+            continue
+
+        lines.append(
+            f"{name}: p95 {base['p95_ms']:.1f} -> {result['p95_ms']:.1f}ms, "
+            f"{base['throughput_rps']:.0f} -> {result['throughput_rps']:.0f} req/s, "
+            f"{base['queries_per_request']:.1f} -> {result['queries_per_request']:.1f} queries/request"
+        )
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 latency up {result['p95_ms'] / base['p95_ms'] - 1:.0%}")
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput down {1 - result['throughput_rps'] / base['throughput_rps']:.0%}")
+        if result["queries_per_request"] > base["queries_per_request"]:
+            regressions.append(f"{name}: more queries per request")
+    return lines, regressions
+
+
+def gate(baseline, current, tolerance):
+    """
+    Print the comparison, and exit with status 1 if anything regressed
+    """
+    lines, regressions = compare_results(baseline, current, tolerance)
+    print("\n".join(lines))
+    if regressions:
+        print("\nRegressions:\n" + "\n".join(f"  {regression}" for regression in regressions))
+        sys.exit(1)
+    print(f"\nNo regressions (tolerance {tolerance:.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change in latency/throughput")
+    args = parser.parse_args()
+
+    gate(load_results(args.baseline), load_results(args.current), args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
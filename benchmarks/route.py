@@ -0,0 +1,63 @@
+"""
+Speed and quality of the itinerary route optimizer on synthetic stops.
+
+Each size is solved for random stops in a 1000km box. Route lengths are compared with the nearest-neighbour
+route, and the heuristic is compared with the exact solver on 12 stops.
+
+    python -m benchmarks.route --sizes 8 12 50 200 500 --runs 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks import setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8, 12, 50, 200, 500])
+    parser.add_argument("--runs", type=int, default=5, help="random instances per size")
+    parser.add_argument("--time-budget", type=float, default=0.5, help="seconds for the heuristic")
+    args = parser.parse_args()
+
+    setup_django()
+    from triptuner.geo import haversine_matrix
+    from triptuner.routing import nearest_neighbour, optimize_route, route_length
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        latencies, versus_nearest = [], []
+        for _ in range(args.runs):
+            latitudes, longitudes = rng.uniform(40, 49, size), rng.uniform(0, 12, size)
+            started = time.perf_counter()
+            distances = haversine_matrix(latitudes, longitudes)
+            route, method = optimize_route(distances, time_budget=args.time_budget)
+            latencies.append(time.perf_counter() - started)
+
+            length = route_length(distances, route)
+            versus_nearest.append(length / route_length(distances, nearest_neighbour(distances, 0)))
+
+        summary = summarize(latencies)
+        print(
+            f"{size} stops ({method}): p50 {summary['p50_ms']:.1f}ms, p95 {summary['p95_ms']:.1f}ms, "
+            f"{(1 - np.mean(versus_nearest)) * 100:.1f}% shorter than nearest neighbour"
+        )
+
+    # Heuristic against the optimum on sizes both can solve
+    gaps = []
+    for _ in range(args.runs * 4):
+        latitudes, longitudes = rng.uniform(40, 49, 12), rng.uniform(0, 12, 12)
+        distances = haversine_matrix(latitudes, longitudes)
+        exact, _ = optimize_route(distances)
+        heuristic, _ = optimize_route(distances, exact_max_stops=0, time_budget=args.time_budget)
+        gaps.append(route_length(distances, heuristic) / route_length(distances, exact) - 1)
+    print(
+        f"heuristic on 12 stops: {np.mean(gaps) * 100:.2f}% longer than the optimum on average, "
+        f"{np.mean(np.array(gaps) < 1e-9) * 100:.0f}% optimal"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Speed of the read-only fast path of list views (`FastListMixin` in triptuner/views.py) against the serializers.
+
+Seeds destinations and itineraries, then turns the same rows into JSON both ways: model instances through the
+serializer and `JSONRenderer`, and `.values()` rows through `destination_rows`/`itinerary_rows` and orjson. Each
+timing includes fetching the rows (and the stops of the itineraries). The outputs are checked to be identical.
+
+    python -m benchmarks.serialization --rows 10000 --repeat 5
+"""
+
+import argparse
+import time
+
+from benchmarks import benchmark_database, setup_django
+from benchmarks.api import seed_itineraries
+from benchmarks.nearby import seed_destinations
+
+
+def fast_values(viewset):
+    """
+    The page query of the list of the viewset, without the paginator
+    """
+    return viewset.queryset.order_by("id").values(*viewset.fast_list_values, **viewset.fast_list_expressions)
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000, help="destinations and itineraries serialized")
+    parser.add_argument("--min-stops", type=int, default=5)
+    parser.add_argument("--max-stops", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db.models import Prefetch
+    from rest_framework.renderers import JSONRenderer
+
+    from triptuner.models import Destination, Itinerary, ItineraryDestination
+    from triptuner.renderers import render_json
+    from triptuner.serializers import DestinationSerializer, ItinerarySerializer, destination_rows, itinerary_rows
+    from triptuner.views import DestinationViewSet, ItineraryViewSet
+
+    with benchmark_database():
+        seed_destinations(args.rows)
+        seed_itineraries(args.rows, args.min_stops, args.max_stops)
+        stops = Prefetch("itinerarydestination_set", queryset=ItineraryDestination.objects.order_by("visit_order"))
+
+        cases = {
+            "destinations": (
+                lambda: JSONRenderer().render(DestinationSerializer(Destination.objects.order_by("id"), many=True).data),
+                lambda: render_json(destination_rows(fast_values(DestinationViewSet))),
+            ),
+            "itineraries": (
+                lambda: JSONRenderer().render(
+                    ItinerarySerializer(Itinerary.objects.order_by("id").prefetch_related(stops), many=True).data
+                ),
+                lambda: render_json(itinerary_rows(fast_values(ItineraryViewSet))),
+            ),
+        }
+        for name, (serialize, fast_path) in cases.items():
+            serializer_time, expected = best_time(serialize, args.repeat)
+            fast_time, output = best_time(fast_path, args.repeat)
+            if output != expected:
+                raise SystemExit(f"{name}: the fast path rendered different JSON")
+            print(
+                f"{name}: {args.rows} rows, {len(output) / 1e6:.1f}MB, serializer {serializer_time * 1000:.0f}ms, "
+                f"fast path {fast_time * 1000:.0f}ms, {serializer_time / fast_time:.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
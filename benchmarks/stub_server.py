@@ -0,0 +1,104 @@
+"""
+Local stand-in for the Open-Meteo forecast API, with injected latency.
+
+The stub runs in its own process, so its CPU use does not compete with the client being benchmarked.
+"""
+
+import json
+import multiprocessing
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def forecast_payload(latitude, longitude, hours=168):
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "hourly": {
+            "time": [f"2024-09-{20 + hour // 24:02d}T{hour % 24:02d}:00" for hour in range(hours)],
+            "temperature_2m": [round(15 + (hour % 24) / 2, 1) for hour in range(hours)],
+        },
+    }
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 would make the stub, not the client, the bottleneck
+    request_queue_size = 1024
+
+
+def _serve(host, port, latency, request_count):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, avoid delayed-ACK stalls on keep-alive connections
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            with request_count.get_lock():
+                request_count.value += 1
+            time.sleep(latency)
+            query = parse_qs(urlparse(self.path).query)
+            latitudes = query.get("latitude", ["0"])[0].split(",")
+            longitudes = query.get("longitude", ["0"])[0].split(",")
+            payloads = [forecast_payload(float(lat), float(lon)) for lat, lon in zip(latitudes, longitudes)]
+            body = json.dumps(payloads[0] if len(payloads) == 1 else payloads).encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _Server((host, port), Handler).serve_forever()
+
+
+class StubForecastServer:
+    """
+    Serve fake forecasts from a child process, e.g.
+
+        with StubForecastServer(latency=0.1) as server:
+            requests.get(server.url, params={"latitude": 1, "longitude": 2})
+    """
+
+    def __init__(self, latency=0.05, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.host = host
+        self.port = port or self._free_port(host)
+        self._request_count = multiprocessing.Value("i", 0)
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.host, self.port, latency, self._request_count), daemon=True
+        )
+
+    @staticmethod
+    def _free_port(host):
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+            return sock.getsockname()[1]
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v1/forecast"
+
+    @property
+    def requests(self):
+        return self._request_count.value
+
+    def __enter__(self):
+        self._process.start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((self.host, self.port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.02)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        self._process.join()
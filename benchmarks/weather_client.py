@@ -0,0 +1,85 @@
+"""
+Compare the blocking and async Open-Meteo fetch paths against a local stub server.
+
+The sync path is what a WSGI worker does: one blocking `requests` call per thread. The async path keeps
+every lookup in flight on one event loop through the shared `aiohttp` pool.
+
+    python -m benchmarks.weather_client --requests 1000 --latency 0.1 --threads 16
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import setup_django, summarize
+from benchmarks.stub_server import StubForecastServer
+
+
+def report(name, wall_time, latencies):
+    summary = summarize(latencies)
+    print(
+        f"{name:>6}: {len(latencies)} lookups in {wall_time:.2f}s "
+        f"({len(latencies) / wall_time:.0f} req/s), "
+        f"p50 {summary['p50_ms']:.0f}ms, p95 {summary['p95_ms']:.0f}ms"
+    )
+
+
+def locations(count):
+    return [(round(-60 + (index * 0.37) % 120, 2), round(-170 + (index * 0.73) % 340, 2)) for index in range(count)]
+
+
+def run_sync(url, count, threads):
+    from triptuner.weather import fetch_forecast
+
+    def timed(location):
+        started = time.perf_counter()
+        fetch_forecast(*location, url=url)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(timed, locations(count)))
+    report("sync", time.perf_counter() - started, latencies)
+
+
+def run_async(url, count, concurrency):
+    from triptuner.weather_client import AsyncWeatherClient
+
+    client = AsyncWeatherClient(url=url, max_connections=concurrency, max_concurrency=concurrency)
+
+    async def timed(location):
+        started = time.perf_counter()
+        await client.get({"latitude": location[0], "longitude": location[1], "hourly": "temperature_2m"})
+        return time.perf_counter() - started
+
+    async def run():
+        try:
+            return await asyncio.gather(*(timed(location) for location in locations(count)))
+        finally:
+            await client.aclose()
+
+    started = time.perf_counter()
+    latencies = asyncio.run(run())
+    report("async", time.perf_counter() - started, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="number of forecast lookups")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds of latency injected by the stub")
+    parser.add_argument("--threads", type=int, default=16, help="worker threads for the sync path")
+    parser.add_argument("--concurrency", type=int, default=100, help="in-flight requests for the async path")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test.utils import override_settings
+
+    # Measure the clients, not the upstream rate limit
+    with StubForecastServer(latency=args.latency) as server, override_settings(WEATHER_UPSTREAM={"RATE": None}):
+        run_sync(server.url, args.requests, args.threads)
+        run_async(server.url, args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
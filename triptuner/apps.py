@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class TriptunerConfig(AppConfig):
+    name = "triptuner"
+
+    def ready(self):
+        from triptuner import checks  # noqa: F401
+        from triptuner.auth import connect_signals
+
+        connect_signals()
@@ -0,0 +1,195 @@
+"""
+Authentication and permission checks served from the Django cache.
+
+Token authentication (`Authorization: Token <key>`) resolves the token to its user, and the model backend resolves
+the user's permissions (their own and their groups'), from entries in the cache, so a request on a warm cache makes
+no queries for authentication or `DjangoModelPermissions` checks. Users loaded by session authentication come from
+the same user cache, though the session itself is still read.
+
+Entries are dropped by signal handlers when a user, group, permission or token changes. Changes to groups and
+permissions may affect many users, so they bump a version shared by all permission entries instead.
+
+Users are cached as the few fields authentication and permission checks read, and the session auth hash (an HMAC
+of the password hash) that session authentication compares, never as pickled model instances with their password.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+DEFAULT_AUTH_CACHE_SETTINGS = {
+    "CACHE_ALIAS": "default",
+    "TIMEOUT": 5 * 60,
+}
+
+PERMISSIONS_VERSION_KEY = "auth:permissions:version"
+
+
+def auth_cache_settings():
+    return {**DEFAULT_AUTH_CACHE_SETTINGS, **getattr(settings, "AUTH_CACHE", {})}
+
+
+def auth_cache():
+    return caches[auth_cache_settings()["CACHE_ALIAS"]]
+
+
+def token_key(key):
+    # Tokens are credentials, keep them out of cache keys
+    return f"auth:token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def user_key(user_id):
+    return f"auth:user-fields:{user_id}"
+
+
+def permissions_key(user_id, version):
+    return f"auth:permissions:{version}:{user_id}"
+
+
+def permissions_version(backend):
+    version = backend.get(PERMISSIONS_VERSION_KEY)
+    if version is None:
+        backend.add(PERMISSIONS_VERSION_KEY, 1, timeout=None)
+        version = backend.get(PERMISSIONS_VERSION_KEY, 1)
+    return version
+
+
+def cached_fields(user_model):
+    """
+    The fields of users kept in the cache, in the order of the model's fields
+    """
+    names = {user_model._meta.pk.attname, user_model.USERNAME_FIELD, "is_active", "is_staff", "is_superuser"}
+    return [field.attname for field in user_model._meta.concrete_fields if field.attname in names]
+
+
+def user_entry(user):
+    fields = {name: getattr(user, name) for name in cached_fields(type(user))}
+    return {"fields": fields, "session_auth_hash": user.get_session_auth_hash()}
+
+
+def entry_user(entry):
+    """
+    The user of a cache entry. Its other fields are deferred: they are loaded from the database when read, and
+    left out when it is saved.
+    """
+    fields, session_auth_hash = entry["fields"], entry["session_auth_hash"]
+    user = get_user_model().from_db(None, list(fields), list(fields.values()))
+    # Computed from the password when the entry was cached. Fallback hashes are still computed from the password,
+    # which is then loaded.
+    user.get_session_auth_hash = lambda: session_auth_hash
+    return user
+
+
+def cached_user(user_id):
+    """
+    The user with this id, from the cache or the database, or None
+    """
+    backend = auth_cache()
+    entry = backend.get(user_key(user_id))
+    if entry is not None:
+        return entry_user(entry)
+    user = get_user_model()._default_manager.filter(pk=user_id).first()
+    if user is not None:
+        backend.set(user_key(user_id), user_entry(user), timeout=auth_cache_settings()["TIMEOUT"])
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    DRF token authentication, resolving tokens to users through the cache
+    """
+
+    def authenticate_credentials(self, key):
+        backend = auth_cache()
+        cached = backend.get(token_key(key))
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            timeout = auth_cache_settings()["TIMEOUT"]
+            backend.set_many(
+                {token_key(key): (user.pk, token.created), user_key(user.pk): user_entry(user)}, timeout=timeout
+            )
+            return user, token
+
+        user_id, created = cached
+        user = cached_user(user_id)
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        return user, Token(key=key, user=user, created=created)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    `ModelBackend` with users and their permission sets kept in the cache
+    """
+
+    def get_user(self, user_id):
+        user = cached_user(user_id)
+        return user if self.user_can_authenticate(user) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, "_perm_cache"):
+            backend = auth_cache()
+            key = permissions_key(user_obj.pk, permissions_version(backend))
+            permissions = backend.get(key)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                backend.set(key, permissions, timeout=auth_cache_settings()["TIMEOUT"])
+            user_obj._perm_cache = permissions
+        return user_obj._perm_cache
+
+
+def forget_user(user_id):
+    backend = auth_cache()
+    backend.delete_many([user_key(user_id), permissions_key(user_id, permissions_version(backend))])
+
+
+def forget_all_permissions():
+    backend = auth_cache()
+    try:
+        backend.incr(PERMISSIONS_VERSION_KEY)
+    except ValueError:
+        # No version yet, so nothing was cached under it
+        pass
+
+
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+def token_deleted(sender, instance, **kwargs):
+    auth_cache().delete(token_key(instance.key))
+
+
+def permissions_changed(sender, instance, action=None, **kwargs):
+    """
+    Drop the permissions affected by a change of the groups or permissions of a user or group (`m2m_changed`), or
+    by a group or permission being saved or deleted
+    """
+    if action is not None and not action.startswith("post_"):
+        return
+    if isinstance(instance, get_user_model()):
+        forget_user(instance.pk)
+    else:
+        forget_all_permissions()
+
+
+def connect_signals():
+    user_model = get_user_model()
+    post_save.connect(user_changed, sender=user_model, dispatch_uid="auth_cache_user_saved")
+    post_delete.connect(user_changed, sender=user_model, dispatch_uid="auth_cache_user_deleted")
+    post_delete.connect(token_deleted, sender=Token, dispatch_uid="auth_cache_token_deleted")
+    post_save.connect(permissions_changed, sender=Permission, dispatch_uid="auth_cache_permission_saved")
+    for model in (Group, Permission):
+        post_delete.connect(permissions_changed, sender=model, dispatch_uid=f"auth_cache_{model.__name__}_deleted")
+    for through in (user_model.groups.through, user_model.user_permissions.through, Group.permissions.through):
+        m2m_changed.connect(permissions_changed, sender=through, dispatch_uid=f"auth_cache_{through.__name__}_changed")
@@ -0,0 +1,504 @@
+"""
+Bulk import and export of the destination catalogue.
+
+Imports read CSV, NDJSON or GeoJSON (a FeatureCollection, or one Feature per line) as a stream, validate the rows a
+chunk at a time, and write each chunk with Postgres `COPY` into a temporary staging table, from which
+`INSERT ... ON CONFLICT` statements upsert it on `external_id`. Rows without an `external_id` are always inserted,
+and rows that didn't change are left alone, so re-importing a catalogue doesn't touch their `updated_at`. Only one
+chunk is held in memory, whatever the size of the input. Invalid rows are skipped and reported; a file that can't be
+parsed rolls back the whole import.
+
+Parents are referenced by `parent_external_id`, and resolved in the upsert, one level of the hierarchy per
+statement, so parents may come after their children in the file. Rows still waiting for their parent are carried
+over to the next chunk, and reported as invalid if it never turns up (or is of a narrower type, or one of their own
+descendants). Rows without the column keep their current parent, so catalogues exported before it existed can
+still be imported. The closure table of the hierarchy is kept up to date by its triggers.
+
+Exports write the same columns in the same formats (plus `id`), reading rows with a server-side cursor, so an
+export can be imported again.
+"""
+
+import csv
+import io
+import json
+import os
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, connection, transaction
+
+from triptuner.models import Destination, DestinationClosure
+
+FORMATS = ("csv", "ndjson", "geojson")
+CONTENT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", "geojson": "application/geo+json"}
+EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".geojson": "geojson", ".json": "geojson"}
+COLUMNS = ["external_id", "name", "description", "type", "latitude", "longitude", "parent_external_id"]
+# Columns of the destination table, written as they are
+DESTINATION_COLUMNS = COLUMNS[:-1]
+TYPES = {choice for choice, _ in Destination.DESTINATION_TYPE_CHOICES}
+COORDINATE_PLACES = Decimal("0.000001")
+
+CHUNK_SIZE = 50000
+# Errors listed in the summary of an import, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+STAGING_TABLE = "triptuner_destination_import"
+# Key of the records of GeoJSON features without a point geometry
+GEOMETRY_ERROR = "_geometry_error"
+
+
+def guess_format(filename):
+    """
+    The import format of a file name by its extension. Raises ValueError for unknown extensions.
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(f"Unknown file format, use one of: {', '.join(FORMATS)}")
+    return EXTENSIONS[extension]
+
+
+def read_csv(stream):
+    yield from csv.DictReader(stream)
+
+
+def read_ndjson(stream):
+    for number, line in enumerate(stream, start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON on line {number}: {e}")
+
+
+class JSONStream:
+    """
+    Incremental reader of JSON values from a text stream, refilling its buffer as values are decoded
+    """
+
+    WHITESPACE = " \t\r\n\x1e"  # and the record separator of GeoJSON text sequences
+
+    def __init__(self, stream, read_size=1 << 16):
+        self.stream = stream
+        self.read_size = read_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        data = self.stream.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        start = self.position
+        self.buffer = self.buffer[start:] + data
+        self.position = 0
+        return True
+
+    def peek(self):
+        """
+        The next character that isn't whitespace, or "" at the end of the stream
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in self.WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer) or not self.fill():
+                start, end = self.position, self.position + 1
+                return self.buffer[start:end]
+
+    def expect(self, characters):
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(f"Invalid JSON: expected {' or '.join(characters)}, found {character or 'end of file'}")
+        self.position += 1
+        return character
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as e:
+                if self.fill():
+                    continue
+                raise ValueError(f"Invalid JSON: {e}")
+            # A number (or literal) running up to the end of the buffer may continue after it
+            if end == len(self.buffer) and not self.eof and self.fill():
+                continue
+            self.position = end
+            return value
+
+
+def read_geojson(stream, read_size=1 << 16):
+    """
+    Features of GeoJSON FeatureCollections or Features. Top-level objects are read key by key, and the items of a
+    `features` array one at a time, so a collection is never loaded whole.
+    """
+    reader = JSONStream(stream, read_size)
+    while reader.peek():
+        reader.expect("{")
+        value = {}
+        if reader.peek() == "}":
+            reader.expect("}")
+        else:
+            while True:
+                key = reader.decode()
+                reader.expect(":")
+                if key == "features" and reader.peek() == "[":
+                    reader.expect("[")
+                    if reader.peek() == "]":
+                        reader.expect("]")
+                    else:
+                        while True:
+                            yield reader.decode()
+                            if reader.expect(",]") == "]":
+                                break
+                else:
+                    value[key] = reader.decode()
+                if reader.expect(",}") == "}":
+                    break
+        if value.get("type") == "Feature":
+            yield value
+
+
+def geojson_record(feature):
+    if not isinstance(feature, dict):
+        return {}
+    properties = feature.get("properties") or {}
+    geometry = feature.get("geometry") or {}
+    record = {**properties, "latitude": None, "longitude": None}
+    if "external_id" not in record and feature.get("id") is not None:
+        record["external_id"] = feature["id"]
+    if geometry:
+        coordinates = geometry.get("coordinates")
+        if geometry.get("type") != "Point" or not isinstance(coordinates, list) or len(coordinates) < 2:
+            record[GEOMETRY_ERROR] = "Only Point geometries are supported."
+        else:
+            record["longitude"], record["latitude"] = coordinates[:2]
+    return record
+
+
+READERS = {
+    "csv": read_csv,
+    "ndjson": read_ndjson,
+    "geojson": lambda stream: (geojson_record(feature) for feature in read_geojson(stream)),
+}
+
+
+def clean_coordinate(value, limit):
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError
+    coordinate = Decimal(str(value).strip()).quantize(COORDINATE_PLACES)
+    if not -limit <= coordinate <= limit:
+        raise ValueError
+    return coordinate
+
+
+def clean_record(record):
+    """
+    A row of COLUMNS values for an input record, or raises ValueError with the problems found
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Expected an object.")
+    errors = []
+    if GEOMETRY_ERROR in record:
+        errors.append(record[GEOMETRY_ERROR])
+
+    name = record.get("name")
+    name = "" if name is None else str(name).strip()
+    if not name or len(name) > 255:
+        errors.append("name is required, and at most 255 characters.")
+    description = record.get("description")
+    description = "" if description is None else str(description)
+    if record.get("type") not in TYPES:
+        errors.append(f"type must be one of: {', '.join(sorted(TYPES))}.")
+    external_id = clean_external_id(record.get("external_id"))
+    if external_id is not None and len(external_id) > 255:
+        errors.append("external_id is at most 255 characters.")
+    parent_external_id = clean_external_id(record.get("parent_external_id"))
+    if parent_external_id is not None and len(parent_external_id) > 255:
+        errors.append("parent_external_id is at most 255 characters.")
+    elif parent_external_id is not None and parent_external_id == external_id:
+        errors.append("A destination can not be inside itself.")
+
+    coordinates = []
+    for field, limit in (("latitude", 90), ("longitude", 180)):
+        try:
+            coordinates.append(clean_coordinate(record.get(field), limit))
+        except (ValueError, InvalidOperation):
+            errors.append(f"{field} must be a number between -{limit} and {limit}.")
+    if len(coordinates) == 2 and (coordinates[0] is None) != (coordinates[1] is None):
+        errors.append("latitude and longitude must be given together.")
+
+    if errors:
+        raise ValueError(" ".join(errors))
+    return (external_id, name, description, record["type"], *coordinates, parent_external_id, "parent_external_id" in record)
+
+
+def clean_external_id(value):
+    return None if value is None or value == "" else str(value)
+
+
+# Staged rows: their row number in the input, the COLUMNS values, and whether the input had a parent_external_id
+STAGING_COLUMNS = ["row_number", *COLUMNS, "has_parent"]
+
+
+def create_staging_table(cursor):
+    cursor.execute(
+        f"""
+        CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} (
+            row_number bigint NOT NULL,
+            external_id varchar(255),
+            name varchar(255) NOT NULL,
+            description text NOT NULL,
+            type varchar(10) NOT NULL,
+            latitude numeric(9, 6),
+            longitude numeric(9, 6),
+            parent_external_id varchar(255),
+            has_parent boolean NOT NULL
+        ) ON COMMIT DROP
+        """
+    )
+    # Left over from an earlier import in the same (outer) transaction
+    cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+
+
+def type_level_sql(column):
+    """
+    The level of the destination type in `column`, from 1 for the broadest (see `DestinationSerializer.type_levels`)
+    """
+    types = ", ".join(f"'{choice}'" for choice, _ in Destination.DESTINATION_TYPE_CHOICES)
+    return f"array_position(ARRAY[{types}]::varchar[], {column})"
+
+
+def parent_sql(staged):
+    """
+    The condition on the parent of the staged row `staged`, found as `parent`: of a broader or the same type, and
+    not the staged destination itself or one of its descendants
+    """
+    table, closure = Destination._meta.db_table, DestinationClosure._meta.db_table
+    return f"""
+        parent.external_id = {staged}.parent_external_id
+        AND {type_level_sql("parent.type")} <= {type_level_sql(f"{staged}.type")}
+        AND NOT EXISTS (
+            SELECT FROM {closure} AS closure JOIN {table} AS existing ON existing.id = closure.ancestor_id
+            WHERE existing.external_id = {staged}.external_id AND closure.descendant_id = parent.id
+        )
+    """
+
+
+def upsert_sql(with_parent):
+    """
+    Upsert the staged rows that are ready, taking them out of the staging table. Rows without a parent_external_id
+    column (`with_parent` false) keep their current parent. The others are ready once their parent, if any, exists.
+    Returns the number of rows inserted, updated, and taken.
+    """
+    table = Destination._meta.db_table
+    columns = [*DESTINATION_COLUMNS, "parent_id"] if with_parent else DESTINATION_COLUMNS
+    changed = ", ".join(column for column in columns if column != "external_id")
+    excluded = ", ".join(f"EXCLUDED.{column}" for column in columns if column != "external_id")
+    current = ", ".join(f"destination.{column}" for column in columns if column != "external_id")
+    if with_parent:
+        ready = f"""
+            has_parent AND (
+                parent_external_id IS NULL
+                OR EXISTS (SELECT FROM {table} AS parent WHERE {parent_sql(STAGING_TABLE)})
+            )
+        """
+        values = ", ".join(f"ready.{column}" for column in DESTINATION_COLUMNS) + ", parent.id"
+        source = f"ready LEFT JOIN {table} AS parent ON parent.external_id = ready.parent_external_id"
+    else:
+        ready = "NOT has_parent"
+        values = ", ".join(DESTINATION_COLUMNS)
+        source = "ready"
+    return f"""
+        WITH ready AS (
+            DELETE FROM {STAGING_TABLE} WHERE {ready} RETURNING *
+        ), upserted AS (
+            INSERT INTO {table} AS destination ({", ".join(columns)}, updated_at)
+            SELECT {values}, now() FROM {source}
+            ON CONFLICT (external_id) DO UPDATE SET ({changed}, updated_at) = ({excluded}, EXCLUDED.updated_at)
+            WHERE ({current}) IS DISTINCT FROM ({excluded})
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT
+            count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted), (SELECT count(*) FROM ready)
+        FROM upserted
+    """
+
+
+def write_chunk(cursor, rows):
+    """
+    Upsert rows of STAGING_COLUMNS values through the staging table, along with the rows carried over from previous
+    chunks that now have their parent. Returns the number of rows inserted and updated.
+    """
+    with cursor.copy(f"COPY {STAGING_TABLE} ({', '.join(STAGING_COLUMNS)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+    # Carried over rows are replaced by later rows of their external_id
+    cursor.execute(
+        f"""
+        DELETE FROM {STAGING_TABLE} AS earlier USING {STAGING_TABLE} AS later
+        WHERE later.external_id = earlier.external_id AND later.row_number > earlier.row_number
+        """
+    )
+
+    cursor.execute(upsert_sql(with_parent=False))
+    inserted, updated, _ = cursor.fetchone()
+    # A level of the hierarchy at a time, until no row is left whose parent exists
+    while True:
+        cursor.execute(upsert_sql(with_parent=True))
+        level_inserted, level_updated, taken = cursor.fetchone()
+        inserted, updated = inserted + level_inserted, updated + level_updated
+        if not taken:
+            return inserted, updated
+
+
+def orphan_errors(cursor):
+    """
+    The row numbers and errors of the rows left in the staging table, whose parent was not found
+    """
+    table = Destination._meta.db_table
+    cursor.execute(
+        f"""
+        SELECT staged.row_number, staged.parent_external_id, staged.type, parent.type
+        FROM {STAGING_TABLE} AS staged LEFT JOIN {table} AS parent ON parent.external_id = staged.parent_external_id
+        ORDER BY staged.row_number
+        """
+    )
+    levels = {choice: level for level, (choice, _) in enumerate(Destination.DESTINATION_TYPE_CHOICES)}
+    for number, parent_external_id, destination_type, parent_type in cursor:
+        if parent_type is None:
+            error = f"parent_external_id {parent_external_id} does not match any destination."
+        elif levels[parent_type] > levels[destination_type]:
+            error = f"A {destination_type} can not be inside a {parent_type}."
+        else:
+            error = "A destination can not be inside itself or its descendants."
+        yield number, error
+
+
+def report_error(summary, number, error):
+    summary["invalid"] += 1
+    if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+        summary["errors"].append(f"Row {number}: {error}")
+
+
+def chunk_rows(records, summary, chunk_size):
+    """
+    The rows of the valid records, with their row number, as chunks of at most `chunk_size` rows. Errors are added
+    to `summary`. Within a chunk the last row of an `external_id` wins, as one statement can't upsert a row twice.
+    """
+    identified, anonymous = {}, []
+    for number, record in enumerate(records, start=1):
+        summary["rows"] += 1
+        try:
+            row = (number, *clean_record(record))
+        except ValueError as e:
+            report_error(summary, number, e)
+            continue
+
+        external_id = row[1]
+        if external_id is None:
+            anonymous.append(row)
+        else:
+            identified.pop(external_id, None)
+            identified[external_id] = row
+        if len(identified) + len(anonymous) >= chunk_size:
+            yield [*identified.values(), *anonymous]
+            identified, anonymous = {}, []
+    if identified or anonymous:
+        yield [*identified.values(), *anonymous]
+
+
+def import_destinations(stream, file_format, chunk_size=CHUNK_SIZE):
+    """
+    Import destinations from a text stream in one of FORMATS, in a single transaction.
+    Returns a summary with the number of rows read, inserted, updated, unchanged and invalid, and the first errors.
+    Raises ValueError if the input can't be parsed, in which case nothing is imported.
+    """
+    if file_format not in READERS:
+        raise ValueError(f"Unknown file format, use one of: {', '.join(FORMATS)}")
+    summary = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "invalid": 0, "errors": []}
+
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            create_staging_table(cursor)
+            for rows in chunk_rows(READERS[file_format](stream), summary, chunk_size):
+                inserted, updated = write_chunk(cursor, rows)
+                summary["inserted"] += inserted
+                summary["updated"] += updated
+            for number, error in orphan_errors(cursor):
+                report_error(summary, number, error)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid {file_format} file: {e}")
+    except IntegrityError as e:
+        # Moves that are valid one by one can still make a cycle together, which the closure triggers reject
+        raise ValueError(f"Invalid parents: {str(e).splitlines()[0]}")
+
+    summary["unchanged"] = summary["rows"] - summary["invalid"] - summary["inserted"] - summary["updated"]
+    return summary
+
+
+EXPORT_COLUMNS = ["id", *COLUMNS]
+# Fields of the export columns. Parents without an external_id are exported without parent_external_id.
+EXPORT_FIELDS = ["id", *DESTINATION_COLUMNS, "parent__external_id"]
+
+
+def export_record(row):
+    record = dict(zip(EXPORT_COLUMNS, row))
+    for field in ("latitude", "longitude"):
+        if record[field] is not None:
+            record[field] = float(record[field])
+    return record
+
+
+def export_feature(row):
+    record = export_record(row)
+    latitude, longitude = record.pop("latitude"), record.pop("longitude")
+    geometry = None if latitude is None else {"type": "Point", "coordinates": [longitude, latitude]}
+    return {"type": "Feature", "geometry": geometry, "properties": record}
+
+
+def dump_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def export_lines(queryset, file_format, chunk_size=2000):
+    """
+    The destinations of `queryset` in one of FORMATS, as chunks of text
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown file format, use one of: {', '.join(FORMATS)}")
+    rows = queryset.order_by("id").values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+    if file_format == "geojson":
+        yield '{"type":"FeatureCollection","features":['
+    elif file_format == "csv":
+        yield ",".join(EXPORT_COLUMNS) + "\r\n"
+
+    chunk, first = [], True
+    for row in rows:
+        if file_format == "csv":
+            chunk.append(row)
+        elif file_format == "ndjson":
+            chunk.append(dump_json(export_record(row)) + "\n")
+        else:
+            chunk.append(("\n" if first else ",\n") + dump_json(export_feature(row)))
+            first = False
+        if len(chunk) == chunk_size:
+            yield render_chunk(chunk, file_format)
+            chunk = []
+    if chunk:
+        yield render_chunk(chunk, file_format)
+
+    if file_format == "geojson":
+        yield "\n]}\n"
+
+
+def render_chunk(chunk, file_format):
+    if file_format != "csv":
+        return "".join(chunk)
+    output = io.StringIO()
+    csv.writer(output).writerows(chunk)
+    return output.getvalue()
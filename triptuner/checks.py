@@ -0,0 +1,42 @@
+"""
+System checks of the settings the app relies on.
+"""
+
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from triptuner.auth import auth_cache_settings
+from triptuner.weather import cache_settings
+from triptuner.weather_client import upstream_settings
+
+# Cache backends that keep their entries in each process
+PER_PROCESS_CACHE_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+@register(Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    """
+    Forecasts, single-flight locks, the Open-Meteo rate limit and circuit breaker, and cached users are shared
+    between workers through the cache, which a per-process backend doesn't do. Fine for development, so only
+    checked with DEBUG off.
+    """
+    if settings.DEBUG:
+        return []
+    aliases = {
+        "WEATHER_FORECAST_CACHE": cache_settings()["CACHE_ALIAS"],
+        "WEATHER_UPSTREAM": upstream_settings()["CACHE_ALIAS"],
+        "AUTH_CACHE": auth_cache_settings()["CACHE_ALIAS"],
+    }
+    return [
+        Warning(
+            f"{setting} uses the {alias!r} cache, whose backend {settings.CACHES[alias]['BACKEND']} is not shared "
+            "between processes.",
+            hint="Set REDIS_URL, or use another shared backend (e.g. the database cache) for this alias.",
+            id="triptuner.W001",
+        )
+        for setting, alias in aliases.items()
+        if settings.CACHES.get(alias, {}).get("BACKEND") in PER_PROCESS_CACHE_BACKENDS
+    ]
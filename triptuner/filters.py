@@ -0,0 +1,187 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+from triptuner.geo import box_expression, box_overlaps
+from triptuner.models import DestinationClosure, ItineraryDestination
+
+
+class DestinationSearchFilter(BaseFilterBackend):
+    """
+    Ranked `?q=` search over destination names and descriptions.
+
+    Matches come from the full-text `search_vector` (with the last word matched as a prefix, for search-as-you-type)
+    or from trigram word similarity on the name, which tolerates typos. Both are served by GIN indexes.
+    """
+
+    search_param = "q"
+
+    def get_search_terms(self, request):
+        return re.findall(r"\w+", request.query_params.get(self.search_param, ""))
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        text = " ".join(terms)
+        query = SearchQuery(" & ".join(terms) + ":*", search_type="raw", config="english")
+        return (
+            queryset.filter(Q(search_vector=query) | Q(name__trigram_word_similar=text))
+            # Double precision, so the rank round-trips exactly through pagination cursors
+            .annotate(
+                rank=Cast(SearchRank(F("search_vector"), query) + TrigramWordSimilarity(text, "name"), FloatField())
+            ).order_by("-rank", "id")
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.search_param,
+                "required": False,
+                "in": "query",
+                "description": "Search destination names and descriptions, ranked by relevance",
+                "schema": {"type": "string"},
+            }
+        ]
+
+
+class HierarchyFilter(BaseFilterBackend):
+    """
+    Filter by a destination id given with `?<hierarchy_param>=`, looked up in the closure table of the destination
+    hierarchy, which answers subtrees of any depth with one index scan.
+    """
+
+    hierarchy_param = None
+    description = None
+
+    def get_destination(self, request):
+        value = request.query_params.get(self.hierarchy_param)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise serializers.ValidationError({self.hierarchy_param: ["A valid integer is required."]})
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.hierarchy_param,
+                "required": False,
+                "in": "query",
+                "description": self.description,
+                "schema": {"type": "integer"},
+            }
+        ]
+
+
+class DestinationWithinFilter(HierarchyFilter):
+    hierarchy_param = "within"
+    description = "Destinations inside this destination, at any depth (e.g. the cities and points of interest of a country)"
+
+    def filter_queryset(self, request, queryset, view):
+        destination = self.get_destination(request)
+        if destination is None:
+            return queryset
+        subtree = DestinationClosure.objects.filter(ancestor_id=destination, depth__gt=0).values("descendant_id")
+        return queryset.filter(pk__in=subtree)
+
+
+class ItineraryVisitsFilter(HierarchyFilter):
+    hierarchy_param = "visits"
+    description = "Itineraries with a stop at this destination or anywhere inside it"
+
+    def filter_queryset(self, request, queryset, view):
+        destination = self.get_destination(request)
+        if destination is None:
+            return queryset
+        subtree = DestinationClosure.objects.filter(ancestor_id=destination).values("descendant_id")
+        return queryset.filter(pk__in=ItineraryDestination.objects.filter(destination_id__in=subtree).values("itinerary_id"))
+
+
+class ItineraryBoundingBoxFilter(BaseFilterBackend):
+    """
+    Itineraries whose bounding box overlaps `?bbox=<min_longitude>,<min_latitude>,<max_longitude>,<max_latitude>`
+    (in GeoJSON order), served by a GiST index on the bounding box columns of the itinerary summary. A box with
+    `min_longitude` greater than `max_longitude` crosses the antimeridian.
+    """
+
+    bbox_param = "bbox"
+
+    def get_bounding_box(self, request):
+        value = request.query_params.get(self.bbox_param)
+        if value is None:
+            return None
+        try:
+            min_longitude, min_latitude, max_longitude, max_latitude = (float(part) for part in value.split(","))
+        except ValueError:
+            raise serializers.ValidationError(
+                {self.bbox_param: ["Expected min_longitude,min_latitude,max_longitude,max_latitude."]}
+            )
+        if not (-90 <= min_latitude <= max_latitude <= 90 and -180 <= min_longitude <= 180 and -180 <= max_longitude <= 180):
+            raise serializers.ValidationError(
+                {self.bbox_param: ["Coordinates out of range, or min_latitude above max_latitude."]}
+            )
+        return min_longitude, min_latitude, max_longitude, max_latitude
+
+    def filter_queryset(self, request, queryset, view):
+        bounding_box = self.get_bounding_box(request)
+        if bounding_box is None:
+            return queryset
+        min_longitude, min_latitude, max_longitude, max_latitude = bounding_box
+        longitude_ranges = [(min_longitude, max_longitude)]
+        if min_longitude > max_longitude:
+            longitude_ranges = [(min_longitude, 180.0), (-180.0, max_longitude)]
+
+        itinerary_box = box_expression("min_latitude", "min_longitude", "max_latitude", "max_longitude")
+        overlaps = Q()
+        for west, east in longitude_ranges:
+            box = box_expression(Value(min_latitude), Value(west), Value(max_latitude), Value(east))
+            overlaps |= Q(box_overlaps(itinerary_box, box))
+        return queryset.filter(overlaps)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.bbox_param,
+                "required": False,
+                "in": "query",
+                "description": "Itineraries with stops in this box: min_longitude,min_latitude,max_longitude,max_latitude",
+                "schema": {"type": "string"},
+            }
+        ]
+
+
+class KeysetOrderingFilter(BaseFilterBackend):
+    """
+    `?ordering=<field>` (or `-<field>` for descending) among the view's `keyset_ordering_fields`, with the id as tie
+    breaker in the same direction. Both fields going the same way, the cursor of the next page is a row comparison
+    (see `KeysetPagination.after`), which an index on `(<field>, id)` serves as an index condition.
+    """
+
+    ordering_param = "ordering"
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_param)
+        if not ordering:
+            return queryset
+        if ordering.lstrip("-") not in view.keyset_ordering_fields:
+            fields = ", ".join(view.keyset_ordering_fields)
+            raise serializers.ValidationError({self.ordering_param: [f"Order by one of: {fields}, with - for descending."]})
+        return queryset.order_by(ordering, "-id" if ordering.startswith("-") else "id")
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.ordering_param,
+                "required": False,
+                "in": "query",
+                "description": f"Order by one of: {', '.join(view.keyset_ordering_fields)}, with - for descending",
+                "schema": {"type": "string"},
+            }
+        ]
@@ -0,0 +1,335 @@
+"""
+Persistent forecast store.
+
+Each hourly variable of a location's forecast is kept as one `Forecast` row holding a packed float32 buffer, the
+timestamp of its first value and the step between values, instead of Open-Meteo's JSON with a timestamp string
+per hour. A week of hourly temperatures takes 672 bytes rather than several kilobytes. Requested time ranges are
+sliced straight out of the buffer, and only the requested hours are turned back into JSON.
+
+Forecasts are shown to users in the local time of the destination with `local_forecast`, which aggregates the hourly
+series into daily minimums, maximums and means with a few numpy operations.
+"""
+
+import datetime
+import math
+
+import numpy as np
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from triptuner.models import Forecast
+from triptuner.visits import utc_offsets
+
+# Packed values are little-endian float32
+DTYPE = np.dtype("<f4")
+# Values are rounded to this many decimals when rendered, which hides float32 noise (Open-Meteo sends at most two)
+DECIMALS = 2
+
+
+def pack_series(values):
+    """
+    Pack a list of numbers (or None for missing values) into float32 bytes
+    """
+    return np.array([math.nan if value is None else value for value in values], dtype=DTYPE).tobytes()
+
+
+def parse_bound(value, end=False):
+    """
+    Parse an ISO date or datetime (UTC unless it has an offset) bounding a requested range. A date bounds the whole
+    day, so as an `end` it includes every hour of that day. Raises ValueError for anything else.
+    """
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    day = parse_date(value)
+    if day is not None:
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=1) if end else day, datetime.time())
+        if end:
+            moment -= datetime.timedelta(microseconds=1)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f"Invalid date or time: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, datetime.timezone.utc)
+    return moment
+
+
+def forecast_rows(latitude, longitude, response, fetched_at):
+    """
+    Unsaved `Forecast` rows for every hourly variable of an Open-Meteo response (none if it has no time axis)
+    """
+    hourly = response.get("hourly") or {}
+    times = hourly.get("time") or []
+    if not times:
+        return []
+
+    offset = datetime.timedelta(seconds=response.get("utc_offset_seconds", 0))
+    first = datetime.datetime.fromisoformat(times[0])
+    step = (datetime.datetime.fromisoformat(times[1]) - first) if len(times) > 1 else datetime.timedelta(hours=1)
+    start = (first - offset).replace(tzinfo=datetime.timezone.utc)
+    units = response.get("hourly_units") or {}
+
+    return [
+        Forecast(
+            latitude=latitude,
+            longitude=longitude,
+            variable=variable,
+            unit=units.get(variable, ""),
+            start=start,
+            step=int(step.total_seconds()),
+            values=pack_series(values),
+            fetched_at=fetched_at,
+        )
+        for variable, values in hourly.items()
+        if variable != "time"
+    ]
+
+
+def upsert_arguments():
+    return {
+        "update_conflicts": True,
+        "unique_fields": ["latitude", "longitude", "variable"],
+        "update_fields": ["unit", "start", "step", "values", "fetched_at"],
+    }
+
+
+def save_forecast(latitude, longitude, response):
+    """
+    Store (or replace) the hourly series of an Open-Meteo response, with one upsert. Returns the rows.
+    """
+    rows = forecast_rows(latitude, longitude, response, timezone.now())
+    if rows:
+        Forecast.objects.bulk_create(rows, **upsert_arguments())
+    return rows
+
+
+async def asave_forecast(latitude, longitude, response):
+    rows = forecast_rows(latitude, longitude, response, timezone.now())
+    if rows:
+        await Forecast.objects.abulk_create(rows, **upsert_arguments())
+    return rows
+
+
+def save_forecasts(responses):
+    """
+    Store the Open-Meteo responses of many bucketed (latitude, longitude) locations, with one upsert
+    """
+    fetched_at = timezone.now()
+    rows = [
+        row
+        for (latitude, longitude), response in responses.items()
+        for row in forecast_rows(latitude, longitude, response, fetched_at)
+    ]
+    if rows:
+        Forecast.objects.bulk_create(rows, **upsert_arguments())
+    return rows
+
+
+def series_slice(row, start=None, end=None):
+    """
+    The index of the first value at or after `start`, and a zero-copy float32 view of the values up to `end`
+    """
+    count = len(row.values) // DTYPE.itemsize
+    first = 0 if start is None else math.ceil((start - row.start).total_seconds() / row.step)
+    last = count if end is None else math.floor((end - row.start).total_seconds() / row.step) + 1
+    first, last = min(max(first, 0), count), min(max(last, 0), count)
+    last = max(first, last)
+    return first, np.frombuffer(row.values, dtype=DTYPE, offset=first * DTYPE.itemsize, count=last - first)
+
+
+def rounded_list(values):
+    """
+    Values rounded to `DECIMALS`, as a list with None for missing values
+    """
+    rounded = values.astype(np.float64).round(DECIMALS)
+    return np.where(np.isnan(rounded), None, rounded).tolist()
+
+
+def render_forecast(latitude, longitude, rows, start=None, end=None):
+    """
+    An Open-Meteo shaped response (in GMT) with the values of `rows` between `start` and `end`
+    """
+    hourly, units = {}, {"time": "iso8601"}
+    for row in rows:
+        first, values = series_slice(row, start, end)
+        if "time" not in hourly:
+            origin = np.datetime64(row.start.astimezone(datetime.timezone.utc).replace(tzinfo=None), "s")
+            times = origin + (np.arange(len(values)) + first) * np.timedelta64(row.step, "s")
+            hourly["time"] = np.datetime_as_string(times, unit="m").tolist()
+        hourly[row.variable] = rounded_list(values)
+        units[row.variable] = row.unit
+
+    return {
+        "latitude": float(latitude),
+        "longitude": float(longitude),
+        "utc_offset_seconds": 0,
+        "timezone": "GMT",
+        "hourly_units": units,
+        "hourly": hourly,
+    }
+
+
+def stored_rows_query(latitude, longitude, variables, max_age):
+    rows = Forecast.objects.filter(latitude=latitude, longitude=longitude, variable__in=variables)
+    return fetched_within(rows, max_age)
+
+
+def fetched_within(rows, max_age):
+    if max_age is None:
+        return rows
+    return rows.filter(fetched_at__gte=timezone.now() - datetime.timedelta(seconds=max_age))
+
+
+def stored_rows(latitude, longitude, variables, max_age=3600):
+    """
+    The stored series of `variables` for a bucketed location, in the order of `variables`, or None unless all of
+    them were fetched within the last `max_age` seconds (at any time if None)
+    """
+    return complete_rows(list(stored_rows_query(latitude, longitude, variables, max_age)), variables)
+
+
+async def astored_rows(latitude, longitude, variables, max_age=3600):
+    rows = [row async for row in stored_rows_query(latitude, longitude, variables, max_age)]
+    return complete_rows(rows, variables)
+
+
+def complete_rows(rows, variables):
+    if len(rows) != len(set(variables)):
+        return None
+    return sorted(rows, key=lambda row: variables.index(row.variable))
+
+
+def stored_forecast(latitude, longitude, variables, start=None, end=None, max_age=3600):
+    """
+    The stored forecast of `variables` for a bucketed location, sliced to `start`/`end`, or None unless all of
+    them were fetched within the last `max_age` seconds (at any time if None) and cover `start` to `end`
+    """
+    rows = stored_rows(latitude, longitude, variables, max_age)
+    if rows is None or not covers(rows, start, end):
+        return None
+    return render_forecast(latitude, longitude, rows, start, end)
+
+
+def series_end(row):
+    """
+    The moment right after the last value of a stored series
+    """
+    return row.start + datetime.timedelta(seconds=row.step * (len(row.values) // DTYPE.itemsize))
+
+
+def covers(rows, start=None, end=None):
+    """
+    Whether the stored series `rows` all have values from `start` to `end`
+    """
+    return all((start is None or row.start <= start) and (end is None or series_end(row) > end) for row in rows)
+
+
+def stored_series(locations, variables, start=None, end=None, max_age=3600):
+    """
+    The stored rows of `variables` for many bucketed (latitude, longitude) locations, by location, for the locations
+    whose rows were all fetched within the last `max_age` seconds and cover `start` to `end`. One query.
+    """
+    locations = {(float(latitude), float(longitude)) for latitude, longitude in locations}
+    if not locations:
+        return {}
+    # Every combination of the latitudes and longitudes, the other locations are left out below
+    rows = Forecast.objects.filter(
+        latitude__in={latitude for latitude, _ in locations},
+        longitude__in={longitude for _, longitude in locations},
+        variable__in=variables,
+    )
+
+    by_location = {}
+    for row in fetched_within(rows, max_age):
+        location = (float(row.latitude), float(row.longitude))
+        if location in locations:
+            by_location.setdefault(location, []).append(row)
+    return {
+        location: sorted(location_rows, key=lambda row: variables.index(row.variable))
+        for location, location_rows in by_location.items()
+        if len(location_rows) == len(set(variables)) and covers(location_rows, start, end)
+    }
+
+
+def stored_forecasts(locations, variables, start=None, end=None, max_age=3600):
+    """
+    Like `stored_forecast` for many bucketed locations, by location, leaving out the locations whose stored series
+    are missing, too old, or don't cover `start` to `end`
+    """
+    return {
+        location: render_forecast(*location, rows, start, end)
+        for location, rows in stored_series(locations, variables, start, end, max_age).items()
+    }
+
+
+async def astored_forecast(latitude, longitude, variables, start=None, end=None, max_age=3600):
+    rows = await astored_rows(latitude, longitude, variables, max_age)
+    if rows is None or not covers(rows, start, end):
+        return None
+    return render_forecast(latitude, longitude, rows, start, end)
+
+
+def daily_aggregates(values, day_index, days):
+    """
+    The minimum, maximum and mean of `values` for each of `days` days, given the day (from 0) of every value.
+    Missing values are ignored, and days without any value are NaN.
+    """
+    valid = ~np.isnan(values)
+    counts = np.bincount(day_index[valid], minlength=days)
+    totals = np.bincount(day_index[valid], weights=values[valid], minlength=days)
+    minimum, maximum = np.full(days, np.nan), np.full(days, np.nan)
+    # fmin/fmax ignore NaN
+    np.fmin.at(minimum, day_index, values)
+    np.fmax.at(maximum, day_index, values)
+    mean = np.divide(totals, counts, out=np.full(days, np.nan), where=counts > 0)
+    return minimum, maximum, mean
+
+
+def local_forecast(forecast, zone, start=None, end=None, hourly=False):
+    """
+    An Open-Meteo shaped forecast in the local time of `zone`, with the daily minimum, maximum and mean of every
+    hourly variable (e.g. `temperature_2m_min`) for the local days between `start` and `end`, and with `hourly` the
+    hourly series of these days. Forecasts without an hourly time axis are passed through.
+    """
+    series = forecast.get("hourly") or {}
+    if not series.get("time"):
+        return forecast
+
+    offset = np.timedelta64(forecast.get("utc_offset_seconds", 0), "s")
+    times = np.array(series["time"], dtype="datetime64[m]") - offset
+    selected = np.ones(len(times), dtype=bool)
+    if start is not None:
+        selected &= times >= np.datetime64(start.astimezone(datetime.timezone.utc).replace(tzinfo=None))
+    if end is not None:
+        selected &= times <= np.datetime64(end.astimezone(datetime.timezone.utc).replace(tzinfo=None))
+    times = times[selected]
+
+    offsets = utc_offsets(times, zone)
+    local_times = times + offsets.astype("timedelta64[s]")
+    days, day_index = np.unique(local_times.astype("datetime64[D]"), return_inverse=True)
+    values = {
+        variable: np.array(hours, dtype=np.float64)[selected] for variable, hours in series.items() if variable != "time"
+    }
+    units = forecast.get("hourly_units") or {}
+
+    daily, daily_units = {"time": np.datetime_as_string(days).tolist()}, {"time": "iso8601"}
+    for variable, hours in values.items():
+        for name, aggregate in zip(("min", "max", "mean"), daily_aggregates(hours, day_index, len(days))):
+            daily[f"{variable}_{name}"] = rounded_list(aggregate)
+            daily_units[f"{variable}_{name}"] = units.get(variable, "")
+
+    local = {
+        "latitude": forecast.get("latitude"),
+        "longitude": forecast.get("longitude"),
+        "timezone": zone.key,
+        "utc_offset_seconds": int(offsets[0]) if len(offsets) else 0,
+        "daily_units": daily_units,
+        "daily": daily,
+    }
+    if hourly:
+        local["hourly_units"] = {"time": "iso8601", **{variable: units.get(variable, "") for variable in values}}
+        local["hourly"] = {
+            "time": np.datetime_as_string(local_times, unit="m").tolist(),
+            **{variable: rounded_list(hours) for variable, hours in values.items()},
+        }
+    return local
@@ -0,0 +1,97 @@
+"""
+Great-circle distance helpers.
+"""
+
+import math
+
+import numpy as np
+from django.db.models import BooleanField, F, Field, FloatField, Func, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great-circle distance between two points, in kilometres
+    """
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_matrix(latitudes, longitudes):
+    """
+    Great-circle distances between every pair of points, in kilometres, as an (n, n) array
+    """
+    phi = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lam = np.radians(np.asarray(longitudes, dtype=np.float64))
+    delta_phi = phi[:, None] - phi[None, :]
+    delta_lambda = lam[:, None] - lam[None, :]
+    a = np.sin(delta_phi / 2) ** 2 + np.cos(phi)[:, None] * np.cos(phi)[None, :] * np.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def bounding_box_filter(latitude, longitude, radius_km, latitude_field="latitude", longitude_field="longitude"):
+    """
+    A filter for the rows within a latitude/longitude box around a point, which contains every point within
+    `radius_km` of it. It only compares the raw coordinate columns, so it can use their index.
+    """
+    delta_latitude = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_latitude, max_latitude = latitude - delta_latitude, latitude + delta_latitude
+    box = Q(**{f"{latitude_field}__gte": max(min_latitude, -90), f"{latitude_field}__lte": min(max_latitude, 90)})
+
+    # Near the poles every longitude can be within range
+    if min_latitude <= -90 or max_latitude >= 90:
+        return box
+
+    delta_longitude = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(latitude))))
+    if delta_longitude >= 180:
+        return box
+
+    min_longitude, max_longitude = longitude - delta_longitude, longitude + delta_longitude
+    if min_longitude < -180:
+        # The box crosses the antimeridian, so it wraps around to the other side
+        return box & (
+            Q(**{f"{longitude_field}__gte": min_longitude + 360}) | Q(**{f"{longitude_field}__lte": max_longitude})
+        )
+    if max_longitude > 180:
+        return box & (
+            Q(**{f"{longitude_field}__gte": min_longitude}) | Q(**{f"{longitude_field}__lte": max_longitude - 360})
+        )
+    return box & Q(**{f"{longitude_field}__gte": min_longitude, f"{longitude_field}__lte": max_longitude})
+
+
+def haversine_expression(latitude, longitude, latitude_field="latitude", longitude_field="longitude"):
+    """
+    Database expression for the great-circle distance in kilometres from a point to each row,
+    so distances are computed and ranked by the database in one pass
+    """
+    phi1 = Value(math.radians(latitude))
+    phi2 = Radians(Cast(F(latitude_field), FloatField()))
+    delta_phi = phi2 - phi1
+    delta_lambda = Radians(Cast(F(longitude_field), FloatField())) - Value(math.radians(longitude))
+    a = Power(Sin(delta_phi / 2), 2) + Value(math.cos(math.radians(latitude))) * Cos(phi2) * Power(Sin(delta_lambda / 2), 2)
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)))
+
+
+def box_expression(min_latitude, min_longitude, max_latitude, max_longitude):
+    """
+    Database expression for a Postgres `box` between two corners, from field names or expressions, which GiST
+    indexes can search for overlaps (see `box_overlaps`)
+    """
+
+    def point(latitude, longitude):
+        latitude, longitude = (F(value) if isinstance(value, str) else value for value in (latitude, longitude))
+        return Func(longitude, latitude, function="point", output_field=Field())
+
+    return Func(point(min_latitude, min_longitude), point(max_latitude, max_longitude), function="box", output_field=Field())
+
+
+def box_overlaps(box, other):
+    """
+    A filter for the rows where the `box_expression` `box` overlaps `other` (the `&&` operator)
+    """
+    return Func(box, other, template="%(expressions)s", arg_joiner=" && ", output_field=BooleanField())
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from triptuner.schema import api_schema_settings, write_schema_files
+
+
+class Command(BaseCommand):
+    help = "Build the OpenAPI schema served at /api/schema/ for the current code version, e.g. at deploy time"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", help='schema directory, API_SCHEMA["DIRECTORY"] by default')
+
+    def handle(self, *args, **options):
+        directory = options["directory"] or api_schema_settings()["DIRECTORY"]
+        if not directory:
+            raise CommandError('Set API_SCHEMA["DIRECTORY"] or pass --directory')
+        self.stdout.write(f"Schema written to {write_schema_files(directory)}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from triptuner.catalogue import FORMATS, export_lines
+from triptuner.models import Destination
+
+
+class Command(BaseCommand):
+    help = "Export all destinations as CSV, NDJSON or GeoJSON, in the format read by import_destinations"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--output", help="file to write, standard output by default")
+
+    def handle(self, *args, **options):
+        lines = export_lines(Destination.objects.all(), options["format"])
+        if not options["output"]:
+            for chunk in lines:
+                self.stdout.write(chunk, ending="")
+            return
+
+        with open(options["output"], "w", encoding="utf-8", newline="") as output:
+            output.writelines(lines)
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from triptuner.catalogue import CHUNK_SIZE, FORMATS, guess_format, import_destinations
+
+
+class Command(BaseCommand):
+    help = "Import destinations from a CSV, NDJSON or GeoJSON file, upserting them on external_id"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="file to import, or - for standard input")
+        parser.add_argument("--format", choices=FORMATS, help="file format, guessed from the file extension by default")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows validated and copied at a time")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        try:
+            file_format = options["format"] or guess_format(path)
+            if path == "-":
+                summary = import_destinations(sys.stdin, file_format, options["chunk_size"])
+            else:
+                with open(path, encoding="utf-8-sig", newline="") as stream:
+                    summary = import_destinations(stream, file_format, options["chunk_size"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in summary["errors"]:
+            self.stderr.write(error)
+        self.stdout.write(
+            f"{summary['rows']} rows: {summary['inserted']} inserted, {summary['updated']} updated, "
+            f"{summary['unchanged']} unchanged, {summary['invalid']} invalid"
+        )
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from triptuner.prefetch import prefetch_forecasts, prefetch_settings
+
+
+class Command(BaseCommand):
+    help = "Fetch the forecasts of upcoming itineraries into the forecast store ahead of time"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--horizon-days", type=int, help="only itineraries overlapping the next N days")
+        parser.add_argument("--refresh-margin", type=int, help="refresh stored forecasts N seconds before they are too old")
+        parser.add_argument("--concurrency", type=int, help="upstream calls in flight")
+        parser.add_argument("--rate-limit", type=float, help="upstream calls per second")
+        parser.add_argument("--loop", action="store_true", help="keep running, every --interval seconds")
+        parser.add_argument("--interval", type=int, default=prefetch_settings()["INTERVAL"])
+
+    def handle(self, *args, **options):
+        while True:
+            summary = prefetch_forecasts(
+                horizon_days=options["horizon_days"],
+                refresh_margin=options["refresh_margin"],
+                concurrency=options["concurrency"],
+                rate_limit=options["rate_limit"],
+            )
+            self.stdout.write(
+                f"{summary['locations']} locations: {summary['fetched']} fetched, "
+                f"{summary['up_to_date']} up to date, {summary['failed']} failed"
+            )
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
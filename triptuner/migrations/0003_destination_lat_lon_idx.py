@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("triptuner", "0002_itinerary_itinerarydestination_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="destination",
+            index=models.Index(fields=["latitude", "longitude"], name="destination_lat_lon_idx"),
+        ),
+    ]
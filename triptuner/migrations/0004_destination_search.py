@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:09
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("triptuner", "0003_destination_lat_lon_idx"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="destination",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.CombinedSearchVector(
+                    django.contrib.postgres.search.SearchVector("name", config="english", weight="A"),
+                    "||",
+                    django.contrib.postgres.search.SearchVector("description", config="english", weight="B"),
+                    django.contrib.postgres.search.SearchConfig("english"),
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="destination",
+            index=django.contrib.postgres.indexes.GinIndex(fields=["search_vector"], name="destination_search_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="destination",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["name"],
+                name="destination_name_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("triptuner", "0004_destination_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="itinerary",
+            index=models.Index(fields=["start_date", "id"], name="itinerary_start_date_id_idx"),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("triptuner", "0005_itinerary_start_date_id_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Forecast",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("latitude", models.DecimalField(decimal_places=6, max_digits=9)),
+                ("longitude", models.DecimalField(decimal_places=6, max_digits=9)),
+                ("variable", models.CharField(max_length=64)),
+                ("unit", models.CharField(blank=True, max_length=16)),
+                ("start", models.DateTimeField()),
+                ("step", models.PositiveIntegerField(default=3600)),
+                ("values", models.BinaryField()),
+                ("fetched_at", models.DateTimeField()),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("latitude", "longitude", "variable"),
+                        name="forecast_location_variable_unique",
+                    )
+                ],
+            },
+        ),
+    ]
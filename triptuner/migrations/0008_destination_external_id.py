@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("triptuner", "0007_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="destination",
+            name="external_id",
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("triptuner", "0008_destination_external_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="itinerary",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,144 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Every destination gets its own row, and the rows of its parent's ancestors one level deeper. Rows inserted by
+# the same statement may be parents of each other, so paths are first followed up through the inserted rows.
+CLOSURE_INSERT_SQL = """
+CREATE FUNCTION triptuner_destination_closure_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO triptuner_destinationclosure (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE chain (ancestor_id, descendant_id, depth, parent_id) AS (
+        SELECT id, id, 0, parent_id FROM inserted
+        UNION ALL
+        SELECT inserted.id, chain.descendant_id, chain.depth + 1, inserted.parent_id
+        FROM chain JOIN inserted ON inserted.id = chain.parent_id
+    )
+    SELECT ancestor_id, descendant_id, depth FROM chain
+    UNION ALL
+    SELECT closure.ancestor_id, chain.descendant_id, chain.depth + closure.depth + 1
+    FROM chain JOIN triptuner_destinationclosure AS closure ON closure.descendant_id = chain.parent_id;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER destination_closure_insert
+AFTER INSERT ON triptuner_destination
+REFERENCING NEW TABLE AS inserted
+FOR EACH STATEMENT EXECUTE FUNCTION triptuner_destination_closure_insert();
+"""
+
+# Moving a destination moves its whole subtree: the paths from its former ancestors into the subtree are replaced
+# by paths from the new ancestors. Moves under the destination itself or one of its descendants are rejected.
+CLOSURE_MOVE_SQL = """
+CREATE FUNCTION triptuner_destination_closure_move() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF EXISTS (
+        SELECT FROM triptuner_destinationclosure WHERE ancestor_id = NEW.id AND descendant_id = NEW.parent_id
+    ) THEN
+        RAISE EXCEPTION 'Destination % can not be moved inside itself', NEW.id USING ERRCODE = 'check_violation';
+    END IF;
+
+    DELETE FROM triptuner_destinationclosure AS closure
+    USING triptuner_destinationclosure AS above, triptuner_destinationclosure AS below
+    WHERE above.descendant_id = NEW.id AND above.depth > 0 AND below.ancestor_id = NEW.id
+        AND closure.ancestor_id = above.ancestor_id AND closure.descendant_id = below.descendant_id;
+
+    INSERT INTO triptuner_destinationclosure (ancestor_id, descendant_id, depth)
+    SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1
+    FROM triptuner_destinationclosure AS above, triptuner_destinationclosure AS below
+    WHERE above.descendant_id = NEW.parent_id AND below.ancestor_id = NEW.id;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER destination_closure_move
+AFTER UPDATE OF parent_id ON triptuner_destination
+FOR EACH ROW WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+EXECUTE FUNCTION triptuner_destination_closure_move();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("triptuner", "0009_itinerary_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="destination",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="children",
+                to="triptuner.destination",
+            ),
+        ),
+        migrations.CreateModel(
+            name="DestinationClosure",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("depth", models.PositiveIntegerField()),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_paths",
+                        to="triptuner.destination",
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_paths",
+                        to="triptuner.destination",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["descendant", "depth"], name="destination_ancestors_idx")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("ancestor", "descendant"),
+                        include=("depth",),
+                        name="destination_subtree_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="destination",
+            index=models.Index(fields=["type", "id"], name="destination_type_id_idx"),
+        ),
+        # Existing destinations have no parent yet
+        migrations.RunSQL(
+            "INSERT INTO triptuner_destinationclosure (ancestor_id, descendant_id, depth) "
+            "SELECT id, id, 0 FROM triptuner_destination",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            CLOSURE_INSERT_SQL,
+            "DROP TRIGGER destination_closure_insert ON triptuner_destination; "
+            "DROP FUNCTION triptuner_destination_closure_insert();",
+        ),
+        migrations.RunSQL(
+            CLOSURE_MOVE_SQL,
+            "DROP TRIGGER destination_closure_move ON triptuner_destination; "
+            "DROP FUNCTION triptuner_destination_closure_move();",
+        ),
+    ]
@@ -0,0 +1,207 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:43
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+# Recompute the summary columns of some itineraries from their stops, and bump their `updated_at` with `touch`.
+# Route legs join consecutive stops with coordinates in visit order, with the haversine formula of triptuner/geo.py.
+SUMMARY_FUNCTION_SQL = """
+CREATE FUNCTION triptuner_refresh_itinerary_summaries(itinerary_ids bigint[], touch boolean) RETURNS void
+LANGUAGE sql AS $$
+    UPDATE triptuner_itinerary AS itinerary
+    SET stop_count = summary.stop_count,
+        route_distance_km = summary.route_distance_km,
+        min_latitude = summary.min_latitude,
+        min_longitude = summary.min_longitude,
+        max_latitude = summary.max_latitude,
+        max_longitude = summary.max_longitude,
+        centroid_latitude = summary.centroid_latitude,
+        centroid_longitude = summary.centroid_longitude,
+        updated_at = CASE WHEN touch THEN now() ELSE itinerary.updated_at END
+    FROM (
+        SELECT
+            ids.id,
+            (SELECT count(*) FROM triptuner_itinerarydestination WHERE itinerary_id = ids.id) AS stop_count,
+            coalesce(sum(located.leg_km), 0) AS route_distance_km,
+            min(located.latitude) AS min_latitude,
+            min(located.longitude) AS min_longitude,
+            max(located.latitude) AS max_latitude,
+            max(located.longitude) AS max_longitude,
+            round(avg(located.latitude), 6) AS centroid_latitude,
+            round(avg(located.longitude), 6) AS centroid_longitude
+        FROM unnest(itinerary_ids) AS ids (id)
+        LEFT JOIN LATERAL (
+            SELECT
+                latitude,
+                longitude,
+                -- least() skips nulls, so the first stop needs its own case
+                CASE WHEN previous_latitude IS NOT NULL THEN 2 * 6371.0088 * asin(least(1.0, sqrt(
+                    sin(radians(latitude::float8 - previous_latitude::float8) / 2) ^ 2
+                    + cos(radians(previous_latitude::float8)) * cos(radians(latitude::float8))
+                    * sin(radians(longitude::float8 - previous_longitude::float8) / 2) ^ 2
+                ))) END AS leg_km
+            FROM (
+                SELECT
+                    destination.latitude,
+                    destination.longitude,
+                    lag(destination.latitude) OVER visits AS previous_latitude,
+                    lag(destination.longitude) OVER visits AS previous_longitude
+                FROM triptuner_itinerarydestination AS stop
+                JOIN triptuner_destination AS destination ON destination.id = stop.destination_id
+                WHERE stop.itinerary_id = ids.id
+                    AND destination.latitude IS NOT NULL AND destination.longitude IS NOT NULL
+                WINDOW visits AS (ORDER BY stop.visit_order, stop.id)
+            ) AS legs
+        ) AS located ON true
+        GROUP BY ids.id
+    ) AS summary
+    WHERE itinerary.id = summary.id
+$$;
+"""
+
+# Stops are written in bulk, so summaries are refreshed once per statement, for the itineraries it changed
+STOPS_TRIGGER_SQL = """
+CREATE FUNCTION triptuner_itinerary_stops_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM triptuner_refresh_itinerary_summaries(ARRAY(SELECT DISTINCT itinerary_id FROM new_stops), false);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM triptuner_refresh_itinerary_summaries(ARRAY(SELECT DISTINCT itinerary_id FROM old_stops), false);
+    ELSE
+        PERFORM triptuner_refresh_itinerary_summaries(
+            ARRAY(SELECT itinerary_id FROM new_stops UNION SELECT itinerary_id FROM old_stops), false
+        );
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER itinerary_stops_inserted
+AFTER INSERT ON triptuner_itinerarydestination
+REFERENCING NEW TABLE AS new_stops
+FOR EACH STATEMENT EXECUTE FUNCTION triptuner_itinerary_stops_changed();
+
+CREATE TRIGGER itinerary_stops_updated
+AFTER UPDATE ON triptuner_itinerarydestination
+REFERENCING OLD TABLE AS old_stops NEW TABLE AS new_stops
+FOR EACH STATEMENT EXECUTE FUNCTION triptuner_itinerary_stops_changed();
+
+CREATE TRIGGER itinerary_stops_deleted
+AFTER DELETE ON triptuner_itinerarydestination
+REFERENCING OLD TABLE AS old_stops
+FOR EACH STATEMENT EXECUTE FUNCTION triptuner_itinerary_stops_changed();
+"""
+
+# New coordinates of a destination change the itineraries visiting it, which also get a new `updated_at` for their ETags
+DESTINATION_TRIGGER_SQL = """
+CREATE FUNCTION triptuner_destination_coordinates_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM triptuner_refresh_itinerary_summaries(
+        ARRAY(SELECT DISTINCT itinerary_id FROM triptuner_itinerarydestination WHERE destination_id = NEW.id), true
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER destination_coordinates_changed
+AFTER UPDATE OF latitude, longitude ON triptuner_destination
+FOR EACH ROW WHEN (OLD.latitude IS DISTINCT FROM NEW.latitude OR OLD.longitude IS DISTINCT FROM NEW.longitude)
+EXECUTE FUNCTION triptuner_destination_coordinates_changed();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("triptuner", "0010_destination_hierarchy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="itinerary",
+            name="centroid_latitude",
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name="itinerary",
+            name="centroid_longitude",
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name="itinerary",
+            name="max_latitude",
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name="itinerary",
+            name="max_longitude",
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name="itinerary",
+            name="min_latitude",
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name="itinerary",
+            name="min_longitude",
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name="itinerary",
+            name="route_distance_km",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="itinerary",
+            name="stop_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="itinerary",
+            index=models.Index(fields=["route_distance_km", "id"], name="itinerary_distance_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="itinerary",
+            index=models.Index(fields=["stop_count", "id"], name="itinerary_stop_count_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="itinerary",
+            index=django.contrib.postgres.indexes.GistIndex(
+                models.Func(
+                    models.Func(
+                        models.F("min_longitude"),
+                        models.F("min_latitude"),
+                        function="point",
+                        output_field=models.Field(),
+                    ),
+                    models.Func(
+                        models.F("max_longitude"),
+                        models.F("max_latitude"),
+                        function="point",
+                        output_field=models.Field(),
+                    ),
+                    function="box",
+                    output_field=models.Field(),
+                ),
+                name="itinerary_bounding_box_idx",
+            ),
+        ),
+        migrations.RunSQL(SUMMARY_FUNCTION_SQL, "DROP FUNCTION triptuner_refresh_itinerary_summaries(bigint[], boolean);"),
+        migrations.RunSQL(
+            "SELECT triptuner_refresh_itinerary_summaries(ARRAY(SELECT id FROM triptuner_itinerary), false)",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            STOPS_TRIGGER_SQL,
+            "DROP TRIGGER itinerary_stops_inserted ON triptuner_itinerarydestination; "
+            "DROP TRIGGER itinerary_stops_updated ON triptuner_itinerarydestination; "
+            "DROP TRIGGER itinerary_stops_deleted ON triptuner_itinerarydestination; "
+            "DROP FUNCTION triptuner_itinerary_stops_changed();",
+        ),
+        migrations.RunSQL(
+            DESTINATION_TRIGGER_SQL,
+            "DROP TRIGGER destination_coordinates_changed ON triptuner_destination; "
+            "DROP FUNCTION triptuner_destination_coordinates_changed();",
+        ),
+    ]
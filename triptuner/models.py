@@ -1,5 +1,9 @@
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 
+from triptuner.geo import box_expression
+
 
 class Destination(models.Model):
     DESTINATION_TYPE_CHOICES = [
@@ -8,22 +12,116 @@ class Destination(models.Model):
         ("poi", "Point of Interest"),
     ]
 
+    # Identifier in the source catalogue, which bulk imports upsert on (see triptuner/catalogue.py)
+    external_id = models.CharField(max_length=255, unique=True, null=True, blank=True)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     type = models.CharField(max_length=10, choices=DESTINATION_TYPE_CHOICES)
+    # Country > city > point of interest. Changes are mirrored into DestinationClosure by database triggers
+    parent = models.ForeignKey("self", on_delete=models.SET_NULL, blank=True, null=True, related_name="children")
     latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    # Maintained by Postgres on every insert and update, including bulk loads
+    search_vector = models.GeneratedField(
+        expression=SearchVector("name", weight="A", config="english")
+        + SearchVector("description", weight="B", config="english"),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+    # Validators for conditional requests, see ConditionalGetMixin in triptuner/views.py
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Bounding box pruning for nearby searches
+            models.Index(fields=["latitude", "longitude"], name="destination_lat_lon_idx"),
+            # Pages of one type, e.g. the cities within a country
+            models.Index(fields=["type", "id"], name="destination_type_id_idx"),
+            # Full-text and typo-tolerant name search
+            GinIndex(fields=["search_vector"], name="destination_search_idx"),
+            GinIndex(fields=["name"], name="destination_name_trgm_idx", opclasses=["gin_trgm_ops"]),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class DestinationClosure(models.Model):
+    """
+    The closure table of the destination hierarchy: one row per destination and each of its ancestors, `depth`
+    levels up, and one for the destination itself at depth 0. Subtree and ancestor lookups are one index scan at
+    any depth.
+
+    Rows are maintained by triggers on the destination table (see migration 0010), on every insert and change of
+    `parent`, including bulk loads, so the application never writes them.
+    """
+
+    ancestor = models.ForeignKey(Destination, on_delete=models.CASCADE, db_index=False, related_name="descendant_paths")
+    descendant = models.ForeignKey(Destination, on_delete=models.CASCADE, db_index=False, related_name="ancestor_paths")
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            # Subtrees, by index-only scans
+            models.UniqueConstraint(fields=["ancestor", "descendant"], include=["depth"], name="destination_subtree_unique"),
+        ]
+        indexes = [
+            # Ancestors
+            models.Index(fields=["descendant", "depth"], name="destination_ancestors_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} > {self.descendant_id} (Depth: {self.depth})"
+
+
 class Itinerary(models.Model):
+    # Denormalized from the stops and their destinations, see the summary fields below
+    SUMMARY_FIELDS = [
+        "stop_count",
+        "route_distance_km",
+        "min_latitude",
+        "min_longitude",
+        "max_latitude",
+        "max_longitude",
+        "centroid_latitude",
+        "centroid_longitude",
+    ]
+
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     start_date = models.DateField()
     end_date = models.DateField()
     destinations = models.ManyToManyField("Destination", through="ItineraryDestination", related_name="itineraries")
+    # Also bumped when the stops change, as they are part of the itinerary's representation
+    updated_at = models.DateTimeField(auto_now=True)
+    # Incremented by every update, which must name the version it was made from (optimistic concurrency)
+    version = models.PositiveIntegerField(default=1)
+
+    # Summary of the stops, recomputed by database triggers (see migration 0011) for the itineraries whose stops or
+    # stop coordinates changed, so lists can filter and sort on them without joining the stops. The bounding box,
+    # centroid (the mean of the coordinates) and route distance (great-circle legs in visit order) only cover the
+    # stops with coordinates, and are null when there are none.
+    stop_count = models.PositiveIntegerField(default=0)
+    route_distance_km = models.FloatField(default=0)
+    min_latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    min_longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    max_latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    max_longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    centroid_latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    centroid_longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination orders
+            models.Index(fields=["start_date", "id"], name="itinerary_start_date_id_idx"),
+            models.Index(fields=["route_distance_km", "id"], name="itinerary_distance_id_idx"),
+            models.Index(fields=["stop_count", "id"], name="itinerary_stop_count_id_idx"),
+            # Bounding box overlaps
+            GistIndex(
+                box_expression("min_latitude", "min_longitude", "max_latitude", "max_longitude"),
+                name="itinerary_bounding_box_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -39,3 +137,27 @@ class ItineraryDestination(models.Model):
 
     def __str__(self):
         return f"{self.itinerary.name} - {self.destination.name} (Order: {self.visit_order})"
+
+
+class Forecast(models.Model):
+    """
+    An hourly forecast series of one variable (e.g. `temperature_2m`) for a bucketed location.
+    Values are packed little-endian float32, one every `step` seconds from `start`, with NaN for missing hours.
+    """
+
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    variable = models.CharField(max_length=64)
+    unit = models.CharField(max_length=16, blank=True)
+    start = models.DateTimeField()
+    step = models.PositiveIntegerField(default=3600)
+    values = models.BinaryField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["latitude", "longitude", "variable"], name="forecast_location_variable_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.variable} at {self.latitude}, {self.longitude}"
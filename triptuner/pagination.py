@@ -0,0 +1,225 @@
+import base64
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Field, Func, Q, Value
+from django.db.models.lookups import GreaterThan, LessThan
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class Row(Func):
+    """
+    A row constructor, `(a, b)`, which Postgres compares column by column
+    """
+
+    template = "(%(expressions)s)"
+    output_field = Field()
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on an indexed, unique ordering such as `("id",)` or `("start_date", "id")`.
+
+    The cursor holds the ordering values of the last row of a page, and the next page is fetched with the row
+    comparison `WHERE (start_date, id) > (...)` instead of an OFFSET. Postgres reads it as an index condition on
+    `(start_date, id)`, so deep pages cost the same as the first one. Views set the ordering with
+    `pagination_ordering`. If a filter already ordered the queryset (e.g. search ranking), that ordering is used
+    instead, and it must end with a unique field.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 1000
+    default_ordering = ("id",)
+
+    def get_ordering(self, queryset, view):
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+        return tuple(getattr(view, "pagination_ordering", self.default_ordering))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps({"v": values, "r": reverse}, cls=DjangoJSONEncoder, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, request, queryset):
+        """
+        The ordering values and direction held by the cursor of the request, converted to the types of the ordering
+        fields. Cursors that were not made by `encode_cursor` for this ordering are rejected with a 404.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)))
+            values, reverse = payload["v"], payload["r"]
+        except (TypeError, ValueError, KeyError):
+            raise NotFound("Invalid cursor")
+        if not isinstance(values, list) or len(values) != len(self.ordering) or not isinstance(reverse, bool):
+            raise NotFound("Invalid cursor")
+        try:
+            values = [
+                self.ordering_field(queryset, ordering_field).to_python(value)
+                for ordering_field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound("Invalid cursor")
+        # The ordering fields are not nullable, and NULL can't be compared with < or >
+        if any(value is None for value in values):
+            raise NotFound("Invalid cursor")
+        return values, reverse
+
+    def ordering_field(self, queryset, ordering_field):
+        """
+        The model field, or the output field of the annotation, that `ordering_field` orders by
+        """
+        name = self.field_name(ordering_field)
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model = queryset.model
+        for part in name.split("__"):
+            field = model._meta.get_field(part)
+            model = field.related_model
+        return field
+
+    @staticmethod
+    def field_name(ordering_field):
+        return ordering_field.lstrip("-")
+
+    def after(self, queryset, values, reverse):
+        """
+        Rows strictly after `values` in the ordering (or before them, when paging in reverse). An ordering in one
+        direction is compared as a row, `(start_date, id) > (...)`, which an index on its fields serves as an index
+        condition. Orderings that mix directions (e.g. `("-rank", "id")`) can't be, and are compared field by field.
+        """
+        descending = {ordering_field.startswith("-") for ordering_field in self.ordering}
+        if len(descending) == 1:
+            fields = [self.field_name(ordering_field) for ordering_field in self.ordering]
+            row = Row(*(F(field) for field in fields))
+            cursor = Row(
+                *(
+                    Value(value, output_field=self.ordering_field(queryset, ordering_field))
+                    for ordering_field, value in zip(self.ordering, values)
+                )
+            )
+            return (LessThan if descending.pop() != reverse else GreaterThan)(row, cursor)
+
+        conditions = []
+        for index, ordering_field in enumerate(self.ordering):
+            descending = ordering_field.startswith("-") != reverse
+            lookup = "lt" if descending else "gt"
+            equal = {self.field_name(field): value for field, value in zip(self.ordering[:index], values)}
+            conditions.append(Q(**equal, **{f"{self.field_name(ordering_field)}__{lookup}": values[index]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def reverse_ordering(self):
+        return [field[1:] if field.startswith("-") else f"-{field}" for field in self.ordering]
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        The unevaluated query of the requested page, with one extra row that tells whether there is another page
+        in this direction
+        """
+        self.request = request
+        self.ordering = self.get_ordering(queryset, view)
+        self.page_size_value = self.get_page_size(request)
+        values, reverse = self.cursor = self.decode_cursor(request, queryset)
+
+        queryset = queryset.order_by(*(self.reverse_ordering() if reverse else self.ordering))
+        if values is not None:
+            queryset = queryset.filter(self.after(queryset, values, reverse))
+        limit = self.page_size_value + 1
+        return queryset[:limit]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.page_queryset(queryset, request, view))
+        values, reverse = self.cursor
+        # As fetched, including the extra row
+        self.fetched_rows = list(rows)
+
+        has_more = len(rows) == self.page_size_value + 1
+        rows = rows[:-1] if has_more else rows
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = values is not None if not reverse else has_more
+        self.first_values = self.row_values(rows[0]) if rows else values
+        self.last_values = self.row_values(rows[-1]) if rows else values
+        return rows
+
+    def row_values(self, row):
+        # Rows of `.values()` queries are dicts keyed by the ordering fields
+        if isinstance(row, dict):
+            return [row[self.field_name(ordering_field)] for ordering_field in self.ordering]
+        values = []
+        for ordering_field in self.ordering:
+            value = row
+            for name in self.field_name(ordering_field).split("__"):
+                value = getattr(value, name)
+            values.append(value)
+        return values
+
+    def get_link(self, values, reverse):
+        url = self.request.build_absolute_uri()
+        if values is None:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or self.last_values is None:
+            return None
+        return self.get_link(self.last_values, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_values is None:
+            return None
+        return self.get_link(self.first_values, reverse=True)
+
+    def get_paginated_data(self, data):
+        return {"next": self.get_next_link(), "previous": self.get_previous_link(), "results": data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
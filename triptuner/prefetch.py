@@ -0,0 +1,149 @@
+"""
+Background prefetching of forecasts for upcoming itineraries.
+
+Itineraries overlapping the forecast horizon are scanned for the distinct (bucketed) stop locations, and the
+forecasts of each location over the dates of its itineraries are fetched ahead of time into the forecast store (the
+`Forecast` table), which both weather endpoints read from before calling Open-Meteo. Being in the database, they
+are shared by every worker, and survive restarts. Runs are incremental: only locations whose stored forecasts are
+missing, don't cover those dates or are about to be too old (see `STORE_MAX_AGE`) are fetched again. Upstream calls
+use Open-Meteo's multi-location queries, a few at a time, and are spaced out to stay under the provider's rate
+limit. They have the prefetch priority of the shared upstream rate limit, so they give way to requests.
+"""
+
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from triptuner.forecasts import covers, parse_bound, save_forecasts, stored_series
+from triptuner.models import ItineraryDestination
+from triptuner.visits import forecast_dates
+from triptuner.weather import bucket_coordinate, cache_settings, fetch_forecasts
+from triptuner.weather_client import PREFETCH, UpstreamUnavailable, upstream_priority
+
+logger = logging.getLogger(__name__)
+
+# The hourly variable asked for by the itinerary weather endpoint
+HOURLY = "temperature_2m"
+
+DEFAULT_PREFETCH_SETTINGS = {
+    "HORIZON_DAYS": 16,
+    "REFRESH_MARGIN": 5 * 60,
+    "CONCURRENCY": 4,
+    "RATE_LIMIT": 5,
+    "INTERVAL": 5 * 60,
+}
+
+
+def prefetch_settings():
+    return {**DEFAULT_PREFETCH_SETTINGS, **getattr(settings, "WEATHER_PREFETCH", {})}
+
+
+class RateLimiter:
+    """
+    Space out calls to at most `rate` per second, across threads. A `rate` of None disables the limit.
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+def upcoming_locations(today, horizon_days):
+    """
+    The bucketed locations of the stops of itineraries overlapping the next `horizon_days` days, each with the
+    (start_date, end_date) covering the forecast dates the itinerary weather endpoint asks for at that location
+    """
+    precision = cache_settings()["COORDINATE_PRECISION"]
+    rows = (
+        ItineraryDestination.objects.filter(
+            itinerary__end_date__gte=today,
+            itinerary__start_date__lte=today + datetime.timedelta(days=horizon_days),
+            destination__latitude__isnull=False,
+            destination__longitude__isnull=False,
+        )
+        .values_list("itinerary__start_date", "itinerary__end_date", "destination__latitude", "destination__longitude")
+        .distinct()
+    )
+
+    dates = {}
+    for start_date, end_date, latitude, longitude in rows.iterator():
+        location = (bucket_coordinate(latitude, precision), bucket_coordinate(longitude, precision))
+        start_date, end_date = forecast_dates(start_date, end_date)
+        if location in dates:
+            start_date, end_date = min(start_date, dates[location][0]), max(end_date, dates[location][1])
+        dates[location] = (start_date, end_date)
+    return dates
+
+
+def prefetch_forecasts(today=None, horizon_days=None, refresh_margin=None, concurrency=None, rate_limit=None):
+    """
+    Fetch the forecasts of upcoming itineraries into the forecast store, for the locations whose stored forecasts
+    are missing, don't cover the dates, or become older than `STORE_MAX_AGE` within `refresh_margin` seconds.
+    Returns counts of the locations that were up to date, fetched, and failed.
+    """
+    config = prefetch_settings()
+    today = today or timezone.localdate()
+    horizon_days = config["HORIZON_DAYS"] if horizon_days is None else horizon_days
+    refresh_margin = config["REFRESH_MARGIN"] if refresh_margin is None else refresh_margin
+    concurrency = concurrency or config["CONCURRENCY"]
+    limiter = RateLimiter(config["RATE_LIMIT"] if rate_limit is None else rate_limit)
+
+    upcoming = upcoming_locations(today, horizon_days)
+    stored = stored_series(upcoming, [HOURLY], max_age=cache_settings()["STORE_MAX_AGE"] - refresh_margin)
+
+    # Locations sharing the same dates are fetched together, with multi-location calls
+    groups = defaultdict(list)
+    for location, (start_date, end_date) in sorted(upcoming.items()):
+        start, end = parse_bound(start_date.isoformat()), parse_bound(end_date.isoformat(), end=True)
+        if location not in stored or not covers(stored[location], start, end):
+            groups[(start_date, end_date)].append(location)
+
+    batch_size, batches = cache_settings()["BATCH_SIZE"], []
+    summary = {"locations": len(upcoming), "fetched": 0, "failed": 0}
+    for (start_date, end_date), expiring in groups.items():
+        params = {"hourly": HOURLY, "start_date": start_date.isoformat(), "end_date": end_date.isoformat()}
+        for start in range(0, len(expiring), batch_size):
+            end = start + batch_size
+            batches.append((params, expiring[start:end]))
+
+    def fetch(batch):
+        params, locations = batch
+        limiter.wait()
+        try:
+            # Prefetching only takes the Open-Meteo calls left over by requests
+            with upstream_priority(PREFETCH):
+                forecasts = fetch_forecasts(locations, **params)
+        except (requests.RequestException, UpstreamUnavailable) as error:
+            logger.warning("Prefetching %d forecasts failed: %s", len(locations), error)
+            return locations, None
+        return locations, forecasts
+
+    # The threads only call Open-Meteo, forecasts are stored from this thread and its database connection
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for locations, forecasts in executor.map(fetch, batches):
+            if forecasts is None:
+                summary["failed"] += len(locations)
+                continue
+            save_forecasts(dict(zip(locations, forecasts)))
+            summary["fetched"] += len(locations)
+
+    summary["up_to_date"] = summary["locations"] - summary["fetched"] - summary["failed"]
+    return summary
@@ -0,0 +1,319 @@
+"""
+Opt-in per-request profiling.
+
+`RequestProfilingMiddleware` records for every request the number and duration of database queries, the time
+spent in DRF serialization, and the Open-Meteo calls and forecast cache outcomes of the weather module. Each
+response gets a `Server-Timing` header with these, and they are aggregated in memory per route into histograms,
+served in Prometheus text format by `/api/_metrics/`. Requests sent with an `X-Profile: <CPROFILE_TOKEN>` header
+also run under cProfile, and the stats are written to `CPROFILE_DIR`.
+
+Measurements go to the profile of the current request, held in a context variable, so they are recorded the same
+way for sync and async views, and are ignored outside requests (e.g. in background refreshes).
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import hmac
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.serializers import BaseSerializer
+
+DEFAULT_PROFILING_SETTINGS = {
+    "ENABLED": False,
+    "CPROFILE_TOKEN": "",
+    "CPROFILE_DIR": os.path.join(tempfile.gettempdir(), "triptuner-profiles"),
+}
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+def profiling_settings():
+    return {**DEFAULT_PROFILING_SETTINGS, **getattr(settings, "REQUEST_PROFILING", {})}
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serializing = False
+        self.upstream_calls = []
+        self.cache = Counter()
+
+    @property
+    def upstream_time(self):
+        return sum(duration for duration, _ in self.upstream_calls)
+
+    def server_timing(self, total):
+        """
+        The `Server-Timing` header value, with durations in milliseconds
+        """
+        metrics = [
+            f'db;dur={self.db_time * 1000:.1f};desc="queries={self.db_queries}"',
+            f"serialize;dur={self.serialize_time * 1000:.1f}",
+        ]
+        if self.upstream_calls:
+            metrics.append(f'upstream;dur={self.upstream_time * 1000:.1f};desc="calls={len(self.upstream_calls)}"')
+        if self.cache:
+            outcomes = " ".join(f"{name}={count}" for name, count in sorted(self.cache.items()))
+            metrics.append(f'cache;desc="{outcomes}"')
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper timing the queries of the current request
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.db_queries += 1
+        profile.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_serializer_timer():
+    """
+    Time `serializer.data`, where DRF turns instances into primitive data. Nested serializers are part of the
+    outermost one, so only that is timed.
+    """
+    data = BaseSerializer.data
+    if getattr(data.fget, "profiled", False):
+        return
+
+    def timed_data(serializer):
+        profile = current_profile.get()
+        if profile is None or profile.serializing:
+            return data.fget(serializer)
+        profile.serializing = True
+        started = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            profile.serialize_time += time.perf_counter() - started
+            profile.serializing = False
+
+    timed_data.profiled = True
+    BaseSerializer.data = property(timed_data)
+
+
+@contextlib.contextmanager
+def upstream_call():
+    """
+    Time an upstream call made within the block. Set `.status` on the yielded record to its response status.
+    """
+    profile = current_profile.get()
+    record = UpstreamCall()
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record.status = record.status or "error"
+        raise
+    finally:
+        if profile is not None:
+            duration = time.perf_counter() - started
+            profile.upstream_calls.append((duration, record.status))
+            metrics.count("triptuner_upstream_requests_total", {"status": str(record.status)})
+            metrics.observe("triptuner_upstream_duration_seconds", {}, duration, DURATION_BUCKETS)
+
+
+class UpstreamCall:
+    status = None
+
+
+def record_cache(outcome, amount=1):
+    """
+    Record forecast cache outcomes (hits, misses, stale, coalesced) for the current request
+    """
+    profile = current_profile.get()
+    if profile is not None:
+        profile.cache[outcome] += amount
+        metrics.count("triptuner_forecast_cache_total", {"outcome": outcome}, amount)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    Thread-safe in-memory counters, gauges and histograms, rendered in Prometheus text format
+    """
+
+    HELP = {
+        "triptuner_request_duration_seconds": "Time spent handling requests",
+        "triptuner_db_duration_seconds": "Time spent in database queries per request",
+        "triptuner_db_queries": "Database queries per request",
+        "triptuner_serialize_duration_seconds": "Time spent in DRF serialization per request",
+        "triptuner_upstream_duration_seconds": "Duration of Open-Meteo calls made by requests",
+        "triptuner_upstream_requests_total": "Open-Meteo calls made by requests, by response status",
+        "triptuner_forecast_cache_total": "Forecast cache lookups made by requests, by outcome",
+        "triptuner_upstream_queue_depth": "Open-Meteo calls waiting for a rate limit token, by priority",
+        "triptuner_upstream_wait_seconds": "Time Open-Meteo calls spent waiting for a rate limit token, by priority",
+        "triptuner_upstream_rejected_total": "Open-Meteo calls given up on by the rate limiter or circuit breaker",
+        "triptuner_upstream_circuit_opened_total": "Times the Open-Meteo circuit breaker was opened",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._counters = defaultdict(Counter)
+            self._gauges = defaultdict(Counter)
+            self._histograms = defaultdict(dict)
+            self._buckets = {}
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items()))
+
+    def count(self, name, labels, amount=1):
+        with self._lock:
+            self._counters[name][self._labels(labels)] += amount
+
+    def gauge(self, name, labels, amount):
+        """
+        Move a gauge up or down by `amount`
+        """
+        with self._lock:
+            self._gauges[name][self._labels(labels)] += amount
+
+    def observe(self, name, labels, value, buckets):
+        with self._lock:
+            self._buckets[name] = buckets
+            series = self._histograms[name].setdefault(self._labels(labels), [[0] * len(buckets), 0.0, 0])
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines += [f"# HELP {name} {self.HELP.get(name, name)}", f"# TYPE {name} counter"]
+                lines += [f"{name}{self._format_labels(labels)} {value}" for labels, value in sorted(series.items())]
+            for name, series in sorted(self._gauges.items()):
+                lines += [f"# HELP {name} {self.HELP.get(name, name)}", f"# TYPE {name} gauge"]
+                lines += [f"{name}{self._format_labels(labels)} {value}" for labels, value in sorted(series.items())]
+            for name, series in sorted(self._histograms.items()):
+                lines += [f"# HELP {name} {self.HELP.get(name, name)}", f"# TYPE {name} histogram"]
+                for labels, (counts, total, count) in sorted(series.items()):
+                    for bound, bucket_count in zip(self._buckets[name], counts):
+                        bucket_labels = self._format_labels(labels + (("le", f"{bound:g}"),))
+                        lines.append(f"{name}_bucket{bucket_labels} {bucket_count}")
+                    lines.append(f"{name}_bucket{self._format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {total:g}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class RequestProfilingMiddleware:
+    """
+    Profiles requests when `REQUEST_PROFILING["ENABLED"]` is set, see the module docstring
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = profiling_settings()
+        if not config["ENABLED"]:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.cprofile_token = config["CPROFILE_TOKEN"]
+        self.cprofile_dir = config["CPROFILE_DIR"]
+
+        install_serializer_timer()
+        connection_created.connect(install_query_recorder, dispatch_uid="triptuner_profiling")
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        profile, profiler, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile, profiler)
+
+    async def __acall__(self, request):
+        profile, profiler, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile, profiler)
+
+    def start(self, request):
+        # Connections opened before the middleware was loaded don't get the connection_created signal
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        profiler = None
+        header = request.headers.get("X-Profile")
+        if self.cprofile_token and header and hmac.compare_digest(header, self.cprofile_token):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profile, profiler, token
+
+    def finish(self, request, response, profile, profiler):
+        total = time.perf_counter() - profile.started
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+            path = os.path.join(self.cprofile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(profile)}.prof")
+            profiler.dump_stats(path)
+            response["X-Profile-Output"] = path
+
+        response["Server-Timing"] = profile.server_timing(total)
+
+        match = request.resolver_match
+        labels = {"route": match.view_name if match else "unmatched", "method": request.method}
+        metrics.observe("triptuner_request_duration_seconds", labels, total, DURATION_BUCKETS)
+        metrics.observe("triptuner_db_duration_seconds", labels, profile.db_time, DURATION_BUCKETS)
+        metrics.observe("triptuner_db_queries", labels, profile.db_queries, COUNT_BUCKETS)
+        metrics.observe("triptuner_serialize_duration_seconds", labels, profile.serialize_time, DURATION_BUCKETS)
+        return response
@@ -0,0 +1,78 @@
+"""
+Scoring of destinations against weather preferences.
+
+Hourly forecasts of all candidates are stacked into (destinations, hours) arrays and scored together, so ranking a
+thousand destinations is a handful of numpy operations rather than a Python loop over every hour of every forecast.
+"""
+
+import numpy as np
+
+HOURS_PER_DAY = 24
+
+
+def stack_series(series):
+    """
+    Stack hourly series of possibly different lengths (with None for missing values) into a float array,
+    padded with NaN
+    """
+    width = max((len(values) for values in series), default=0)
+    stacked = np.full((len(series), width), np.nan)
+    for row, values in enumerate(series):
+        count = len(values)
+        stacked[row, :count] = np.array(values, dtype=np.float64)
+    return stacked
+
+
+def daily_totals(hourly):
+    """
+    Sum (destinations, hours) values into (destinations, days) totals, ignoring missing hours.
+    Days without any value are NaN.
+    """
+    destinations, hours = hourly.shape
+    days = -(-hours // HOURS_PER_DAY)
+    padded = np.full((destinations, days * HOURS_PER_DAY), np.nan)
+    padded[:, :hours] = hourly
+    padded = padded.reshape(destinations, days, HOURS_PER_DAY)
+    totals = np.nansum(padded, axis=2)
+    totals[np.isnan(padded).all(axis=2)] = np.nan
+    return totals
+
+
+def fraction(condition, valid):
+    """
+    Per destination, the fraction of valid entries meeting `condition` (0 when none are valid)
+    """
+    counts = valid.sum(axis=1)
+    return np.divide((condition & valid).sum(axis=1), counts, out=np.zeros(len(counts)), where=counts > 0)
+
+
+def mean(values, valid):
+    """
+    Per destination, the mean of the valid entries (NaN when none are valid)
+    """
+    counts = valid.sum(axis=1)
+    totals = np.where(valid, values, 0).sum(axis=1)
+    return np.divide(totals, counts, out=np.full(len(counts), np.nan), where=counts > 0)
+
+
+def score_weather(temperatures, precipitation, min_temperature, max_temperature, max_daily_precipitation):
+    """
+    Score every destination from its hourly temperatures and precipitation, both (destinations, hours) arrays.
+
+    The temperature score is the fraction of hours within [min_temperature, max_temperature], and the dry score the
+    fraction of days with at most `max_daily_precipitation` mm. The score is their mean, between 0 and 1.
+    """
+    valid_hours = ~np.isnan(temperatures)
+    temperature_score = fraction((temperatures >= min_temperature) & (temperatures <= max_temperature), valid_hours)
+
+    daily_precipitation = daily_totals(precipitation)
+    valid_days = ~np.isnan(daily_precipitation)
+    dry_score = fraction(daily_precipitation <= max_daily_precipitation, valid_days)
+
+    return {
+        "score": (temperature_score + dry_score) / 2,
+        "temperature_score": temperature_score,
+        "dry_score": dry_score,
+        "mean_temperature": mean(temperatures, valid_hours),
+        "precipitation_mm": np.nansum(precipitation, axis=1),
+    }
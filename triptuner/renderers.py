@@ -0,0 +1,14 @@
+"""
+JSON rendering for the read-only fast path of list endpoints, see `FastListMixin` in triptuner/views.py.
+"""
+
+import orjson
+
+
+def render_json(data):
+    """
+    Render data made of dicts, lists, strings, ints, bools and None with orjson, byte for byte as DRF's
+    `JSONRenderer` does with the default settings: compact, UTF-8, and with U+2028 and U+2029 escaped.
+    Other types (Decimals, dates, floats) are converted by the caller, as orjson formats them differently.
+    """
+    return orjson.dumps(data).replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
@@ -0,0 +1,84 @@
+"""
+Database routing to read replicas.
+
+The aliases in `settings.DATABASE_REPLICAS` are read-only copies of `default`. Reads go to a replica only while a
+view handles a safe request (see `ReplicaReadMixin` in triptuner/views.py), and each request sticks to one replica.
+Everything else uses the primary: writes, reads once the request has written anything (so it reads its own
+writes), and reads inside transactions opened by the request. Outside of views, e.g. in management commands, all
+queries go to the primary.
+"""
+
+import contextlib
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+current_routing = contextvars.ContextVar("current_routing", default=None)
+
+
+class RequestRouting:
+    """
+    Routing state of a request that may read from a replica
+    """
+
+    def __init__(self):
+        self.replica = None
+        self.pinned = False
+        # Transactions already open when the request started reading, e.g. those of test cases
+        self.atomic_depth = None
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    """
+    Let reads within the block go to a replica, or with `enabled` false, keep them on the primary
+    """
+    token = current_routing.set(RequestRouting() if enabled else None)
+    try:
+        yield
+    finally:
+        current_routing.reset(token)
+
+
+class ReplicaRouter:
+    @staticmethod
+    def replicas():
+        return getattr(settings, "DATABASE_REPLICAS", [])
+
+    def choose_replica(self, replicas):
+        return random.choice(replicas)
+
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        replicas = self.replicas()
+        if routing is None or routing.pinned or not replicas:
+            return DEFAULT_DB_ALIAS
+
+        depth = len(connections[DEFAULT_DB_ALIAS].atomic_blocks)
+        if routing.atomic_depth is None:
+            routing.atomic_depth = depth
+        if depth > routing.atomic_depth:
+            return DEFAULT_DB_ALIAS
+
+        if routing.replica is None:
+            routing.replica = self.choose_replica(replicas)
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *self.replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in self.replicas():
+            return False
+        return None
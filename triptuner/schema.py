@@ -0,0 +1,158 @@
+"""
+Precomputed OpenAPI schema.
+
+Generating the schema introspects every view and serializer, which takes hundreds of milliseconds, so it is built
+once per code version instead of on every request to `/api/schema/`: at deploy time with
+`python manage.py build_schema`, which writes it to `API_SCHEMA["DIRECTORY"]`, or else on the first request of each
+worker. Both formats (YAML and JSON) are kept in memory rendered and pre-compressed with gzip and brotli, and are
+served with an ETag.
+
+The code version is a hash of the project sources, the drf-spectacular version and its settings, so schema files
+built for a previous deploy are not served after any of them changed.
+"""
+
+import gzip
+import hashlib
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import brotli
+import drf_spectacular
+from django.conf import settings
+from django.utils import translation
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+
+DEFAULT_API_SCHEMA_SETTINGS = {
+    "DIRECTORY": None,
+}
+
+RENDERERS = {"yaml": OpenApiYamlRenderer, "json": OpenApiJsonRenderer}
+
+# Content encodings of the pre-compressed variants, in order of preference, with their file suffixes
+ENCODINGS = {
+    "br": (lambda body: brotli.compress(body, quality=11), ".br"),
+    "gzip": (lambda body: gzip.compress(body, compresslevel=9, mtime=0), ".gz"),
+}
+
+
+def api_schema_settings():
+    return {**DEFAULT_API_SCHEMA_SETTINGS, **getattr(settings, "API_SCHEMA", {})}
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """
+    Hash of everything the schema is generated from
+    """
+    digest = hashlib.sha256()
+    spectacular = sorted(getattr(settings, "SPECTACULAR_SETTINGS", {}).items())
+    digest.update(repr((drf_spectacular.__version__, spectacular)).encode())
+    package = Path(__file__).resolve().parent
+    for path in sorted(package.rglob("*.py")):
+        digest.update(str(path.relative_to(package)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def generate_schema():
+    """
+    The schema served by `SpectacularAPIView` to requests without a language or version, as bytes per format
+    """
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    with translation.override(settings.LANGUAGE_CODE):
+        schema = generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+    return {name: renderer().render(schema, renderer_context={}) for name, renderer in RENDERERS.items()}
+
+
+def schema_variant(body, encoded=None):
+    """
+    A rendered schema with its ETag and its body per content encoding, compressed unless given in `encoded`
+    """
+    encoded = encoded or {encoding: compress(body) for encoding, (compress, _) in ENCODINGS.items()}
+    return {"etag": f'W/"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"', "identity": body, **encoded}
+
+
+def schema_directory(directory):
+    return Path(directory) / code_version()
+
+
+def write_schema_files(directory):
+    """
+    Generate the schema into a subdirectory of `directory` named after the code version, and return its path
+    """
+    target = schema_directory(directory)
+    target.mkdir(parents=True, exist_ok=True)
+    for name, body in generate_schema().items():
+        variant = schema_variant(body)
+        (target / f"schema.{name}").write_bytes(body)
+        for encoding, (_, suffix) in ENCODINGS.items():
+            (target / f"schema.{name}{suffix}").write_bytes(variant[encoding])
+    return target
+
+
+def read_schema_files(directory):
+    """
+    The schema variants written by `write_schema_files` for the current code version, or None when missing
+    """
+    source = schema_directory(directory)
+    try:
+        return {
+            name: schema_variant(
+                (source / f"schema.{name}").read_bytes(),
+                {encoding: (source / f"schema.{name}{suffix}").read_bytes() for encoding, (_, suffix) in ENCODINGS.items()},
+            )
+            for name in RENDERERS
+        }
+    except FileNotFoundError:
+        return None
+
+
+class PrecomputedSchema:
+    """
+    The schema variants of this worker, loaded from the schema directory or generated on first use
+    """
+
+    def __init__(self):
+        self._variants = None
+        self._lock = threading.Lock()
+
+    def variants(self):
+        if self._variants is None:
+            with self._lock:
+                if self._variants is None:
+                    directory = api_schema_settings()["DIRECTORY"]
+                    variants = read_schema_files(directory) if directory else None
+                    if variants is None:
+                        variants = {name: schema_variant(body) for name, body in generate_schema().items()}
+                    self._variants = variants
+        return self._variants
+
+    def clear(self):
+        with self._lock:
+            self._variants = None
+
+
+precomputed_schema = PrecomputedSchema()
+
+
+def accepted_encoding(header):
+    """
+    The preferred pre-compressed encoding allowed by an `Accept-Encoding` header, or "identity"
+    """
+    weights = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        weight = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                weight = float(value)
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    for encoding in ENCODINGS:
+        if weights.get(encoding, weights.get("*", 0)) > 0:
+            return encoding
+    return "identity"
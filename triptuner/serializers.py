@@ -1,7 +1,147 @@
+from collections import defaultdict, deque
+
 from django.contrib.auth.models import User
-from rest_framework import serializers
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from triptuner.models import Destination, DestinationClosure, Itinerary, ItineraryDestination
+
+
+def validate_destination_ids(destination_ids):
+    """
+    Check that all destinations exist, with one query
+    """
+    existing = set(Destination.objects.filter(pk__in=set(destination_ids)).values_list("pk", flat=True))
+    missing = sorted(set(destination_ids) - existing)
+    if missing:
+        raise serializers.ValidationError(f"Invalid destination ids: {', '.join(str(pk) for pk in missing)}")
+
+
+@transaction.atomic
+def create_itineraries(items):
+    """
+    Create itineraries and all of their stops with one INSERT each, in a single transaction
+    """
+    stops = [item.pop("itinerarydestination_set", []) for item in items]
+    for item in items:
+        item.pop("version", None)
+    itineraries = Itinerary.objects.bulk_create([Itinerary(**item) for item in items])
+    ItineraryDestination.objects.bulk_create(
+        [
+            ItineraryDestination(itinerary=itinerary, destination_id=stop["destination_id"], visit_order=stop["visit_order"])
+            for itinerary, itinerary_stops in zip(itineraries, stops)
+            for stop in itinerary_stops
+        ]
+    )
+
+    # Load the stops and summaries back for the response with one query each for all itineraries
+    prefetch_related_objects(
+        itineraries, Prefetch("itinerarydestination_set", queryset=ItineraryDestination.objects.order_by("visit_order"))
+    )
+    load_summaries(itineraries)
+    return itineraries
+
+
+def load_summaries(itineraries):
+    """
+    Load the summary fields of itineraries, which the database recomputes when their stops change, with one query
+    """
+    summaries = Itinerary.objects.filter(pk__in=[itinerary.pk for itinerary in itineraries]).values(
+        "pk", *Itinerary.SUMMARY_FIELDS
+    )
+    by_pk = {summary.pop("pk"): summary for summary in summaries}
+    for itinerary in itineraries:
+        for name, value in by_pk.get(itinerary.pk, {}).items():
+            setattr(itinerary, name, value)
+
+
+class VersionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The itinerary was changed by someone else, fetch it again and retry."
+    default_code = "version_conflict"
+
+
+def stop_changes(existing, stops):
+    """
+    The stops to insert, update and delete to turn the `existing` stops of an itinerary into `stops`, dicts with a
+    `visit_order` and a `destination_id` or `id` (or both). Stops given without an id take over an existing stop of
+    the same destination, so only rows that really change are written.
+    """
+    by_id = {stop.id: stop for stop in existing}
+    unknown = sorted(stop["id"] for stop in stops if "id" in stop and stop["id"] not in by_id)
+    if unknown:
+        raise serializers.ValidationError(f"Invalid stop ids: {', '.join(str(pk) for pk in unknown)}")
+    claimed = {stop["id"] for stop in stops if "id" in stop}
+    if len(claimed) != sum("id" in stop for stop in stops):
+        raise serializers.ValidationError("Stops can only be listed once.")
+
+    unclaimed = defaultdict(deque)
+    for stop in sorted(existing, key=lambda stop: stop.visit_order):
+        if stop.id not in claimed:
+            unclaimed[stop.destination_id].append(stop)
+
+    kept, inserts, updates = set(), [], []
+    for item in stops:
+        if "id" in item:
+            stop = by_id[item["id"]]
+        elif "destination_id" not in item:
+            raise serializers.ValidationError("New stops need a destination.")
+        elif unclaimed[item["destination_id"]]:
+            stop = unclaimed[item["destination_id"]].popleft()
+        else:
+            inserts.append(ItineraryDestination(destination_id=item["destination_id"], visit_order=item["visit_order"]))
+            continue
+        kept.add(stop.id)
+        destination_id = item.get("destination_id", stop.destination_id)
+        if (stop.destination_id, stop.visit_order) != (destination_id, item["visit_order"]):
+            stop.destination_id, stop.visit_order = destination_id, item["visit_order"]
+            updates.append(stop)
+
+    deletes = [stop for stop in existing if stop.id not in kept]
+    return inserts, updates, deletes
 
-from triptuner.models import Destination, Itinerary, ItineraryDestination
+
+@transaction.atomic
+def update_itinerary(itinerary, data):
+    """
+    Update an itinerary from `version`, and its stops if given (see `stop_changes`), in a single transaction.
+    Raises VersionConflict when it was updated since.
+
+    The version is checked by the UPDATE of the itinerary itself, so no lock is held beyond this transaction.
+    Stops are written with at most one bulk INSERT, UPDATE and DELETE each.
+    """
+    version = data.pop("version")
+    stops = data.pop("itinerarydestination_set", None)
+    updated_at = timezone.now()
+    updated = Itinerary.objects.filter(pk=itinerary.pk, version=version).update(
+        version=version + 1, updated_at=updated_at, **data
+    )
+    if not updated:
+        raise VersionConflict()
+    for name, value in {**data, "version": version + 1, "updated_at": updated_at}.items():
+        setattr(itinerary, name, value)
+
+    if stops is not None:
+        existing = list(itinerary.itinerarydestination_set.all())
+        inserts, updates, deletes = stop_changes(existing, stops)
+        if deletes:
+            ItineraryDestination.objects.filter(pk__in=[stop.id for stop in deletes]).delete()
+        if updates:
+            ItineraryDestination.objects.bulk_update(updates, ["destination_id", "visit_order"])
+        for stop in inserts:
+            stop.itinerary = itinerary
+        ItineraryDestination.objects.bulk_create(inserts)
+
+        # Serialize the stops without fetching them again
+        removed = {stop.id for stop in deletes}
+        stops = [stop for stop in existing if stop.id not in removed] + inserts
+        itinerary._prefetched_objects_cache = {"itinerarydestination_set": sorted(stops, key=lambda stop: stop.visit_order)}
+        if inserts or updates or deletes:
+            load_summaries([itinerary])
+    return itinerary
 
 
 # Serializers define the API representation.
@@ -12,33 +152,264 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
 
 
 class DestinationSerializer(serializers.ModelSerializer):
+    # Types from the broadest, destinations can only be inside one of a broader or the same type
+    type_levels = {choice: level for level, (choice, _) in enumerate(Destination.DESTINATION_TYPE_CHOICES)}
+
     class Meta:
         model = Destination
-        fields = ["id", "name", "description", "type", "latitude", "longitude"]
+        fields = ["id", "external_id", "name", "description", "type", "parent", "latitude", "longitude"]
+
+    def validate(self, attrs):
+        instance = self.instance
+        parent = attrs["parent"] if "parent" in attrs else getattr(instance, "parent", None)
+        destination_type = attrs.get("type", getattr(instance, "type", None))
+        if parent is None:
+            return attrs
+        if self.type_levels[parent.type] > self.type_levels[destination_type]:
+            raise serializers.ValidationError({"parent": [f"A {destination_type} can not be inside a {parent.type}."]})
+        # The database rejects cycles too, see DestinationClosure
+        if (
+            instance is not None
+            and "parent" in attrs
+            and DestinationClosure.objects.filter(ancestor=instance, descendant=parent).exists()
+        ):
+            raise serializers.ValidationError({"parent": ["A destination can not be inside itself or its descendants."]})
+        return attrs
+
+
+def decimal_string(value, decimal_places=6):
+    """
+    A Decimal as DRF's DecimalField renders it, as a string with `decimal_places` places
+    """
+    if value is None:
+        return None
+    # Values of decimal columns already have `decimal_places` places, and str() is exact for them
+    text = str(value)
+    if text.find(".") == len(text) - decimal_places - 1 and "E" not in text:
+        return text
+    value = serializers.DecimalField(max_digits=None, decimal_places=decimal_places).quantize(value)
+    return format(value, "f")
+
+
+def summary_representation(values):
+    """
+    The `summary` of an itinerary, from a mapping of its summary fields
+    """
+    located = values["min_latitude"] is not None
+    return {
+        "stop_count": values["stop_count"],
+        "route_distance_km": values["route_distance_km"],
+        "bounding_box": (
+            {
+                name: decimal_string(values[name])
+                for name in ("min_latitude", "min_longitude", "max_latitude", "max_longitude")
+            }
+            if located
+            else None
+        ),
+        "centroid": (
+            {
+                "latitude": decimal_string(values["centroid_latitude"]),
+                "longitude": decimal_string(values["centroid_longitude"]),
+            }
+            if located
+            else None
+        ),
+    }
+
+
+def destination_rows(rows):
+    """
+    The representation of `DestinationSerializer` for `.values()` rows, for the read-only fast path of list views
+    """
+    return [
+        {
+            "id": row["id"],
+            "external_id": row["external_id"],
+            "name": row["name"],
+            "description": row["description"],
+            "type": row["type"],
+            "parent": row["parent"],
+            "latitude": decimal_string(row["latitude"]),
+            "longitude": decimal_string(row["longitude"]),
+        }
+        for row in rows
+    ]
+
+
+class NearbyDestinationSerializer(DestinationSerializer):
+    distance_km = serializers.FloatField(read_only=True)
+
+    class Meta(DestinationSerializer.Meta):
+        fields = DestinationSerializer.Meta.fields + ["distance_km"]
+
+
+class NearbyQuerySerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    radius_km = serializers.FloatField(min_value=0, max_value=20000, default=10)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=20)
+
+
+class RankedDestinationSerializer(DestinationSerializer):
+    score = serializers.FloatField(read_only=True)
+    temperature_score = serializers.FloatField(read_only=True)
+    dry_score = serializers.FloatField(read_only=True)
+    mean_temperature = serializers.FloatField(read_only=True, allow_null=True)
+    precipitation_mm = serializers.FloatField(read_only=True)
+
+    class Meta(DestinationSerializer.Meta):
+        fields = DestinationSerializer.Meta.fields + [
+            "score",
+            "temperature_score",
+            "dry_score",
+            "mean_temperature",
+            "precipitation_mm",
+        ]
+
+
+class RankByWeatherSerializer(serializers.Serializer):
+    # Candidates, or every destination matching the query parameter filters when left out
+    destinations = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    min_temperature = serializers.FloatField(default=18)
+    max_temperature = serializers.FloatField(default=28)
+    # Days with more rain than this (in mm) don't count as dry
+    max_daily_precipitation = serializers.FloatField(min_value=0, default=1)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=20)
+
+    def validate(self, data):
+        if data["end_date"] < data["start_date"]:
+            raise serializers.ValidationError("The end date can not be before the start date.")
+        if data["max_temperature"] < data["min_temperature"]:
+            raise serializers.ValidationError("The maximum temperature can not be below the minimum temperature.")
+        return data
+
+
+class OptimizeRouteSerializer(serializers.Serializer):
+    # Keep the current first stop (e.g. the arrival airport) at the start of the route
+    fix_start = serializers.BooleanField(default=True)
+
+
+class StopChangeSerializer(serializers.Serializer):
+    # The version of the itinerary the change is made from
+    version = serializers.IntegerField(min_value=1)
+
+
+class MoveStopSerializer(StopChangeSerializer):
+    stop = serializers.IntegerField()
+    # Position in the visit order, from 1
+    position = serializers.IntegerField(min_value=1)
+
+
+class InsertStopSerializer(StopChangeSerializer):
+    destination = serializers.IntegerField()
+    # At the end when left out
+    position = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_destination(self, value):
+        validate_destination_ids([value])
+        return value
+
+
+class RemoveStopSerializer(StopChangeSerializer):
+    stop = serializers.IntegerField()
 
 
 class ItineraryDestinationSerializer(serializers.ModelSerializer):
-    destination = serializers.PrimaryKeyRelatedField(queryset=Destination.objects.all())
+    # Updates may refer to existing stops by id, see `stop_changes`
+    id = serializers.IntegerField(required=False)
+    # Existence is checked by ItinerarySerializer for all stops at once, instead of one query per stop
+    destination = serializers.IntegerField(source="destination_id")
 
     class Meta:
         model = ItineraryDestination
         fields = ["id", "destination", "visit_order"]
+        extra_kwargs = {"visit_order": {"required": False}}
+
+
+class ItineraryListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        validate_destination_ids(
+            [
+                stop["destination_id"]
+                for item in attrs
+                for stop in item["itinerarydestination_set"]
+                if "destination_id" in stop
+            ]
+        )
+        return attrs
+
+    def create(self, validated_data):
+        return create_itineraries(validated_data)
 
 
 class ItinerarySerializer(serializers.ModelSerializer):
     destinations = ItineraryDestinationSerializer(many=True, source="itinerarydestination_set")
+    # Updates must give the version they were made from, see `update_itinerary`
+    version = serializers.IntegerField(min_value=1, required=False)
+    # Maintained by the database from the stops, see `Itinerary`
+    summary = serializers.SerializerMethodField()
 
     class Meta:
         model = Itinerary
-        fields = ["id", "name", "description", "start_date", "end_date", "destinations"]
+        fields = ["id", "name", "description", "start_date", "end_date", "version", "summary", "destinations"]
+        list_serializer_class = ItineraryListSerializer
+
+    def validate_destinations(self, stops):
+        # Stops without a visit order are visited in the order they are given
+        for position, stop in enumerate(stops, start=1):
+            stop.setdefault("visit_order", position)
+
+        visit_orders = [stop["visit_order"] for stop in stops]
+        if len(set(visit_orders)) != len(visit_orders):
+            raise serializers.ValidationError("Visit orders must be unique within an itinerary.")
+
+        # When creating many itineraries, ItineraryListSerializer checks the destinations of all of them at once
+        if not isinstance(self.parent, serializers.ListSerializer):
+            validate_destination_ids([stop["destination_id"] for stop in stops if "destination_id" in stop])
+        return stops
+
+    def get_summary(self, itinerary) -> dict:
+        return summary_representation({name: getattr(itinerary, name) for name in Itinerary.SUMMARY_FIELDS})
+
+    def validate(self, attrs):
+        if self.instance is not None and "version" not in attrs:
+            raise serializers.ValidationError({"version": "The version the update is made from is required."})
+        return attrs
 
     def create(self, validated_data):
-        destinations = validated_data.pop("itinerarydestination_set", [])
-        itinerary = Itinerary.objects.create(**validated_data)
+        return create_itineraries([validated_data])[0]
+
+    def update(self, instance, validated_data):
+        return update_itinerary(instance, validated_data)
+
 
-        for destination in destinations:
-            ItineraryDestination.objects.create(
-                itinerary=itinerary, destination=destination["destination"], visit_order=len(destinations)
-            )
+def itinerary_rows(rows):
+    """
+    The representation of `ItinerarySerializer` for `.values()` rows, for the read-only fast path of list views.
+    The stops of all itineraries are fetched with one query, ordered as the prefetch of the viewset orders them.
+    """
+    stops = defaultdict(list)
+    stop_rows = (
+        ItineraryDestination.objects.filter(itinerary_id__in=[row["id"] for row in rows])
+        .order_by("visit_order")
+        .values_list("itinerary_id", "id", "destination_id", "visit_order")
+    )
+    for itinerary_id, stop_id, destination_id, visit_order in stop_rows:
+        stops[itinerary_id].append({"id": stop_id, "destination": destination_id, "visit_order": visit_order})
 
-        return itinerary
+    return [
+        {
+            "id": row["id"],
+            "name": row["name"],
+            "description": row["description"],
+            "start_date": row["start_date"].isoformat(),
+            "end_date": row["end_date"].isoformat(),
+            "version": row["version"],
+            "summary": summary_representation(row),
+            "destinations": stops[row["id"]],
+        }
+        for row in rows
+    ]
@@ -38,13 +38,17 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
+    "rest_framework.authtoken",
     "django_filters",
     "drf_spectacular",
     "triptuner",
 ]
 
 MIDDLEWARE = [
+    # Only active when REQUEST_PROFILING["ENABLED"] is set
+    "triptuner.profiling.RequestProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -86,9 +90,61 @@ DATABASES = {
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD"),
         "HOST": os.environ.get("POSTGRES_HOST"),
         "PORT": os.environ.get("POSTGRES_PORT"),
+        # Keep connections open between requests, checking them before reuse
+        "CONN_MAX_AGE": int(os.environ.get("POSTGRES_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Alternatively, with POSTGRES_POOL_MAX_SIZE set, each worker process shares a psycopg pool of up to that many
+# connections between its threads. Pooled connections are returned to the pool after each request.
+if os.environ.get("POSTGRES_POOL_MAX_SIZE"):
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.environ.get("POSTGRES_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.environ.get("POSTGRES_POOL_MAX_SIZE")),
+            # Seconds a request waits for a free connection
+            "timeout": 10,
+        }
+    }
+
+# Read replicas of `default`, as comma separated `host[:port]` values in POSTGRES_REPLICAS. Reads of safe requests
+# to the API go to one of them, see triptuner/routers.py. Test runs use them as mirrors of the test database of
+# `default` rather than creating their own. Leave POSTGRES_REPLICAS unset to run the tests, as a mirror has its own
+# connection, which can't see the uncommitted data of a test case.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.environ.get("POSTGRES_REPLICAS", "").split(",")), start=1):
+    host, _, port = replica.strip().partition(":")
+    DATABASES[f"replica{index}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{index}")
+
+DATABASE_ROUTERS = ["triptuner.routers.ReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Cached forecasts, single-flight locks, the Open-Meteo rate limit and circuit breaker, and cached users and tokens
+# are shared between workers through the cache. Set REDIS_URL (e.g. `redis://localhost:6379/0`, needs the `redis`
+# extra) for a cache shared by all processes. Without it each process keeps its own, which is only fit for
+# development and the tests, and the `triptuner.W001` check warns about it when DEBUG is off.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+if os.environ.get("REDIS_URL"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["REDIS_URL"],
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -134,11 +190,31 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # REST framework config
 REST_FRAMEWORK = {
+    # Tokens (`Authorization: Token <key>`) and their users are resolved through the cache, see triptuner/auth.py.
+    # Session authentication comes first so unauthenticated requests keep getting 403 rather than 401 responses
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "rest_framework.authentication.SessionAuthentication",
+        "triptuner.auth.CachedTokenAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ],
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
+    # Cursor pagination on indexed orderings, see triptuner/pagination.py
+    "DEFAULT_PAGINATION_CLASS": "triptuner.pagination.KeysetPagination",
+    "PAGE_SIZE": 100,
+}
+
+# `ModelBackend` with users and their permissions kept in the cache, see triptuner/auth.py
+AUTHENTICATION_BACKENDS = ["triptuner.auth.CachedModelBackend"]
+
+AUTH_CACHE = {
+    "CACHE_ALIAS": "default",
+    # Seconds users, tokens and permission sets are cached. Changes invalidate them right away through signals, this
+    # only bounds how long changes made without signals (e.g. `QuerySet.update()`) take to apply
+    "TIMEOUT": 5 * 60,
 }
 
 # Swagger documentation settings
@@ -148,3 +224,94 @@ SPECTACULAR_SETTINGS = {
     "VERSION": "0.1.0",
     "SERVE_INCLUDE_SCHEMA": False,
 }
+
+# Precomputed OpenAPI schema, see triptuner/schema.py
+API_SCHEMA = {
+    # Directory `python manage.py build_schema` writes the schema to, and workers read it from. Without it (or a
+    # schema built for the running code), each worker generates the schema on its first request to /api/schema/
+    "DIRECTORY": os.environ.get("API_SCHEMA_DIRECTORY"),
+}
+
+# Open-Meteo forecast cache settings, see triptuner/weather.py
+WEATHER_FORECAST_CACHE = {
+    "CACHE_ALIAS": "default",
+    # Seconds a forecast is served as fresh
+    "TTL": 15 * 60,
+    # Seconds an expired forecast is still served while it is refreshed in the background
+    "STALE_TTL": 60 * 60,
+    # Size of the in-process LRU in front of the shared cache
+    "MAX_ENTRIES": 1024,
+    # Coordinates are rounded to this many decimals (~1km) to build cache keys
+    "COORDINATE_PRECISION": 2,
+    # Locations per Open-Meteo multi-location call, used by the itinerary weather endpoint
+    "BATCH_SIZE": 50,
+    # Seconds a forecast kept in the forecast store (the `Forecast` table) is reused before it is fetched again
+    "STORE_MAX_AGE": 60 * 60,
+    # Seconds an expired forecast is still served while Open-Meteo is throttling us or down
+    "STALE_IF_ERROR_TTL": 24 * 60 * 60,
+}
+
+# Open-Meteo client, see triptuner/weather_client.py. The pool settings apply to the async weather endpoint
+WEATHER_HTTP_CLIENT = {
+    # Forecast endpoint, e.g. a self-hosted Open-Meteo instance or the stub server used by the benchmarks
+    "URL": "https://api.open-meteo.com/v1/forecast",
+    # Keep-alive connections to Open-Meteo per worker
+    "MAX_CONNECTIONS": 100,
+    # Upper bound on Open-Meteo requests in flight per worker, further lookups wait for a slot
+    "MAX_CONCURRENCY": 100,
+    # Seconds per upstream request
+    "TIMEOUT": 10,
+    # Connection errors, timeouts and 502-504 responses are retried with exponential backoff
+    "RETRIES": 2,
+    "BACKOFF": 0.2,
+}
+
+# Rate limit and circuit breaker in front of Open-Meteo, shared by all workers through the cache, see
+# triptuner/weather_client.py. Use a cache shared by the workers (e.g. Redis) for the limits to be global.
+WEATHER_UPSTREAM = {
+    "CACHE_ALIAS": "default",
+    # Open-Meteo calls per second (None to disable the rate limit), and calls that may be made at once after a lull
+    "RATE": 10,
+    "BURST": 20,
+    # Seconds a call made while handling a request may wait for its turn, it fails with a 503 beyond that
+    "MAX_WAIT": 5,
+    # Tokens left to requests by prefetching and background refreshes, which wait up to PREFETCH_MAX_WAIT seconds
+    "PREFETCH_RESERVE": 10,
+    "PREFETCH_MAX_WAIT": 60,
+    # Failed calls in a row (5xx responses, connection errors and timeouts) that open the circuit breaker
+    "FAILURE_THRESHOLD": 5,
+    # Seconds the circuit stays open, unless a 429 response asked for a different delay with Retry-After
+    "RESET_TIMEOUT": 30,
+}
+
+# Background forecast prefetching for upcoming itineraries into the forecast store (`python manage.py
+# prefetch_forecasts`), see triptuner/prefetch.py. Run it more often than STORE_MAX_AGE of WEATHER_FORECAST_CACHE so
+# stored forecasts are refreshed before they are too old to be served.
+WEATHER_PREFETCH = {
+    # Itineraries overlapping this many days from today are prefetched (Open-Meteo forecasts 16 days ahead)
+    "HORIZON_DAYS": 16,
+    # Seconds before a stored forecast is older than STORE_MAX_AGE that it is fetched again
+    "REFRESH_MARGIN": 5 * 60,
+    # Open-Meteo calls in flight, and calls per second
+    "CONCURRENCY": 4,
+    "RATE_LIMIT": 5,
+    # Seconds between runs with `--loop`
+    "INTERVAL": 5 * 60,
+}
+
+# Route optimizer used by `POST /api/itineraries/<id>/optimize-route/`, see triptuner/routing.py
+ROUTE_OPTIMIZER = {
+    # Itineraries with up to this many stops get the exact shortest route, larger ones a 2-opt/Or-opt heuristic
+    "EXACT_MAX_STOPS": 12,
+    # Seconds the heuristic may spend improving a route
+    "TIME_BUDGET": 0.5,
+}
+
+# Opt-in per-request profiling, see triptuner/profiling.py. Adds `Server-Timing` headers to responses and collects
+# per-route histograms, served to admins in Prometheus text format at /api/_metrics/
+REQUEST_PROFILING = {
+    "ENABLED": os.environ.get("REQUEST_PROFILING") == "1",
+    # Requests with an `X-Profile: <token>` header are run under cProfile, and the stats written to CPROFILE_DIR.
+    # Left empty, cProfile capture is disabled.
+    "CPROFILE_TOKEN": os.environ.get("REQUEST_PROFILING_CPROFILE_TOKEN", ""),
+}
@@ -1,12 +1,60 @@
+import asyncio
+import datetime
+import gzip
 import json
+import math
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from zoneinfo import ZoneInfo
 
+import aiohttp
+import brotli
+import numpy as np
 import requests_mock
-from django.contrib.auth.models import User
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, transaction
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
-from triptuner.models import Destination, Itinerary, ItineraryDestination
+from triptuner.auth import user_key
+from triptuner.catalogue import import_destinations, read_geojson
+from triptuner.checks import check_shared_caches
+from triptuner.geo import haversine_km
+from triptuner.models import Destination, DestinationClosure, Forecast, Itinerary, ItineraryDestination
+from triptuner.pagination import KeysetPagination
+from triptuner.prefetch import RateLimiter
+from triptuner.profiling import metrics
+from triptuner.ranking import score_weather, stack_series
+from triptuner.routers import ReplicaRouter, replica_reads
+from triptuner.schema import precomputed_schema, schema_directory
+from triptuner.views import DestinationViewSet, ItineraryViewSet
+from triptuner.visits import utc_offsets, visit_windows
+from triptuner.weather import ForecastCache, cache_settings, forecast_cache, forecast_key
+from triptuner.weather_client import (
+    PREFETCH,
+    AsyncWeatherClient,
+    UpstreamGuard,
+    UpstreamUnavailable,
+    async_weather_client,
+    upstream_guard,
+    upstream_priority,
+)
 
 
 class UserTest(APITestCase):
@@ -24,7 +72,7 @@ class UserTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Check the number of users and contents
-        users = response.json()
+        users = response.json()["results"]
         self.assertEqual(len(users), 2)
         usernames = [user["username"] for user in users]
         self.assertIn("ellie", usernames)
@@ -60,7 +108,7 @@ class DestinationTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Check the number of destinations and contents
-        destinations = response.json()
+        destinations = response.json()["results"]
         self.assertEqual(len(destinations), 2)
         names = [destination["name"] for destination in destinations]
         self.assertIn("Nurnenharad", names)
@@ -77,7 +125,7 @@ class DestinationTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Check the number of destinations and contents
-        destinations = response.json()
+        destinations = response.json()["results"]
         self.assertEqual(len(destinations), 1)
         self.assertEquals(destinations[0]["name"], "Galadorn")
 
@@ -107,6 +155,283 @@ class DestinationTest(APITestCase):
         self.assertEquals(result.description, "A mystical forest land where time flows differently.")
 
 
+class DestinationSearchTest(APITestCase):
+    def setUp(self):
+        Destination.objects.create(
+            name="Galadorn",
+            description="An ancient Elven stronghold hidden deep within the Ered Luin mountains.",
+            type="city",
+        )
+        Destination.objects.create(
+            name="Ered Luin",
+            description="The Blue Mountains, west of Eriador.",
+            type="poi",
+        )
+        Destination.objects.create(
+            name="Nurnenharad",
+            description="A volcanic wasteland south of Mordor.",
+            type="poi",
+        )
+
+    def search(self, **query_params):
+        response = self.client.get("/api/destinations/", query_params=query_params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [destination["name"] for destination in response.json()["results"]]
+
+    def test_search_ranked(self):
+        """
+        Ensure name matches rank above description matches
+        """
+        self.assertEqual(self.search(q="ered luin"), ["Ered Luin", "Galadorn"])
+
+    def test_search_prefix_and_typos(self):
+        self.assertEqual(self.search(q="galad"), ["Galadorn"])
+        self.assertEqual(self.search(q="Nurnenharrad"), ["Nurnenharad"])
+
+    def test_search_filtered_by_type(self):
+        self.assertEqual(self.search(q="mountains", type="city"), ["Galadorn"])
+
+    def test_search_updated_on_save(self):
+        destination = Destination.objects.get(name="Nurnenharad")
+        destination.description = "Slaves toil near the Sea of Nurnen."
+        destination.save()
+
+        self.assertEqual(self.search(q="slaves"), ["Nurnenharad"])
+        self.assertEqual(self.search(q="volcanic"), [])
+
+
+class DestinationHierarchyTests(APITestCase):
+    def setUp(self):
+        self.middle_earth = Destination.objects.create(name="Middle-earth", type="country")
+        self.gondor = Destination.objects.create(name="Gondor", type="country", parent=self.middle_earth)
+        self.minas_tirith = Destination.objects.create(name="Minas Tirith", type="city", parent=self.gondor)
+        self.citadel = Destination.objects.create(name="Citadel", type="poi", parent=self.minas_tirith)
+        self.rohan = Destination.objects.create(name="Rohan", type="country", parent=self.middle_earth)
+        self.edoras = Destination.objects.create(name="Edoras", type="city", parent=self.rohan)
+        self.user = User.objects.create_user(username="admin", is_staff=1, is_superuser=1)
+
+    def paths(self, destination):
+        return set(DestinationClosure.objects.filter(descendant=destination).values_list("ancestor__name", "depth"))
+
+    def within(self, destination, **query_params):
+        response = self.client.get("/api/destinations/", query_params={"within": destination.id, **query_params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item["name"] for item in response.json()["results"]]
+
+    def test_closure_maintained_on_insert(self):
+        self.assertEqual(self.paths(self.citadel), {("Citadel", 0), ("Minas Tirith", 1), ("Gondor", 2), ("Middle-earth", 3)})
+
+        # Rows of one statement may be inside each other
+        shire = Destination(id=1000, name="The Shire", type="country", parent=self.middle_earth)
+        hobbiton = Destination(id=1001, name="Hobbiton", type="city", parent_id=1000)
+        Destination.objects.bulk_create([hobbiton, shire])
+        self.assertEqual(self.paths(hobbiton), {("Hobbiton", 0), ("The Shire", 1), ("Middle-earth", 2)})
+
+    def test_within(self):
+        self.assertEqual(self.within(self.middle_earth), ["Gondor", "Minas Tirith", "Citadel", "Rohan", "Edoras"])
+        self.assertEqual(self.within(self.middle_earth, type="city"), ["Minas Tirith", "Edoras"])
+        self.assertEqual(self.within(self.citadel), [])
+
+        response = self.client.get("/api/destinations/", query_params={"within": "gondor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ancestors(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/destinations/{self.citadel.id}/ancestors/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["name"] for item in response.json()], ["Middle-earth", "Gondor", "Minas Tirith"])
+        self.assertEqual(response.json()[-1]["id"], self.minas_tirith.id)
+
+        self.assertEqual(self.client.get(f"/api/destinations/{self.middle_earth.id}/ancestors/").json(), [])
+        self.assertEqual(self.client.get("/api/destinations/0/ancestors/").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_move(self):
+        """
+        Ensure moving a destination moves its subtree
+        """
+        self.client.force_authenticate(user=self.user)
+        response = self.client.patch(f"/api/destinations/{self.minas_tirith.id}/", {"parent": self.rohan.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["parent"], self.rohan.id)
+
+        self.assertEqual(self.paths(self.citadel), {("Citadel", 0), ("Minas Tirith", 1), ("Rohan", 2), ("Middle-earth", 3)})
+        self.assertEqual(self.within(self.gondor), [])
+        self.assertEqual(self.within(self.rohan), ["Minas Tirith", "Citadel", "Edoras"])
+
+        self.minas_tirith.parent = None
+        self.minas_tirith.save()
+        self.assertEqual(self.paths(self.citadel), {("Citadel", 0), ("Minas Tirith", 1)})
+
+    def test_invalid_parents(self):
+        self.client.force_authenticate(user=self.user)
+        url = f"/api/destinations/{self.gondor.id}/"
+        response = self.client.patch(url, {"parent": self.citadel.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("parent", response.json())
+
+        self.minas_tirith.type = "country"
+        self.minas_tirith.save()
+        response = self.client.patch(url, {"parent": self.minas_tirith.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("parent", response.json())
+
+        self.gondor.parent = self.citadel
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.gondor.save()
+
+    def test_delete_parent(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(f"/api/destinations/{self.gondor.id}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.minas_tirith.refresh_from_db()
+        self.assertIsNone(self.minas_tirith.parent)
+        self.assertEqual(self.paths(self.citadel), {("Citadel", 0), ("Minas Tirith", 1)})
+        self.assertEqual(self.within(self.middle_earth), ["Rohan", "Edoras"])
+
+    def test_itineraries_visiting(self):
+        for name, destination in (("Errand", self.citadel), ("Ride", self.edoras), ("Council", self.middle_earth)):
+            itinerary = Itinerary.objects.create(name=name, start_date="2025-03-01", end_date="2025-03-05")
+            ItineraryDestination.objects.create(itinerary=itinerary, destination=destination, visit_order=1)
+
+        def visiting(destination):
+            response = self.client.get("/api/itineraries/", query_params={"visits": destination.id})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(item["name"] for item in response.json()["results"])
+
+        self.assertEqual(visiting(self.middle_earth), ["Council", "Errand", "Ride"])
+        self.assertEqual(visiting(self.gondor), ["Errand"])
+        self.assertEqual(visiting(self.citadel), ["Errand"])
+
+
+class NearbyDestinationTest(APITestCase):
+    def setUp(self):
+        self.london = Destination.objects.create(name="London", type="city", latitude=51.5074, longitude=-0.1278)
+        self.big_ben = Destination.objects.create(name="Big Ben", type="poi", latitude=51.5007, longitude=-0.1246)
+        self.oxford = Destination.objects.create(name="Oxford", type="city", latitude=51.7520, longitude=-1.2577)
+        self.paris = Destination.objects.create(name="Paris", type="city", latitude=48.8566, longitude=2.3522)
+        Destination.objects.create(name="Atlantis", type="city")
+
+    def test_get_nearby(self):
+        """
+        Ensure destinations within the radius are returned nearest first, with their distance
+        """
+        response = self.client.get("/api/destinations/nearby/", query_params={"lat": 51.5, "lon": -0.12, "radius_km": 100})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        destinations = response.json()
+        self.assertEqual([destination["name"] for destination in destinations], ["Big Ben", "London", "Oxford"])
+        self.assertAlmostEqual(destinations[2]["distance_km"], haversine_km(51.5, -0.12, 51.7520, -1.2577), places=3)
+
+    def test_get_nearby_filtered(self):
+        query_params = {"lat": 51.5, "lon": -0.12, "radius_km": 1000, "limit": 2, "type": "city"}
+        response = self.client.get("/api/destinations/nearby/", query_params=query_params)
+
+        self.assertEqual([destination["name"] for destination in response.json()], ["London", "Oxford"])
+
+    def test_get_nearby_across_antimeridian(self):
+        fiji = Destination.objects.create(name="Fiji", type="country", latitude=-17.7, longitude=178.0)
+        samoa = Destination.objects.create(name="Samoa", type="country", latitude=-13.8, longitude=-172.1)
+
+        response = self.client.get("/api/destinations/nearby/", query_params={"lat": -16, "lon": 179.9, "radius_km": 1500})
+
+        self.assertEqual([destination["id"] for destination in response.json()], [fiji.id, samoa.id])
+
+    def test_get_nearby_invalid(self):
+        response = self.client.get("/api/destinations/nearby/", query_params={"lat": 91, "lon": 0})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("lat", response.json())
+
+    def test_haversine_km(self):
+        self.assertAlmostEqual(haversine_km(51.5074, -0.1278, 48.8566, 2.3522), 343.5, places=0)
+        self.assertAlmostEqual(haversine_km(0, 179.5, 0, -179.5), 111.2, places=0)
+
+
+class RankByWeatherTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        forecast_cache.clear()
+
+        # The stub forecasts below are warm south of 30 degrees, and wet between 15 and 30 degrees
+        self.warm_dry = Destination.objects.create(name="Warm and dry", type="city", latitude=10, longitude=0)
+        self.warm_wet = Destination.objects.create(name="Warm and wet", type="city", latitude=20, longitude=0)
+        self.cold_dry = Destination.objects.create(name="Cold and dry", type="poi", latitude=60, longitude=0)
+        self.nowhere = Destination.objects.create(name="Nowhere", type="city")
+        self.url = reverse("destination-rank-by-weather")
+
+    @staticmethod
+    def respond(request, context):
+        forecasts = []
+        for latitude in request.qs["latitude"][0].split(","):
+            latitude = float(latitude)
+            temperature = 25.0 if latitude < 30 else 5.0
+            rain = 0.5 if 15 < latitude < 30 else 0.0
+            forecasts.append({"hourly": {"temperature_2m": [temperature] * 48, "precipitation": [rain] * 48}})
+        return forecasts if len(forecasts) > 1 else forecasts[0]
+
+    def rank(self, query=None, **data):
+        url = f"{self.url}?{query}" if query else self.url
+        return self.client.post(url, data={"start_date": "2024-09-20", "end_date": "2024-09-21", **data}, format="json")
+
+    @requests_mock.Mocker()
+    def test_rank_by_weather(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+        ids = [self.cold_dry.id, self.warm_wet.id, self.warm_dry.id, self.nowhere.id]
+
+        # The candidates, and their forecasts missing from the cache looked up in the forecast store
+        with self.assertNumQueries(2):
+            response = self.rank(destinations=ids)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ranked = response.json()
+        # Ties are broken by id
+        self.assertEqual([item["id"] for item in ranked], [self.warm_dry.id, self.warm_wet.id, self.cold_dry.id])
+        self.assertEqual([item["score"] for item in ranked], [1.0, 0.5, 0.5])
+        self.assertEqual(ranked[1]["temperature_score"], 1.0)
+        self.assertEqual(ranked[1]["dry_score"], 0.0)
+        self.assertEqual(ranked[1]["precipitation_mm"], 24.0)
+        self.assertEqual(ranked[2]["mean_temperature"], 5.0)
+
+        # All candidates in one upstream call
+        self.assertEqual(mocker.call_count, 1)
+        self.assertEqual(mocker.last_request.qs["hourly"], ["temperature_2m,precipitation"])
+        self.assertEqual(mocker.last_request.qs["start_date"], ["2024-09-20"])
+
+    @requests_mock.Mocker()
+    def test_rank_by_weather_preferences(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+
+        response = self.rank(min_temperature=0, max_temperature=10, max_daily_precipitation=20, limit=1)
+
+        self.assertEqual([item["id"] for item in response.json()], [self.cold_dry.id])
+
+    @requests_mock.Mocker()
+    def test_rank_by_weather_filtered(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+
+        response = self.rank(query="type=city")
+
+        self.assertEqual([item["id"] for item in response.json()], [self.warm_dry.id, self.warm_wet.id])
+
+    def test_rank_by_weather_invalid(self):
+        response = self.rank(end_date="2024-09-19")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"non_field_errors": ["The end date can not be before the start date."]})
+
+    def test_score_weather_missing_hours(self):
+        temperatures = stack_series([[20.0, None, 30.0], [None, None]])
+        precipitation = stack_series([[0.0] * 30, []])
+
+        scores = score_weather(temperatures, precipitation, 15, 25, 1)
+
+        self.assertEqual(scores["temperature_score"].tolist(), [0.5, 0.0])
+        self.assertEqual(scores["dry_score"].tolist(), [1.0, 0.0])
+        self.assertEqual(scores["mean_temperature"][0], 25.0)
+        self.assertTrue(math.isnan(scores["mean_temperature"][1]))
+
+
 class ItineraryTest(APITestCase):
     def setUp(self):
         # Create destinations, dummy data provided by an LLM.
@@ -157,67 +482,2200 @@ class ItineraryTest(APITestCase):
 
         self.assertEquals(result.destinations.all()[0].description, "A vast savanna rich in biodiversity.")
 
+    def post_itinerary(self, destinations, name="Trip 1"):
+        data = {"name": name, "start_date": "2024-09-23", "end_date": "2024-09-25", "destinations": destinations}
+        self.client.force_authenticate(user=self.user)
+        return self.client.post("/api/itineraries/", data=json.dumps(data), content_type="application/json")
 
-class ItineraryDestinationWeatherViewTests(APITestCase):
-
-    def setUp(self):
-        # Set up some test data
-        self.destination = Destination.objects.create(name="Test City", type="city", latitude=51.5074, longitude=-0.1278)
+    def test_post_itinerary_visit_order(self):
+        """
+        Ensure stops keep the visit order they are given, or the order they are listed in
+        """
+        response = self.post_itinerary(
+            [
+                {"destination": self.destination2.id, "visit_order": 2},
+                {"destination": self.destination1.id, "visit_order": 1},
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([stop["visit_order"] for stop in response.json()["destinations"]], [1, 2])
+        self.assertEqual(
+            [stop["destination"] for stop in response.json()["destinations"]], [self.destination1.id, self.destination2.id]
+        )
 
-        self.itinerary = Itinerary.objects.create(
-            name="Test Itinerary",
-            description="Test itinerary description",
-            start_date="2024-09-20",
-            end_date="2024-09-25",
+        response = self.post_itinerary(
+            [{"destination": self.destination1.id}, {"destination": self.destination2.id}], name="Trip 2"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        stops = ItineraryDestination.objects.filter(itinerary__name="Trip 2")
+        self.assertEqual(
+            [(stop.destination_id, stop.visit_order) for stop in stops],
+            [(self.destination1.id, 1), (self.destination2.id, 2)],
         )
 
-        self.itinerary_destination = ItineraryDestination.objects.create(
-            itinerary=self.itinerary, destination=self.destination, visit_order=1
+    def test_post_itinerary_invalid(self):
+        """
+        Ensure unknown destinations and duplicate visit orders are rejected, without creating anything
+        """
+        response = self.post_itinerary([{"destination": self.destination1.id}, {"destination": 0}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"destinations": ["Invalid destination ids: 0"]})
+
+        response = self.post_itinerary(
+            [
+                {"destination": self.destination1.id, "visit_order": 1},
+                {"destination": self.destination2.id, "visit_order": 1},
+            ]
         )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Itinerary.objects.exists())
 
-    @requests_mock.Mocker()
-    def test_get_weather_success(self, mocker):
-        # Mock the Open-Meteo API response
-        mocker.get(
-            "https://api.open-meteo.com/v1/forecast",
-            json={"hourly": {"temperature_2m": [15.0, 16.0, 17.0]}},
-            status_code=200,
+    def test_post_itinerary_queries(self):
+        """
+        Ensure the number of queries does not grow with the number of stops
+        """
+        destinations = [{"destination": self.destination1.id}, {"destination": self.destination2.id}] * 20
+        self.client.force_authenticate(user=self.user)
+        self.post_itinerary(destinations[:2], name="Warm up")
+
+        # Destination check, savepoint, itinerary insert, stops insert, release savepoint, stops and summary for the
+        # response
+        with self.assertNumQueries(7):
+            response = self.post_itinerary(destinations)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.json()["destinations"]), 40)
+
+    def test_post_itineraries_bulk(self):
+        """
+        Ensure we can create many itineraries in one request
+        """
+        data = [
+            {
+                "name": f"Trip {index}",
+                "start_date": "2024-09-23",
+                "end_date": "2024-09-25",
+                "destinations": [{"destination": self.destination1.id}, {"destination": self.destination2.id}],
+            }
+            for index in range(10)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+        with self.assertNumQueries(7):
+            response = self.client.post("/api/itineraries/bulk/", data=json.dumps(data), content_type="application/json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([itinerary["name"] for itinerary in response.json()], [f"Trip {index}" for index in range(10)])
+        self.assertEqual(ItineraryDestination.objects.count(), 20)
+        self.assertEqual(len(response.json()[9]["destinations"]), 2)
+
+    def test_post_itineraries_bulk_invalid(self):
+        data = [
+            {"name": "Trip", "start_date": "2024-09-23", "end_date": "2024-09-25", "destinations": [{"destination": 0}]},
+        ]
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post("/api/itineraries/bulk/", data=json.dumps(data), content_type="application/json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"non_field_errors": ["Invalid destination ids: 0"]})
+        self.assertFalse(Itinerary.objects.exists())
+
+
+class ItineraryUpdateTests(APITestCase):
+    def setUp(self):
+        self.destinations = [
+            Destination.objects.create(name=f"Destination {index}", type="city", latitude=index, longitude=index)
+            for index in range(50)
+        ]
+        self.itinerary = Itinerary.objects.create(name="Trip", start_date="2024-09-20", end_date="2024-09-25")
+        self.stops = ItineraryDestination.objects.bulk_create(
+            ItineraryDestination(itinerary=self.itinerary, destination=destination, visit_order=visit_order)
+            for visit_order, destination in enumerate(self.destinations, start=1)
         )
+        self.url = f"/api/itineraries/{self.itinerary.id}/"
+        self.client.force_authenticate(user=User.objects.create_user(username="admin", is_staff=1, is_superuser=1))
 
-        # Make request to the view
-        url = reverse(
-            "get_itinerary_destination_weather",
-            kwargs={
-                "itinerary_id": self.itinerary.id,
-                "itinerary_destination_order": self.itinerary_destination.visit_order,
-            },
+    def stops_in_order(self):
+        return list(self.itinerary.itinerarydestination_set.order_by("visit_order").values_list("id", "destination_id"))
+
+    def test_patch(self):
+        response = self.client.patch(self.url, {"name": "Long trip", "version": 1}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.json()["name"], response.json()["version"]), ("Long trip", 2))
+        self.assertEqual(len(response.json()["destinations"]), 50)
+
+        # Updates made from an older version, or without one, are rejected
+        response = self.client.patch(self.url, {"name": "Short trip", "version": 1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = self.client.patch(self.url, {"name": "Short trip"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Itinerary.objects.get().name, "Long trip")
+
+    def test_put_keeps_unchanged_stops(self):
+        """
+        Stops are matched by id or destination, and only rows that changed are written
+        """
+        data = self.client.get(self.url).json()
+        stops = data["destinations"]
+        data["destinations"] = [
+            {"id": stops[1]["id"]},
+            {"id": stops[0]["id"]},
+            *({"destination": stop["destination"]} for stop in stops[2:-1]),
+            {"destination": self.destinations[0].id},
+        ]
+        data["destinations"][0]["destination"] = stops[1]["destination"]
+        data["destinations"][1]["destination"] = stops[0]["destination"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        ids = [stop.id for stop in self.stops]
+        self.assertEqual(
+            self.stops_in_order(),
+            [(ids[1], self.destinations[1].id), (ids[0], self.destinations[0].id)]
+            + [(stop.id, stop.destination_id) for stop in self.stops[2:-1]]
+            + [(ids[-1] + 1, self.destinations[0].id)],
         )
+        writes = [query["sql"].split()[0] for query in queries.captured_queries]
+        self.assertEqual((writes.count("INSERT"), writes.count("UPDATE"), writes.count("DELETE")), (1, 2, 1))
 
-        response = self.client.get(url)
+    def test_move_stop(self):
+        stops = [stop.id for stop in self.stops]
+
+        # The itinerary and its stops, the version check, one bulk update and the new summary, within a savepoint
+        with self.assertNumQueries(7):
+            response = self.client.post(f"{self.url}move-stop/", {"stop": stops[-1], "position": 49, "version": 1})
 
-        # Check that the response is successful and contains mocked weather data
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn("hourly", response.json())
-        self.assertIn("temperature_2m", response.json()["hourly"])
+        self.assertEqual([stop["id"] for stop in response.json()["destinations"]], stops[:-2] + [stops[-1], stops[-2]])
+        self.assertEqual([stop for stop, _ in self.stops_in_order()], stops[:-2] + [stops[-1], stops[-2]])
 
-    @requests_mock.Mocker()
-    def test_get_weather_missing_coordinates(self, mocker):
-        # Update destination to have no coordinates
-        self.destination.latitude = None
-        self.destination.longitude = None
-        self.destination.save()
+        response = self.client.post(f"{self.url}move-stop/", {"stop": stops[0], "position": 2, "version": 1})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = self.client.post(f"{self.url}move-stop/", {"stop": 0, "position": 2, "version": 2})
+        self.assertEqual(response.json(), {"stop": ["Stop 0 is not part of this itinerary."]})
 
-        # Make request to the view
-        url = reverse(
-            "get_itinerary_destination_weather",
-            kwargs={
-                "itinerary_id": self.itinerary.id,
-                "itinerary_destination_order": self.itinerary_destination.visit_order,
+    def test_insert_and_remove_stop(self):
+        destination = Destination.objects.create(name="Lothurien", type="country")
+        response = self.client.post(f"{self.url}insert-stop/", {"destination": destination.id, "position": 1, "version": 1})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["destinations"][0]["destination"], destination.id)
+        self.assertEqual([stop["visit_order"] for stop in response.json()["destinations"]], list(range(1, 52)))
+
+        inserted = response.json()["destinations"][0]["id"]
+        response = self.client.post(f"{self.url}remove-stop/", {"stop": inserted, "version": 2})
+        self.assertEqual(response.json()["version"], 3)
+        self.assertEqual(self.stops_in_order(), [(stop.id, stop.destination_id) for stop in self.stops])
+
+
+class ItinerarySummaryTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", is_staff=1, is_superuser=1)
+        self.client.force_authenticate(user=self.user)
+        self.rome = Destination.objects.create(name="Rome", type="city", latitude=41.9, longitude=12.5)
+        self.florence = Destination.objects.create(name="Florence", type="city", latitude=43.8, longitude=11.2)
+        self.venice = Destination.objects.create(name="Venice", type="city", latitude=45.4, longitude=12.3)
+        self.nowhere = Destination.objects.create(name="Nowhere", type="poi")
+        self.fiji = Destination.objects.create(name="Suva", type="city", latitude=-18.1, longitude=178.4)
+        self.samoa = Destination.objects.create(name="Apia", type="city", latitude=-13.8, longitude=-171.8)
+
+    def create_itinerary(self, name, destinations):
+        response = self.client.post(
+            "/api/itineraries/",
+            data={
+                "name": name,
+                "start_date": "2025-05-01",
+                "end_date": "2025-05-07",
+                "destinations": [{"destination": destination.id} for destination in destinations],
             },
+            format="json",
         )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()
 
-        response = self.client.get(url)
+    def names(self, **query_params):
+        response = self.client.get("/api/itineraries/", query_params=query_params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [itinerary["name"] for itinerary in response.json()["results"]]
 
-        # Check for a 400 error due to missing coordinates
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertEqual(response.json(), {"error": "Invalid coordinates for this destination"})
+    def test_summary(self):
+        itinerary = self.create_itinerary("Italy", [self.rome, self.nowhere, self.florence, self.venice])
+        summary = itinerary["summary"]
+        self.assertEqual(summary["stop_count"], 4)
+        # Stops without coordinates are skipped
+        self.assertAlmostEqual(
+            summary["route_distance_km"], haversine_km(41.9, 12.5, 43.8, 11.2) + haversine_km(43.8, 11.2, 45.4, 12.3)
+        )
+        self.assertEqual(
+            summary["bounding_box"],
+            {
+                "min_latitude": "41.900000",
+                "min_longitude": "11.200000",
+                "max_latitude": "45.400000",
+                "max_longitude": "12.500000",
+            },
+        )
+        self.assertEqual(summary["centroid"], {"latitude": "43.700000", "longitude": "12.000000"})
+        self.assertEqual(self.client.get(f"/api/itineraries/{itinerary['id']}/").json()["summary"], summary)
+
+        summary = self.create_itinerary("Unknown", [self.nowhere])["summary"]
+        self.assertEqual(summary, {"stop_count": 1, "route_distance_km": 0.0, "bounding_box": None, "centroid": None})
+
+    def test_summary_follows_stops(self):
+        itinerary = self.create_itinerary("Italy", [self.rome, self.florence])
+        url = f"/api/itineraries/{itinerary['id']}/"
+        stop = itinerary["destinations"][0]["id"]
+
+        response = self.client.post(f"{url}remove-stop/", {"stop": stop, "version": 1})
+        self.assertEqual(response.json()["summary"]["stop_count"], 1)
+        self.assertEqual(response.json()["summary"]["route_distance_km"], 0.0)
+        self.assertEqual(self.client.get(url).json()["summary"], response.json()["summary"])
+
+        # Other itineraries are left alone
+        other = self.create_itinerary("Other", [self.venice, self.rome])
+        etag = self.client.get(url)["ETag"]
+        self.florence.latitude, self.florence.longitude = 44.5, 11.3
+        self.florence.save()
+        self.assertEqual(self.client.get(url).json()["summary"]["bounding_box"]["min_latitude"], "44.500000")
+        self.assertNotEqual(self.client.get(url)["ETag"], etag)
+        self.assertEqual(self.client.get(f"/api/itineraries/{other['id']}/").json()["summary"], other["summary"])
+
+        self.florence.delete()
+        self.assertEqual(self.client.get(url).json()["summary"]["stop_count"], 0)
+
+    def test_filter_and_order(self):
+        self.create_itinerary("Italy", [self.rome, self.florence, self.venice])
+        self.create_itinerary("Rome", [self.rome])
+        self.create_itinerary("Pacific", [self.fiji, self.samoa])
+
+        self.assertEqual(self.names(route_distance_km__lte=500, ordering="-route_distance_km"), ["Italy", "Rome"])
+        self.assertEqual(self.names(stop_count__gte=2, ordering="stop_count"), ["Pacific", "Italy"])
+        self.assertEqual(self.names(ordering="-route_distance_km"), ["Pacific", "Italy", "Rome"])
+        self.assertEqual(self.names(bbox="11,43,12,44"), ["Italy"])
+        self.assertEqual(self.names(bbox="12,41,13,42", ordering="route_distance_km"), ["Rome", "Italy"])
+        # Across the antimeridian
+        self.assertEqual(self.names(bbox="170,-20,-170,-10"), ["Pacific"])
+
+        # Following the cursors of a descending order
+        response = self.client.get("/api/itineraries/", query_params={"ordering": "-route_distance_km", "page_size": 1})
+        names = []
+        while response is not None:
+            names += [itinerary["name"] for itinerary in response.json()["results"]]
+            url = response.json()["next"]
+            response = url and self.client.get(url)
+        self.assertEqual(names, ["Pacific", "Italy", "Rome"])
+
+        for query_params in ({"bbox": "1,2,3"}, {"bbox": "0,50,10,40"}, {"ordering": "name"}):
+            with self.subTest(**query_params):
+                response = self.client.get("/api/itineraries/", query_params=query_params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ordered_pages_use_the_index(self):
+        self.create_itinerary("Italy", [self.rome, self.florence, self.venice])
+        self.create_itinerary("Rome", [self.rome])
+
+        for ordering, index in [
+            ("route_distance_km", "itinerary_distance_id_idx"),
+            ("-route_distance_km", "itinerary_distance_id_idx"),
+            ("stop_count", "itinerary_stop_count_id_idx"),
+            ("-stop_count", "itinerary_stop_count_id_idx"),
+        ]:
+            with self.subTest(ordering=ordering):
+                first_page = self.client.get("/api/itineraries/", {"ordering": ordering, "page_size": 1}).json()
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(first_page["next"])
+                # The table is tiny, so the planner has to be kept from reading it all
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+                    cursor.execute(f"EXPLAIN {queries[0]['sql']}")
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                    cursor.execute("RESET enable_seqscan")
+                self.assertIn(index, plan)
+                self.assertIn("Index Cond: (ROW(", plan)
+
+
+class QueryCountTests(APITestCase):
+    """
+    Pin the number of queries per endpoint, so N+1 regressions fail the build
+    """
+
+    def create_itineraries(self, count, stops=3):
+        destinations = [
+            Destination.objects.create(name=f"Destination {index}", type="city", latitude=index, longitude=index)
+            for index in range(stops)
+        ]
+        for index in range(count):
+            itinerary = Itinerary.objects.create(name=f"Trip {index}", start_date="2024-09-20", end_date="2024-09-25")
+            for visit_order, destination in enumerate(destinations, start=1):
+                ItineraryDestination.objects.create(itinerary=itinerary, destination=destination, visit_order=visit_order)
+        return itinerary
+
+    def test_itinerary_list(self):
+        for count in (1, 10, 50):
+            with self.subTest(itineraries=count):
+                Itinerary.objects.all().delete()
+                self.create_itineraries(count)
+
+                # Itineraries, and their stops in one prefetch
+                with self.assertNumQueries(2):
+                    response = self.client.get("/api/itineraries/")
+                self.assertEqual(len(response.json()["results"]), count)
+
+    def test_itinerary_retrieve(self):
+        itinerary = self.create_itineraries(1, stops=20)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/itineraries/{itinerary.id}/")
+        self.assertEqual([stop["visit_order"] for stop in response.json()["destinations"]], list(range(1, 21)))
+
+    def test_destination_list(self):
+        self.create_itineraries(1, stops=20)
+
+        with self.assertNumQueries(1):
+            self.client.get("/api/destinations/")
+
+    def test_user_list(self):
+        for index in range(10):
+            User.objects.create_user(username=f"user{index}")
+
+        with self.assertNumQueries(1):
+            self.client.get("/api/users/")
+
+    @requests_mock.Mocker()
+    def test_itinerary_weather(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=[{}] * 20)
+        cache.clear()
+        forecast_cache.clear()
+        itinerary = self.create_itineraries(1, stops=20)
+
+        # The itinerary, its stops joined with their destinations, and their forecasts in the forecast store
+        with self.assertNumQueries(3):
+            self.client.get(f"/api/itineraries/{itinerary.id}/weather/")
+
+
+class TokenAuthenticationTests(APITestCase):
+    """
+    Tokens, users and permission sets are resolved from the cache, and dropped from it when they change
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="editor")
+        self.group = Group.objects.create(name="Editors")
+        self.group.permissions.add(Permission.objects.get(codename="add_destination"))
+        self.user.groups.add(self.group)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def post_destination(self):
+        return self.client.post("/api/destinations/", {"name": "Lothurien", "type": "country"})
+
+    def test_warm_cache_makes_no_auth_queries(self):
+        # The token with its user, the user's permissions and the group permissions, then the insert
+        with self.assertNumQueries(4):
+            self.assertEqual(self.post_destination().status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.post_destination().status_code, status.HTTP_201_CREATED)
+
+    def test_permission_changes(self):
+        self.post_destination()
+
+        self.group.permissions.clear()
+        self.assertEqual(self.post_destination().status_code, status.HTTP_403_FORBIDDEN)
+        self.user.user_permissions.add(Permission.objects.get(codename="add_destination"))
+        self.assertEqual(self.post_destination().status_code, status.HTTP_201_CREATED)
+        self.user.user_permissions.clear()
+        self.group.permissions.add(Permission.objects.get(codename="add_destination"))
+        self.assertEqual(self.post_destination().status_code, status.HTTP_201_CREATED)
+        self.group.user_set.remove(self.user)
+        self.assertEqual(self.post_destination().status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_user_and_token_changes(self):
+        self.post_destination()
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.post_destination().status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.post_destination().status_code, status.HTTP_201_CREATED)
+
+        self.token.delete()
+        self.assertEqual(self.post_destination().status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cached_users_leave_out_passwords(self):
+        self.user.set_password("loxodonto")
+        self.user.save()
+        self.post_destination()
+
+        entry = cache.get(user_key(self.user.pk))
+        self.assertEqual(list(entry["fields"]), ["id", "is_superuser", "username", "is_staff", "is_active"])
+        self.assertNotIn(self.user.password, repr(entry))
+
+    def test_session_users_from_the_cache(self):
+        self.client.credentials()
+        self.client.force_login(self.user)
+        self.post_destination()
+
+        # The session, then the insert
+        with self.assertNumQueries(2):
+            self.assertEqual(self.post_destination().status_code, status.HTTP_201_CREATED)
+
+        # Sessions end when the password changes
+        self.user.set_password("loxodonto")
+        self.user.save()
+        self.assertEqual(self.post_destination().status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_obtain_token(self):
+        self.user.set_password("loxodonto")
+        self.user.save()
+        self.client.credentials()
+
+        response = self.client.post(reverse("api_token"), {"username": "editor", "password": "loxodonto"})
+        self.assertEqual(response.json(), {"token": self.token.key})
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        # Several itineraries share a start date, so pages must break ties on id
+        for index in range(7):
+            itinerary = Itinerary.objects.create(
+                name=f"Trip {index}" if index % 2 else "Weekend", start_date=f"2024-09-2{index % 3}", end_date="2024-09-29"
+            )
+        self.itinerary = itinerary
+        self.destination = Destination.objects.create(name="Galadorn", type="city")
+        ItineraryDestination.objects.create(itinerary=itinerary, destination=self.destination, visit_order=1)
+        self.expected = list(Itinerary.objects.order_by("start_date", "id").values_list("id", flat=True))
+
+    def collect(self, url, link="next"):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = response.json()
+            ids.extend(itinerary["id"] for itinerary in page["results"])
+            url = page[link]
+            pages += 1
+        return ids, pages, page
+
+    def test_pages_forward_and_back(self):
+        ids, pages, last_page = self.collect("/api/itineraries/?page_size=2")
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(pages, 4)
+
+        # Walk back from the last page, each page is still in ascending order
+        previous_page = self.client.get(last_page["previous"]).json()
+        self.assertEqual([itinerary["id"] for itinerary in previous_page["results"]], self.expected[-3:-1])
+        ids, pages, first_page = self.collect(last_page["previous"], link="previous")
+        self.assertEqual(pages, 3)
+        self.assertEqual([itinerary["id"] for itinerary in first_page["results"]], self.expected[:2])
+        self.assertIsNone(first_page["previous"])
+        second_page = self.client.get(first_page["next"]).json()
+        self.assertEqual([itinerary["id"] for itinerary in second_page["results"]], self.expected[2:4])
+
+    def test_pages_filtered(self):
+        ids, _, _ = self.collect("/api/itineraries/?page_size=2&name=Weekend")
+        self.assertEqual(
+            ids, list(Itinerary.objects.filter(name="Weekend").order_by("start_date", "id").values_list("id", flat=True))
+        )
+
+    def test_pages_search_results(self):
+        for index in range(5):
+            Destination.objects.create(name=f"Galadorn {index}", type="city")
+
+        names = []
+        url = "/api/destinations/?q=galadorn&page_size=2"
+        while url:
+            page = self.client.get(url).json()
+            names.extend(destination["name"] for destination in page["results"])
+            url = page["next"]
+
+        self.assertEqual(names, ["Galadorn"] + [f"Galadorn {index}" for index in range(5)])
+
+    def test_cursor_row_comparison(self):
+        first_page = self.client.get("/api/itineraries/?page_size=2").json()
+        columns = '("triptuner_itinerary"."start_date", "triptuner_itinerary"."id")'
+
+        with CaptureQueriesContext(connection) as queries:
+            second_page = self.client.get(first_page["next"]).json()
+        self.assertIn(f"WHERE {columns} > (", queries[0]["sql"])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(second_page["previous"])
+        self.assertIn(f"WHERE {columns} < (", queries[0]["sql"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/itineraries/?cursor=not-a-cursor")
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Well-formed cursors with values that don't fit the ordering fields
+        encode_cursor = KeysetPagination().encode_cursor
+        for values, backwards in [
+            (["not-a-date", 1], False),
+            (["2024-09-20", "x"], False),
+            (["2024-09-20", None], False),
+            (["2024-09-20", [1]], False),
+            (["2024-09-20", 1], "yes"),
+        ]:
+            with self.subTest(values=values, backwards=backwards):
+                response = self.client.get("/api/itineraries/", {"cursor": encode_cursor(values, backwards)})
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get("/api/itineraries/", {"cursor": encode_cursor(["2024-09-20", 1], False)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_query_count_per_page_size(self):
+        first_page = self.client.get("/api/itineraries/?page_size=3").json()
+        for page_size in (1, 3, 100):
+            with self.subTest(page_size=page_size):
+                # Page of itineraries, and their stops in one prefetch
+                with self.assertNumQueries(2):
+                    self.client.get(f"/api/itineraries/?page_size={page_size}")
+                with self.assertNumQueries(2):
+                    self.client.get(first_page["next"].replace("page_size=3", f"page_size={page_size}"))
+
+    def test_export_ndjson(self):
+        with mock.patch("triptuner.views.ItineraryViewSet.export_chunk_size", 3):
+            response = self.client.get("/api/itineraries/export/?name=Weekend")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(
+            [row["id"] for row in rows],
+            list(Itinerary.objects.filter(name="Weekend").order_by("start_date", "id").values_list("id", flat=True)),
+        )
+        stops = {row["id"]: row["destinations"] for row in rows}
+        self.assertEqual(stops[self.itinerary.id], [{"id": mock.ANY, "destination": self.destination.id, "visit_order": 1}])
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.destination = Destination.objects.create(name="Galadorn", type="city", latitude=-33.2, longitude=-23.1)
+        self.itineraries = [
+            Itinerary.objects.create(name=f"Trip {index}", start_date="2024-09-20", end_date="2024-09-25")
+            for index in range(3)
+        ]
+        for itinerary in self.itineraries:
+            ItineraryDestination.objects.create(itinerary=itinerary, destination=self.destination, visit_order=1)
+        self.user = User.objects.create_user(username="admin", is_staff=1, is_superuser=1)
+
+    def test_retrieve_not_modified(self):
+        url = f"/api/itineraries/{self.itineraries[0].id}/"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        # Only the updated_at of the itinerary is fetched, the stops aren't
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+        response = self.client.get(url, headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.itineraries[0].save()
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_retrieve_missing(self):
+        response = self.client.get("/api/destinations/0/", headers={"If-None-Match": '"anything"'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_not_modified(self):
+        url = "/api/itineraries/?page_size=2"
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # The ETag covers the row past the end of the page, which decides the next link
+        self.itineraries[2].delete()
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.json()["next"])
+        self.assertNotIn("Last-Modified", response)
+
+    def test_stop_changes_modify_itineraries(self):
+        url = f"/api/itineraries/{self.itineraries[0].id}/"
+        etag = self.client.get(url)["ETag"]
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.delete(f"/api/destinations/{self.destination.id}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["destinations"], [])
+
+
+class FastListTests(APITestCase):
+    """
+    The fast path of list views must render the same bytes as the serializers
+    """
+
+    def setUp(self):
+        self.destinations = [
+            Destination.objects.create(name="Galadorn", type="city", latitude=-33.2, longitude=-23.1),
+            Destination.objects.create(
+                name="Zürich\u2028See", description='Quotes " and \\ and \u2029', type="poi", external_id="zh-1"
+            ),
+            Destination.objects.create(name="Galadorn Bay", type="poi", latitude="1.1234567", longitude=0),
+        ]
+        for index in range(4):
+            itinerary = Itinerary.objects.create(
+                name=f"Trip {index}", start_date=f"2024-09-2{index % 2}", end_date="2024-09-29"
+            )
+            for visit_order, destination in enumerate(reversed(self.destinations[: index + 1]), start=1):
+                ItineraryDestination.objects.create(itinerary=itinerary, destination=destination, visit_order=visit_order)
+
+    def assertSameResponses(self, viewset, url, **kwargs):
+        fast = self.client.get(url, **kwargs)
+        with mock.patch.object(viewset, "fast_list", False):
+            slow = self.client.get(url, **kwargs)
+
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, slow.content)
+        self.assertEqual(fast["Content-Type"], slow["Content-Type"])
+        self.assertEqual(fast["ETag"], slow["ETag"])
+        return fast
+
+    def test_destination_list(self):
+        for url in ("/api/destinations/", "/api/destinations/?page_size=1", "/api/destinations/?q=galadorn"):
+            with self.subTest(url=url):
+                self.assertSameResponses(DestinationViewSet, url)
+
+        # Following the cursors
+        url = "/api/destinations/?page_size=2&q=galadorn"
+        while url:
+            url = self.assertSameResponses(DestinationViewSet, url).json()["next"]
+
+    def test_itinerary_list(self):
+        response = self.assertSameResponses(ItineraryViewSet, "/api/itineraries/?page_size=3")
+        self.assertEqual([len(itinerary["destinations"]) for itinerary in response.json()["results"]], [1, 3, 2])
+        self.assertSameResponses(ItineraryViewSet, response.json()["next"])
+
+        # Itineraries, and their stops in one query
+        with self.assertNumQueries(2):
+            self.client.get("/api/itineraries/")
+
+    def test_other_formats_use_serializer(self):
+        response = self.client.get("/api/destinations/", headers={"Accept": "application/json; indent=2"})
+        self.assertIn(b'\n  "next"', response.content)
+
+        response = self.client.get("/api/destinations/?format=api")
+        self.assertContains(response, "Galadorn Bay")
+
+
+class DestinationCatalogueTests(APITestCase):
+    def setUp(self):
+        self.destination = Destination.objects.create(external_id="gal", name="Galadorn", type="city")
+        self.user = User.objects.create_user(username="admin", is_staff=1, is_superuser=1)
+
+    def test_import_csv(self):
+        rows = [
+            "external_id,name,description,type,latitude,longitude",
+            "gal,Galadorn,An ancient Elven stronghold,city,-33.2,-23.1",
+            "lot,Lothurien,,country,-15.4,45.6",
+            ",Nurnenharad,,poi,,",
+            "lot,Lothurien,A mystical forest,country,-15.4,45.6",
+            "bad,Mordor,,volcano,95,1",
+            "half,Rivendell,,city,10,",
+        ]
+
+        summary = import_destinations(StringIO("\n".join(rows)), "csv", chunk_size=3)
+
+        self.assertEqual(
+            {key: value for key, value in summary.items() if key != "errors"},
+            {"rows": 6, "inserted": 2, "updated": 2, "unchanged": 0, "invalid": 2},
+        )
+        self.assertEqual(
+            summary["errors"],
+            [
+                "Row 5: type must be one of: city, country, poi. latitude must be a number between -90 and 90.",
+                "Row 6: latitude and longitude must be given together.",
+            ],
+        )
+        self.destination.refresh_from_db()
+        self.assertEqual(self.destination.description, "An ancient Elven stronghold")
+        self.assertEqual(str(self.destination.latitude), "-33.200000")
+        # Later rows of an external id win
+        self.assertEqual(Destination.objects.get(external_id="lot").description, "A mystical forest")
+        self.assertTrue(Destination.objects.filter(name="Nurnenharad", external_id=None).exists())
+
+    def test_import_parents(self):
+        self.destination.parent = Destination.objects.create(external_id="lot", name="Lothurien", type="country")
+        self.destination.save()
+        rows = [
+            "external_id,name,description,type,latitude,longitude,parent_external_id",
+            "ton,Tower of Nurn,,poi,,,nur",
+            "cel,Celebrant,,city,,,gal",
+            "mor,Mordor,,country,,,",
+            "nur,Nurnenharad,,city,,,mor",
+            "mis,Misty Peak,,poi,,,fog",
+            "big,Greater Mordor,,country,,,nur",
+            "gal,Galadorn,,city,,,cel",
+        ]
+
+        summary = import_destinations(StringIO("\n".join(rows)), "csv", chunk_size=2)
+
+        self.assertEqual(
+            {key: value for key, value in summary.items() if key != "errors"},
+            {"rows": 7, "inserted": 4, "updated": 0, "unchanged": 0, "invalid": 3},
+        )
+        self.assertEqual(
+            summary["errors"],
+            [
+                "Row 5: parent_external_id fog does not match any destination.",
+                "Row 6: A country can not be inside a city.",
+                "Row 7: A destination can not be inside itself or its descendants.",
+            ],
+        )
+        # Parents that come later in the file are resolved too
+        tower = Destination.objects.get(external_id="ton")
+        ancestors = DestinationClosure.objects.filter(descendant=tower).order_by("-depth")
+        self.assertEqual(list(ancestors.values_list("ancestor__external_id", flat=True)), ["mor", "nur", "ton"])
+        self.assertEqual(Destination.objects.get(external_id="cel").parent, self.destination)
+
+        # Files without the column keep the parents
+        summary = import_destinations(StringIO('{"external_id": "gal", "name": "Galadorn", "type": "city"}'), "ndjson")
+        self.assertEqual(summary["unchanged"], 1)
+        self.destination.refresh_from_db()
+        self.assertEqual(self.destination.parent.external_id, "lot")
+
+        # An empty parent_external_id moves the destination to the top level
+        summary = import_destinations(StringIO("external_id,name,type,parent_external_id\nnur,Nurnenharad,city,"), "csv")
+        self.assertEqual(summary["updated"], 1)
+        self.assertFalse(DestinationClosure.objects.filter(ancestor__external_id="mor", descendant=tower).exists())
+
+    def test_import_parent_cycle(self):
+        Destination.objects.create(external_id="nur", name="Nurnenharad", type="city")
+        rows = ["external_id,name,type,parent_external_id", "gal,Galadorn,city,nur", "nur,Nurnenharad,city,gal"]
+
+        with self.assertRaisesMessage(ValueError, "can not be moved inside itself"):
+            import_destinations(StringIO("\n".join(rows)), "csv")
+        self.assertIsNone(Destination.objects.get(external_id="nur").parent)
+
+    def test_reimport_unchanged(self):
+        data = '{"external_id": "gal", "name": "Galadorn", "type": "city"}\n'
+        updated_at = self.destination.updated_at
+
+        summary = import_destinations(StringIO(data), "ndjson")
+
+        self.assertEqual((summary["inserted"], summary["updated"], summary["unchanged"]), (0, 0, 1))
+        self.destination.refresh_from_db()
+        self.assertEqual(self.destination.updated_at, updated_at)
+
+    def test_read_geojson(self):
+        features = [
+            {"type": "Feature", "id": index, "geometry": {"type": "Point", "coordinates": [index, -index]}, "properties": {}}
+            for index in range(5)
+        ]
+        collection = json.dumps({"type": "FeatureCollection", "name": "places", "features": features, "bbox": [1.5]})
+        sequence = "".join(f"\x1e{json.dumps(feature)}\n" for feature in features)
+
+        for data in (collection, sequence):
+            with self.subTest(data=data[:20]):
+                # A tiny buffer splits values (and numbers) across reads
+                self.assertEqual(list(read_geojson(StringIO(data), read_size=3)), features)
+
+    def test_import_invalid_file(self):
+        data = '{"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {}}, {"type": '
+
+        with self.assertRaises(ValueError):
+            import_destinations(StringIO(data), "geojson", chunk_size=1)
+        self.assertEqual(Destination.objects.count(), 1)
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".geojson", delete=False) as stream:
+            feature = {"type": "Feature", "geometry": {"type": "Point", "coordinates": [45.6, -15.4]}, "properties": {}}
+            json.dump({"type": "FeatureCollection", "features": [{**feature, "properties": {"name": "Lothurien"}}]}, stream)
+        self.addCleanup(os.remove, stream.name)
+        stdout, stderr = StringIO(), StringIO()
+
+        call_command("import_destinations", stream.name, stdout=stdout, stderr=stderr)
+
+        self.assertEqual(stdout.getvalue().strip(), "1 rows: 0 inserted, 0 updated, 0 unchanged, 1 invalid")
+        self.assertIn("Row 1: type must be one of", stderr.getvalue())
+
+    def test_upload(self):
+        upload = SimpleUploadedFile(
+            "places.ndjson", b'{"name": "Lothurien", "type": "country", "latitude": 1, "longitude": 2}'
+        )
+
+        response = self.client.post("/api/destinations/import/", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.user)
+        upload.seek(0)
+        response = self.client.post("/api/destinations/import/", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["inserted"], 1)
+
+        upload = SimpleUploadedFile("places.txt", b"")
+        response = self.client.post("/api/destinations/import/", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_round_trip(self):
+        self.destination.parent = Destination.objects.create(
+            external_id="lot", name="Lothurien", type="country", latitude=-15.4, longitude=45.6
+        )
+        self.destination.save()
+
+        for file_format in ("csv", "ndjson", "geojson"):
+            with self.subTest(file_format=file_format):
+                response = self.client.get("/api/destinations/export/", {"file_format": file_format})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                data = b"".join(response.streaming_content).decode()
+
+                self.assertIn("lot", data.rsplit("gal", 1)[1])
+                summary = import_destinations(StringIO(data), file_format)
+                self.assertEqual((summary["rows"], summary["unchanged"]), (2, 2))
+
+        response = self.client.get("/api/destinations/export/", {"file_format": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        self.destination = Destination.objects.create(name="Galadorn", type="city")
+        self.user = User.objects.create_user(username="admin", is_staff=1, is_superuser=1)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        with mock.patch.object(ReplicaRouter, "replicas", return_value=["replica"]):
+            self.assertEqual(router.db_for_read(Destination), DEFAULT_DB_ALIAS)
+            with replica_reads(False):
+                self.assertEqual(router.db_for_read(Destination), DEFAULT_DB_ALIAS)
+
+            with replica_reads():
+                self.assertEqual(router.db_for_read(Destination), "replica")
+                with transaction.atomic():
+                    self.assertEqual(router.db_for_read(Destination), DEFAULT_DB_ALIAS)
+                self.assertEqual(router.db_for_read(Destination), "replica")
+
+                # Reads after a write see it
+                self.assertEqual(router.db_for_write(Destination), DEFAULT_DB_ALIAS)
+                self.assertEqual(router.db_for_read(Destination), DEFAULT_DB_ALIAS)
+
+        self.assertFalse(router.allow_migrate("replica", "triptuner"))
+
+    def test_safe_requests_read_from_replica(self):
+        # `default` stands in for the replica, to see which requests pick one
+        with (
+            mock.patch.object(ReplicaRouter, "replicas", return_value=[DEFAULT_DB_ALIAS]),
+            mock.patch.object(ReplicaRouter, "choose_replica", return_value=DEFAULT_DB_ALIAS) as choose_replica,
+        ):
+            for url in ("/api/destinations/", "/api/destinations/export/", "/api/itineraries/1/1/weather/async/"):
+                with self.subTest(url=url):
+                    choose_replica.reset_mock()
+                    response = self.client.get(url)
+                    if hasattr(response, "streaming_content"):
+                        b"".join(response.streaming_content)
+                    choose_replica.assert_called_once()
+
+            choose_replica.reset_mock()
+            self.client.force_authenticate(user=self.user)
+            response = self.client.post("/api/destinations/", {"name": "Lothurien", "type": "country"})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            choose_replica.assert_not_called()
+
+
+class ItineraryDestinationWeatherViewTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        forecast_cache.clear()
+
+        # Set up some test data
+        self.destination = Destination.objects.create(name="Test City", type="city", latitude=51.5074, longitude=-0.1278)
+
+        self.itinerary = Itinerary.objects.create(
+            name="Test Itinerary",
+            description="Test itinerary description",
+            start_date="2024-09-20",
+            end_date="2024-09-25",
+        )
+
+        self.itinerary_destination = ItineraryDestination.objects.create(
+            itinerary=self.itinerary, destination=self.destination, visit_order=1
+        )
+
+    @requests_mock.Mocker()
+    def test_get_weather_success(self, mocker):
+        # Mock the Open-Meteo API response
+        mocker.get(
+            "https://api.open-meteo.com/v1/forecast",
+            json={"hourly": {"temperature_2m": [15.0, 16.0, 17.0]}},
+            status_code=200,
+        )
+
+        # Make request to the view
+        url = reverse(
+            "get_itinerary_destination_weather",
+            kwargs={
+                "itinerary_id": self.itinerary.id,
+                "itinerary_destination_order": self.itinerary_destination.visit_order,
+            },
+        )
+
+        response = self.client.get(url)
+
+        # Check that the response is successful and contains mocked weather data
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("hourly", response.json())
+        self.assertIn("temperature_2m", response.json()["hourly"])
+
+    @requests_mock.Mocker()
+    def test_get_weather_missing_coordinates(self, mocker):
+        # Update destination to have no coordinates
+        self.destination.latitude = None
+        self.destination.longitude = None
+        self.destination.save()
+
+        # Make request to the view
+        url = reverse(
+            "get_itinerary_destination_weather",
+            kwargs={
+                "itinerary_id": self.itinerary.id,
+                "itinerary_destination_order": self.itinerary_destination.visit_order,
+            },
+        )
+
+        response = self.client.get(url)
+
+        # Check for a 400 error due to missing coordinates
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"error": "Invalid coordinates for this destination"})
+
+    @requests_mock.Mocker()
+    def test_get_weather_at_zero_coordinates(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json={"hourly": {"temperature_2m": [25.0]}})
+        self.destination.latitude, self.destination.longitude = 0, 0
+        self.destination.save()
+
+        response = self.client.get(
+            reverse(
+                "get_itinerary_destination_weather",
+                kwargs={"itinerary_id": self.itinerary.id, "itinerary_destination_order": 1},
+            )
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mocker.last_request.qs["latitude"], ["0.0"])
+
+    @requests_mock.Mocker()
+    def test_get_weather_is_cached(self, mocker):
+        mocker.get(
+            "https://api.open-meteo.com/v1/forecast",
+            json={"hourly": {"temperature_2m": [15.0, 16.0, 17.0]}},
+            status_code=200,
+        )
+
+        url = reverse(
+            "get_itinerary_destination_weather",
+            kwargs={
+                "itinerary_id": self.itinerary.id,
+                "itinerary_destination_order": self.itinerary_destination.visit_order,
+            },
+        )
+
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        # Only the first request should reach Open-Meteo
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(mocker.call_count, 1)
+        self.assertEqual(forecast_cache.stats()["hits"], 1)
+        self.assertEqual(forecast_cache.stats()["misses"], 1)
+
+    @requests_mock.Mocker()
+    def test_get_weather_beyond_a_week(self, mocker):
+        """
+        The days of a stop more than a week ahead are fetched, rather than Open-Meteo's default week
+        """
+        today = timezone.now().date()
+        self.itinerary.start_date = today + datetime.timedelta(days=10)
+        self.itinerary.end_date = today + datetime.timedelta(days=12)
+        self.itinerary.save()
+        mocker.get(
+            "https://api.open-meteo.com/v1/forecast",
+            json=lambda request, context: hourly_forecast(
+                *(datetime.date.fromisoformat(request.qs[name][0]) for name in ("start_date", "end_date"))
+            ),
+        )
+
+        response = self.client.get(
+            reverse(
+                "get_itinerary_destination_weather",
+                kwargs={"itinerary_id": self.itinerary.id, "itinerary_destination_order": 1},
+            )
+        )
+
+        self.assertEqual(
+            response.json()["daily"]["time"],
+            [(today + datetime.timedelta(days=days)).isoformat() for days in range(10, 13)],
+        )
+        self.assertEqual(response.json()["daily"]["temperature_2m_mean"], [20.0] * 3)
+        self.assertLessEqual(mocker.last_request.qs["start_date"][0], self.itinerary.start_date.isoformat())
+
+
+def hourly_forecast(first, last, latitude=51.5, longitude=-0.13):
+    """
+    An Open-Meteo forecast (in GMT) of hourly temperatures from the `first` to the `last` date
+    """
+    times = [
+        (datetime.datetime.combine(first, datetime.time()) + datetime.timedelta(hours=hour)).strftime("%Y-%m-%dT%H:%M")
+        for hour in range(((last - first).days + 1) * 24)
+    ]
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "utc_offset_seconds": 0,
+        "timezone": "GMT",
+        "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+        "hourly": {"time": times, "temperature_2m": [20.0] * len(times)},
+    }
+
+
+class ForecastStoreTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        forecast_cache.clear()
+
+        # On UTC all year, so local times are the forecast's times
+        destination = Destination.objects.create(name="Reykjavik", type="city", latitude=64.1466, longitude=-21.9426)
+        itinerary = Itinerary.objects.create(name="Test Itinerary", start_date="2024-09-20", end_date="2024-09-25")
+        ItineraryDestination.objects.create(itinerary=itinerary, destination=destination, visit_order=1)
+        self.url = reverse(
+            "get_itinerary_destination_weather",
+            kwargs={"itinerary_id": itinerary.id, "itinerary_destination_order": 1},
+        )
+
+        # A week of hourly temperatures, as returned by Open-Meteo
+        self.times = [
+            (datetime.datetime(2024, 9, 20) + datetime.timedelta(hours=hour)).strftime("%Y-%m-%dT%H:%M")
+            for hour in range(168)
+        ]
+        self.temperatures = [10 + hour % 24 * 0.5 for hour in range(168)]
+        self.temperatures[5] = None
+        self.forecast = {
+            "latitude": 51.5,
+            "longitude": -0.13,
+            "utc_offset_seconds": 0,
+            "timezone": "GMT",
+            "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+            "hourly": {"time": self.times, "temperature_2m": self.temperatures},
+        }
+
+    @requests_mock.Mocker()
+    def test_throttled_upstream(self, mocker):
+        """
+        A 429 opens the circuit breaker: the stored forecast is served whatever its age, and without one the
+        response is a 503 asking to retry after the delay given by Open-Meteo
+        """
+        self.addCleanup(upstream_guard.reset)
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.forecast)
+        expected = self.client.get(self.url).json()
+
+        forecast_cache.clear()
+        cache.clear()
+        mocker.get("https://api.open-meteo.com/v1/forecast", status_code=429, headers={"Retry-After": "42"})
+        with override_settings(WEATHER_FORECAST_CACHE={"STORE_MAX_AGE": 0}):
+            self.assertEqual(self.client.get(self.url).json(), expected)
+            self.assertEqual(mocker.call_count, 2)
+
+            Forecast.objects.all().delete()
+            forecast_cache.clear()
+            cache.clear()
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "42")
+
+        # The circuit is open, so the next request does not call Open-Meteo
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(mocker.call_count, 3)
+
+    @requests_mock.Mocker()
+    def test_forecast_is_stored(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.forecast)
+
+        response = self.client.get(self.url, {"hourly": "true"})
+
+        # The days of the itinerary
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["hourly"], {"time": self.times[:144], "temperature_2m": self.temperatures[:144]})
+        self.assertEqual(response.json()["hourly_units"]["temperature_2m"], "°C")
+
+        # One packed float32 per hour
+        stored = Forecast.objects.get()
+        self.assertEqual((stored.variable, stored.step, len(stored.values)), ("temperature_2m", 3600, 168 * 4))
+        self.assertEqual(stored.start, datetime.datetime(2024, 9, 20, tzinfo=datetime.timezone.utc))
+
+    @requests_mock.Mocker()
+    def test_ranges_are_sliced_from_the_store(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.forecast)
+
+        hours = self.client.get(self.url, {"start": "2024-09-21T06:00", "end": "2024-09-21T08:00", "hourly": "1"})
+        day = self.client.get(self.url, {"start": "2024-09-22", "end": "2024-09-22", "hourly": "1"})
+        with_offset = self.client.get(
+            self.url, {"start": "2024-09-21T08:00+02:00", "end": "2024-09-21T06:30Z", "hourly": "1"}
+        )
+        hours, day = hours.json()["hourly"], day.json()["hourly"]
+
+        self.assertEqual(hours, {"time": self.times[30:33], "temperature_2m": [13.0, 13.5, 14.0]})
+        self.assertEqual(day["time"], self.times[48:72])
+        self.assertEqual(with_offset.json()["hourly"]["time"], ["2024-09-21T06:00"])
+
+        # A week from the first day asked for is fetched once
+        self.assertEqual(mocker.call_count, 1)
+        self.assertEqual(mocker.last_request.qs["start_date"], ["2024-09-21"])
+        self.assertEqual(mocker.last_request.qs["end_date"], ["2024-09-27"])
+
+    @requests_mock.Mocker()
+    def test_uncovered_range_is_fetched(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.forecast)
+        self.client.get(self.url)
+        mocker.get(
+            "https://api.open-meteo.com/v1/forecast",
+            json=hourly_forecast(datetime.date(2024, 9, 20), datetime.date(2024, 10, 6)),
+        )
+
+        response = self.client.get(self.url, {"start": "2024-09-30", "end": "2024-09-30", "hourly": "1"})
+
+        self.assertEqual(response.json()["hourly"]["time"][0], "2024-09-30T00:00")
+        self.assertEqual(response.json()["daily"]["temperature_2m_mean"], [20.0])
+        # Widened to the stored days, which the new forecast replaces
+        self.assertEqual(mocker.call_count, 2)
+        self.assertEqual(mocker.last_request.qs["start_date"], ["2024-09-20"])
+        self.assertEqual(mocker.last_request.qs["end_date"], ["2024-10-06"])
+        self.assertEqual(
+            self.client.get(self.url, {"start": "2024-09-21", "end": "2024-09-21"}).json()["daily"]["time"], ["2024-09-21"]
+        )
+        self.assertEqual(mocker.call_count, 2)
+
+    @requests_mock.Mocker()
+    def test_stored_forecast_expires(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.forecast)
+        self.client.get(self.url)
+
+        Forecast.objects.update(fetched_at=timezone.now() - datetime.timedelta(hours=2))
+        cache.clear()
+        forecast_cache.clear()
+        self.client.get(self.url)
+
+        self.assertEqual(mocker.call_count, 2)
+        self.assertGreater(Forecast.objects.get().fetched_at, timezone.now() - datetime.timedelta(minutes=1))
+
+    def test_invalid_range(self):
+        response = self.client.get(self.url, {"start": "tomorrow"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"error": "Invalid date or time: tomorrow"})
+
+
+class ItineraryWeatherViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        forecast_cache.clear()
+
+        london = Destination.objects.create(name="London", type="city", latitude=51.5074, longitude=-0.1278)
+        paris = Destination.objects.create(name="Paris", type="city", latitude=48.8566, longitude=2.3522)
+        # Close enough to London to share its forecast
+        westminster = Destination.objects.create(name="Westminster", type="poi", latitude=51.5089, longitude=-0.1311)
+        nowhere = Destination.objects.create(name="Nowhere", type="poi")
+
+        self.itinerary = Itinerary.objects.create(name="Trip", start_date="2024-09-20", end_date="2024-09-22")
+        for visit_order, destination in enumerate([paris, london, westminster, nowhere], start=1):
+            ItineraryDestination.objects.create(itinerary=self.itinerary, destination=destination, visit_order=visit_order)
+        self.url = reverse("itinerary-weather", kwargs={"pk": self.itinerary.id})
+
+    @staticmethod
+    def respond(request, context):
+        """
+        Echo the requested locations back, as Open-Meteo does for multi-location queries
+        """
+        latitudes = request.qs["latitude"][0].split(",")
+        longitudes = request.qs["longitude"][0].split(",")
+        forecasts = [{"latitude": float(lat), "longitude": float(lon)} for lat, lon in zip(latitudes, longitudes)]
+        return forecasts if len(forecasts) > 1 else forecasts[0]
+
+    @requests_mock.Mocker()
+    def test_get_itinerary_weather(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+
+        # The itinerary, its stops, and the forecasts of their locations in the forecast store
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stops = response.json()["destinations"]
+        self.assertEqual([stop["visit_order"] for stop in stops], [1, 2, 3, 4])
+        self.assertEqual(stops[0]["forecast"], {"latitude": 48.86, "longitude": 2.35})
+        self.assertEqual(stops[1]["forecast"], {"latitude": 51.51, "longitude": -0.13})
+        self.assertEqual(stops[2]["forecast"], stops[1]["forecast"])
+        self.assertEqual(stops[3]["error"], "Invalid coordinates for this destination")
+
+        # One upstream call for the two distinct locations, clipped to the itinerary dates and a day around them
+        self.assertEqual(mocker.call_count, 1)
+        self.assertEqual(mocker.last_request.qs["start_date"], ["2024-09-19"])
+        self.assertEqual(mocker.last_request.qs["end_date"], ["2024-09-23"])
+
+        # Served from the cache the second time
+        self.client.get(self.url)
+        self.assertEqual(mocker.call_count, 1)
+
+    @requests_mock.Mocker()
+    def test_get_itinerary_weather_on_the_prime_meridian(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+        greenwich = Destination.objects.create(name="Greenwich", type="poi", latitude=51.4779, longitude=0.0)
+        ItineraryDestination.objects.create(itinerary=self.itinerary, destination=greenwich, visit_order=5)
+
+        stops = self.client.get(self.url).json()["destinations"]
+
+        self.assertEqual(stops[4]["forecast"], {"latitude": 51.48, "longitude": 0.0})
+
+    @requests_mock.Mocker()
+    def test_get_itinerary_weather_in_batches(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+
+        with override_settings(WEATHER_FORECAST_CACHE={"BATCH_SIZE": 1}):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mocker.call_count, 2)
+
+    @requests_mock.Mocker()
+    def test_get_itinerary_weather_upstream_error(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", status_code=500)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.json()["error"], "Failed to fetch weather data")
+
+
+class LocalForecastTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        forecast_cache.clear()
+
+        london = Destination.objects.create(name="London", type="city", latitude=51.5074, longitude=-0.1278)
+        paris = Destination.objects.create(name="Paris", type="city", latitude=48.8566, longitude=2.3522)
+        # Two days in each, on British and Central European summer time
+        self.itinerary = Itinerary.objects.create(name="Trip", start_date="2024-09-20", end_date="2024-09-23")
+        for visit_order, destination in enumerate([london, paris], start=1):
+            ItineraryDestination.objects.create(itinerary=self.itinerary, destination=destination, visit_order=visit_order)
+
+        # Hourly temperatures counting the hours from 2024-09-19 00:00 UTC
+        times = [
+            (datetime.datetime(2024, 9, 19) + datetime.timedelta(hours=hour)).strftime("%Y-%m-%dT%H:%M")
+            for hour in range(144)
+        ]
+        temperatures = [float(hour) for hour in range(144)]
+        temperatures[80] = None
+        self.forecast = {
+            "utc_offset_seconds": 0,
+            "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+            "hourly": {"time": times, "temperature_2m": temperatures},
+        }
+
+    def respond(self, request, context):
+        locations = len(request.qs["latitude"][0].split(","))
+        return [self.forecast] * locations if locations > 1 else self.forecast
+
+    @requests_mock.Mocker()
+    def test_stop_forecast(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+        url = reverse(
+            "get_itinerary_destination_weather",
+            kwargs={"itinerary_id": self.itinerary.id, "itinerary_destination_order": 2},
+        )
+
+        forecast = self.client.get(url).json()
+
+        # The last two days of the trip in Paris, from 22:00 UTC the day before, without the missing hour
+        self.assertEqual((forecast["timezone"], forecast["utc_offset_seconds"]), ("Europe/Paris", 7200))
+        self.assertEqual(
+            forecast["daily"],
+            {
+                "time": ["2024-09-22", "2024-09-23"],
+                "temperature_2m_min": [70.0, 94.0],
+                "temperature_2m_max": [93.0, 117.0],
+                "temperature_2m_mean": [81.57, 105.5],
+            },
+        )
+        self.assertEqual(forecast["daily_units"]["temperature_2m_max"], "°C")
+        self.assertNotIn("hourly", forecast)
+
+        hourly = self.client.get(url, {"hourly": "true"}).json()["hourly"]
+        self.assertEqual(len(hourly["time"]), 48)
+        self.assertEqual((hourly["time"][0], hourly["temperature_2m"][0]), ("2024-09-22T00:00", 70.0))
+
+    @requests_mock.Mocker()
+    def test_itinerary_forecasts(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+
+        stops = self.client.get(reverse("itinerary-weather", kwargs={"pk": self.itinerary.id})).json()["destinations"]
+
+        self.assertEqual(
+            [(stop["start_date"], stop["end_date"]) for stop in stops],
+            [("2024-09-20", "2024-09-21"), ("2024-09-22", "2024-09-23")],
+        )
+        london = stops[0]["forecast"]
+        self.assertEqual(london["timezone"], "Europe/London")
+        self.assertEqual(london["daily"]["time"], ["2024-09-20", "2024-09-21"])
+        self.assertEqual(london["daily"]["temperature_2m_min"], [23.0, 47.0])
+        self.assertEqual(london["daily"]["temperature_2m_mean"], [34.5, 58.5])
+        self.assertEqual(stops[1]["forecast"]["daily"]["temperature_2m_max"], [93.0, 117.0])
+        self.assertNotIn("hourly", london)
+
+    def test_visit_windows(self):
+        start = datetime.date(2024, 9, 20)
+
+        self.assertEqual(
+            visit_windows(start, start + datetime.timedelta(days=5), 2),
+            [
+                (start, start + datetime.timedelta(days=2)),
+                (start + datetime.timedelta(days=3), start + datetime.timedelta(days=5)),
+            ],
+        )
+        # More stops than days
+        self.assertEqual(
+            [first.day for first, _ in visit_windows(start, start + datetime.timedelta(days=2), 4)], [20, 20, 21, 22]
+        )
+
+    def test_daylight_saving_change(self):
+        times = np.arange("2024-10-26T22:00", "2024-10-27T04:00", dtype="datetime64[h]")
+
+        self.assertEqual(utc_offsets(times, ZoneInfo("Europe/London")).tolist(), [3600] * 3 + [0] * 3)
+        self.assertEqual(utc_offsets(times, ZoneInfo("Asia/Tokyo")).tolist(), [32400] * 6)
+
+
+class SchemaTests(APITestCase):
+    def setUp(self):
+        precomputed_schema.clear()
+        self.addCleanup(precomputed_schema.clear)
+
+    def test_same_schema_as_generated(self):
+        """
+        The precomputed schema is the one drf-spectacular generates, which still serves other languages
+        """
+        for format in ("json", "yaml"):
+            with self.subTest(format=format):
+                cached = self.client.get(reverse("schema"), {"format": format})
+                generated = self.client.get(reverse("schema"), {"format": format, "lang": "en-us"})
+                self.assertEqual(cached.status_code, status.HTTP_200_OK)
+                self.assertEqual(cached.content, generated.content)
+                self.assertEqual(cached["Content-Type"], generated["Content-Type"])
+                self.assertNotIn("ETag", generated)
+
+    def test_compressed_and_conditional(self):
+        plain = self.client.get(reverse("schema"))
+        gzipped = self.client.get(reverse("schema"), HTTP_ACCEPT_ENCODING="gzip, deflate")
+        compressed = self.client.get(reverse("schema"), HTTP_ACCEPT_ENCODING="gzip;q=0.5, br")
+
+        self.assertEqual(gzipped["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(gzipped.content), plain.content)
+        self.assertEqual(compressed["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(compressed.content), plain.content)
+        self.assertIn("Accept-Encoding", plain["Vary"])
+
+        response = self.client.get(reverse("schema"), HTTP_IF_NONE_MATCH=plain["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_build_schema(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(API_SCHEMA={"DIRECTORY": directory}):
+            call_command("build_schema", stdout=StringIO())
+            self.assertEqual(
+                sorted(path.name for path in schema_directory(directory).iterdir()),
+                ["schema.json", "schema.json.br", "schema.json.gz", "schema.yaml", "schema.yaml.br", "schema.yaml.gz"],
+            )
+
+            # Served from the files, without generating the schema
+            with mock.patch("triptuner.schema.generate_schema", side_effect=AssertionError):
+                response = self.client.get(reverse("schema"), {"format": "json"})
+            self.assertEqual(response.content, (schema_directory(directory) / "schema.json").read_bytes())
+
+
+class OptimizeRouteTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", is_staff=1, is_superuser=1)
+        self.client.force_authenticate(user=self.user)
+
+    def create_itinerary(self, longitudes):
+        """
+        An itinerary whose stops lie along the equator, visited in the given order of longitudes
+        """
+        itinerary = Itinerary.objects.create(name="Trip", start_date="2024-09-20", end_date="2024-09-22")
+        for visit_order, longitude in enumerate(longitudes, start=1):
+            destination = Destination.objects.create(name=f"Stop {longitude}", type="poi", latitude=0, longitude=longitude)
+            ItineraryDestination.objects.create(itinerary=itinerary, destination=destination, visit_order=visit_order)
+        return itinerary
+
+    def optimize(self, itinerary, **data):
+        return self.client.post(reverse("itinerary-optimize-route", kwargs={"pk": itinerary.id}), data=data, format="json")
+
+    @staticmethod
+    def longitudes(response):
+        return [Destination.objects.get(id=stop["destination"]).longitude for stop in response.json()["destinations"]]
+
+    def test_optimize_route(self):
+        itinerary = self.create_itinerary([0, 3, 1, 4, 2])
+
+        # Itinerary, stops with their destinations, one UPDATE for all visit orders, one for updated_at, and the new
+        # summary
+        with self.assertNumQueries(5):
+            response = self.optimize(itinerary)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.longitudes(response), [0, 1, 2, 3, 4])
+        self.assertEqual([stop["visit_order"] for stop in response.json()["destinations"]], [1, 2, 3, 4, 5])
+        self.assertEqual(response.json()["route"]["method"], "exact")
+        self.assertAlmostEqual(response.json()["route"]["distance_km"], haversine_km(0, 0, 0, 4), places=6)
+        self.assertAlmostEqual(response.json()["route"]["previous_distance_km"], haversine_km(0, 0, 0, 10), places=6)
+        self.assertAlmostEqual(response.json()["summary"]["route_distance_km"], haversine_km(0, 0, 0, 4), places=6)
+
+        # The new order is saved
+        stops = ItineraryDestination.objects.filter(itinerary=itinerary).order_by("visit_order")
+        self.assertEqual([stop.destination.longitude for stop in stops], [0, 1, 2, 3, 4])
+
+    def test_optimize_route_free_start(self):
+        itinerary = self.create_itinerary([2, 0, 4, 1, 3])
+
+        response = self.optimize(itinerary, fix_start=False)
+
+        self.assertIn(self.longitudes(response), [[0, 1, 2, 3, 4], [4, 3, 2, 1, 0]])
+        self.assertAlmostEqual(response.json()["route"]["distance_km"], haversine_km(0, 0, 0, 4), places=6)
+
+    @override_settings(ROUTE_OPTIMIZER={"EXACT_MAX_STOPS": 3})
+    def test_optimize_route_heuristic(self):
+        itinerary = self.create_itinerary([0, 7, 2, 9, 4, 1, 8, 3, 6, 5])
+
+        response = self.optimize(itinerary)
+
+        self.assertEqual(response.json()["route"]["method"], "heuristic")
+        self.assertEqual(self.longitudes(response), list(range(10)))
+
+    def test_optimize_route_missing_coordinates(self):
+        itinerary = self.create_itinerary([0, 1])
+        nowhere = Destination.objects.create(name="Nowhere", type="poi")
+        ItineraryDestination.objects.create(itinerary=itinerary, destination=nowhere, visit_order=3)
+
+        response = self.optimize(itinerary)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()["destinations"], [nowhere.id])
+        self.assertEqual(ItineraryDestination.objects.get(destination=nowhere).visit_order, 3)
+
+
+class PrefetchForecastsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        forecast_cache.clear()
+
+        today = timezone.localdate()
+        london = Destination.objects.create(name="London", type="city", latitude=51.5074, longitude=-0.1278)
+        paris = Destination.objects.create(name="Paris", type="city", latitude=48.8566, longitude=2.3522)
+        westminster = Destination.objects.create(name="Westminster", type="poi", latitude=51.5089, longitude=-0.1311)
+        nowhere = Destination.objects.create(name="Nowhere", type="poi")
+
+        self.itineraries = []
+        for name, start_in, end_in in [("Soon", 2, 4), ("Ongoing", -1, 1), ("Past", -5, -2), ("Later", 30, 32)]:
+            itinerary = Itinerary.objects.create(
+                name=name,
+                start_date=today + datetime.timedelta(days=start_in),
+                end_date=today + datetime.timedelta(days=end_in),
+            )
+            for visit_order, destination in enumerate([london, paris, westminster, nowhere], start=1):
+                ItineraryDestination.objects.create(itinerary=itinerary, destination=destination, visit_order=visit_order)
+            self.itineraries.append(itinerary)
+
+    def prefetch(self, **options):
+        out = StringIO()
+        call_command("prefetch_forecasts", stdout=out, rate_limit=0, **options)
+        return out.getvalue().strip()
+
+    @staticmethod
+    def respond(request, context):
+        """
+        Hourly temperatures over the requested dates for every requested location, as Open-Meteo does
+        """
+        first, last = (datetime.date.fromisoformat(request.qs[name][0]) for name in ("start_date", "end_date"))
+        times = [
+            (datetime.datetime.combine(first, datetime.time()) + datetime.timedelta(hours=hour)).strftime("%Y-%m-%dT%H:%M")
+            for hour in range(((last - first).days + 1) * 24)
+        ]
+        forecasts = [
+            {
+                "latitude": float(latitude),
+                "longitude": float(longitude),
+                "utc_offset_seconds": 0,
+                "timezone": "GMT",
+                "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+                "hourly": {"time": times, "temperature_2m": [20.0] * len(times)},
+            }
+            for latitude, longitude in zip(request.qs["latitude"][0].split(","), request.qs["longitude"][0].split(","))
+        ]
+        return forecasts if len(forecasts) > 1 else forecasts[0]
+
+    @requests_mock.Mocker()
+    def test_prefetch_upcoming_itineraries(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+
+        self.assertEqual(self.prefetch(), "2 locations: 2 fetched, 0 up to date, 0 failed")
+
+        # One multi-location call for the two distinct locations, over the dates of both itineraries within the horizon
+        self.assertEqual(mocker.call_count, 1)
+        today = timezone.localdate()
+        self.assertEqual(mocker.last_request.qs["start_date"], [(today - datetime.timedelta(days=2)).isoformat()])
+        self.assertEqual(mocker.last_request.qs["end_date"], [(today + datetime.timedelta(days=5)).isoformat()])
+        self.assertEqual(Forecast.objects.count(), 2)
+
+        # Both weather endpoints are served from the forecast store, by any worker
+        forecast_cache.clear()
+        cache.clear()
+        for itinerary in self.itineraries[:2]:
+            response = self.client.get(reverse("itinerary-weather", kwargs={"pk": itinerary.id}))
+            self.assertEqual(response.json()["destinations"][0]["forecast"]["daily"]["temperature_2m_max"][0], 20.0)
+            response = self.client.get(
+                reverse(
+                    "get_itinerary_destination_weather",
+                    kwargs={"itinerary_id": itinerary.id, "itinerary_destination_order": 2},
+                )
+            )
+            self.assertEqual(response.json()["daily"]["temperature_2m_min"][0], 20.0)
+        self.assertEqual(mocker.call_count, 1)
+        self.assertEqual(forecast_cache.stats().get("upstream_calls", 0), 0)
+
+    @requests_mock.Mocker()
+    def test_prefetch_is_incremental(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json=self.respond)
+        self.prefetch()
+
+        self.assertEqual(self.prefetch(), "2 locations: 0 fetched, 2 up to date, 0 failed")
+        self.assertEqual(mocker.call_count, 1)
+
+        # Locations whose stored forecasts don't cover the dates of a new itinerary are fetched again
+        itinerary = Itinerary.objects.create(
+            name="Longer", start_date=timezone.localdate(), end_date=timezone.localdate() + datetime.timedelta(days=8)
+        )
+        ItineraryDestination.objects.create(
+            itinerary=itinerary, destination=Destination.objects.get(name="Paris"), visit_order=1
+        )
+        self.assertEqual(self.prefetch(), "2 locations: 1 fetched, 1 up to date, 0 failed")
+        self.assertEqual(mocker.call_count, 2)
+
+        # And so are the ones about to be too old
+        self.assertEqual(
+            self.prefetch(refresh_margin=cache_settings()["STORE_MAX_AGE"] + 1),
+            "2 locations: 2 fetched, 0 up to date, 0 failed",
+        )
+        self.assertEqual(mocker.call_count, 4)
+
+    @requests_mock.Mocker()
+    def test_prefetch_upstream_error(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", status_code=503)
+
+        with self.assertLogs("triptuner.prefetch", level="WARNING"):
+            self.assertEqual(self.prefetch(), "2 locations: 0 fetched, 0 up to date, 2 failed")
+        self.assertFalse(Forecast.objects.exists())
+
+    def test_rate_limiter(self):
+        clock, sleeps = mock.Mock(return_value=100.0), []
+        limiter = RateLimiter(4, clock=clock, sleep=sleeps.append)
+
+        for _ in range(3):
+            limiter.wait()
+
+        self.assertEqual(sleeps, [0.25, 0.5])
+
+
+@override_settings(REQUEST_PROFILING={"ENABLED": True})
+class RequestProfilingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        forecast_cache.clear()
+        metrics.clear()
+
+        destination = Destination.objects.create(name="Test City", type="city", latitude=51.5074, longitude=-0.1278)
+        self.itinerary = Itinerary.objects.create(name="Test Itinerary", start_date="2024-09-20", end_date="2024-09-25")
+        ItineraryDestination.objects.create(itinerary=self.itinerary, destination=destination, visit_order=1)
+        self.admin = User.objects.create_user(username="admin", is_staff=1, is_superuser=1)
+
+    def test_server_timing(self):
+        response = self.client.get("/api/itineraries/")
+
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="queries=2", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+
+    @requests_mock.Mocker()
+    def test_server_timing_upstream(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", json={"hourly": {"temperature_2m": [15.0]}})
+        url = reverse(
+            "get_itinerary_destination_weather", kwargs={"itinerary_id": self.itinerary.id, "itinerary_destination_order": 1}
+        )
+
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        self.assertRegex(first["Server-Timing"], r'upstream;dur=[\d.]+;desc="calls=1", cache;desc="misses=1"')
+        self.assertNotIn("upstream", second["Server-Timing"])
+        self.assertIn('cache;desc="hits=1"', second["Server-Timing"])
+
+    @requests_mock.Mocker()
+    def test_metrics(self, mocker):
+        mocker.get("https://api.open-meteo.com/v1/forecast", status_code=503)
+        self.client.get("/api/itineraries/")
+        self.client.get("/api/itineraries/")
+        self.client.get(reverse("itinerary-weather", kwargs={"pk": self.itinerary.id}))
+
+        self.assertEqual(self.client.get("/api/_metrics/").status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get("/api/_metrics/")
+
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        lines = response.content.decode().splitlines()
+        self.assertIn("# TYPE triptuner_request_duration_seconds histogram", lines)
+        self.assertIn('triptuner_request_duration_seconds_count{method="GET",route="itinerary-list"} 2', lines)
+        self.assertIn('triptuner_request_duration_seconds_bucket{method="GET",route="itinerary-list",le="+Inf"} 2', lines)
+        self.assertIn('triptuner_db_queries_bucket{method="GET",route="itinerary-list",le="1"} 0', lines)
+        self.assertIn('triptuner_db_queries_bucket{method="GET",route="itinerary-list",le="2"} 2', lines)
+        self.assertIn('triptuner_upstream_requests_total{status="503"} 1', lines)
+        self.assertIn('triptuner_forecast_cache_total{outcome="misses"} 1', lines)
+
+    async def test_server_timing_async(self):
+        forecast = {"hourly": {"temperature_2m": [15.0]}}
+        url = reverse(
+            "get_itinerary_destination_weather_async",
+            kwargs={"itinerary_id": self.itinerary.id, "itinerary_destination_order": 1},
+        )
+        with UpstreamStub((200, forecast)) as upstream, mock.patch.object(async_weather_client, "url", upstream.url):
+            response = await self.async_client.get(url)
+            await async_weather_client.aclose()
+
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="queries=3", .*upstream;dur=[\d.]+;desc="calls=1"')
+
+    def test_cprofile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                REQUEST_PROFILING={"ENABLED": True, "CPROFILE_TOKEN": "secret", "CPROFILE_DIR": directory}
+            ):
+                client = self.client_class()
+                profiled = client.get("/api/itineraries/", headers={"X-Profile": "secret"})
+                unprofiled = client.get("/api/itineraries/", headers={"X-Profile": "guess"})
+
+            self.assertTrue(os.path.exists(profiled["X-Profile-Output"]))
+            self.assertNotIn("X-Profile-Output", unprofiled)
+            self.assertEqual(os.listdir(directory), [os.path.basename(profiled["X-Profile-Output"])])
+
+    @override_settings(REQUEST_PROFILING={"ENABLED": False})
+    def test_disabled(self):
+        response = self.client_class().get("/api/itineraries/")
+
+        self.assertNotIn("Server-Timing", response)
+
+
+class ForecastCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        self.forecast_cache = ForecastCache(ttl=60, stale_ttl=120, max_entries=2, clock=lambda: self.now)
+        self.calls = 0
+
+    def loader(self):
+        self.calls += 1
+        return {"call": self.calls}
+
+    def test_forecast_key_buckets_coordinates(self):
+        """
+        Nearby coordinates share a key, the query parameters do not
+        """
+        self.assertEqual(forecast_key(51.5074, -0.1278), forecast_key(51.5091, -0.1301))
+        self.assertNotEqual(forecast_key(51.5074, -0.1278), forecast_key(51.6, -0.1278))
+        self.assertNotEqual(forecast_key(51.5074, -0.1278), forecast_key(51.5074, -0.1278, start="2024-09-20"))
+
+    def test_hit_after_miss(self):
+        self.assertEqual(self.forecast_cache.get_or_fetch("k", self.loader), {"call": 1})
+        self.assertEqual(self.forecast_cache.get_or_fetch("k", self.loader), {"call": 1})
+        self.assertEqual(self.calls, 1)
+        stats = self.forecast_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["stale"]), (1, 1, 0))
+
+    def test_shared_backend_survives_local_eviction(self):
+        """
+        Entries evicted from the in-process LRU are still served from the shared backend
+        """
+        for key in ("a", "b", "c"):
+            self.forecast_cache.get_or_fetch(key, self.loader)
+        self.assertEqual(self.forecast_cache.stats()["local_entries"], 2)
+
+        self.assertEqual(self.forecast_cache.get_or_fetch("a", self.loader), {"call": 1})
+        self.assertEqual(self.calls, 3)
+
+    def test_stale_while_revalidate(self):
+        self.forecast_cache.get_or_fetch("k", self.loader)
+        self.now += 90
+
+        # Expired, but within the stale window: the old value is served and refreshed in the background
+        self.assertEqual(self.forecast_cache.get_or_fetch("k", self.loader), {"call": 1})
+        self.assertEqual(self.forecast_cache.stats()["stale"], 1)
+
+        deadline = time.monotonic() + 5
+        while self.forecast_cache.stats().get("refreshes", 0) < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.forecast_cache.get_or_fetch("k", self.loader), {"call": 2})
+
+        # Past the stale window the value must be fetched synchronously
+        self.now += 500
+        self.assertEqual(self.forecast_cache.get_or_fetch("k", self.loader), {"call": 3})
+
+    def test_stale_if_error(self):
+        """
+        While the upstream is unavailable, expired values are served for `error_ttl` seconds past their TTL
+        """
+        forecast_cache = ForecastCache(ttl=60, stale_ttl=120, error_ttl=600, clock=lambda: self.now)
+
+        def unavailable(keys=None):
+            raise UpstreamUnavailable("throttled", 30)
+
+        forecast_cache.get_or_fetch("k", self.loader)
+        forecast_cache.get_or_fetch_many(["a"], lambda keys: ["a-1"])
+        self.now += 300
+        self.assertEqual(forecast_cache.get_or_fetch("k", unavailable), {"call": 1})
+        self.assertEqual(forecast_cache.get_or_fetch_many(["a"], unavailable), {"a": "a-1"})
+        self.assertEqual(forecast_cache.stats()["stale_if_error"], 2)
+
+        # Nothing to serve for the other keys
+        with self.assertRaises(UpstreamUnavailable):
+            forecast_cache.get_or_fetch_many(["a", "b"], unavailable)
+        self.now += 600
+        with self.assertRaises(UpstreamUnavailable):
+            forecast_cache.get_or_fetch("k", unavailable)
+
+    def test_get_or_fetch_many(self):
+        def load_many(keys):
+            self.calls += 1
+            return [f"{key}-{self.calls}" for key in keys]
+
+        self.forecast_cache.get_or_fetch("a", self.loader)
+        self.assertEqual(
+            self.forecast_cache.get_or_fetch_many(["a", "b", "c"], load_many), {"a": {"call": 1}, "b": "b-2", "c": "c-2"}
+        )
+        self.assertEqual(self.forecast_cache.get_or_fetch_many(["b", "c"], load_many), {"b": "b-2", "c": "c-2"})
+        self.assertEqual(self.calls, 2)
+
+    def test_concurrent_misses_of_many_are_collapsed(self):
+        release = threading.Event()
+        loaded = []
+
+        def slow_load_many(keys):
+            loaded.append(keys)
+            release.wait(5)
+            return [f"{key}-{len(loaded)}" for key in keys]
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda keys=keys: results.append(self.forecast_cache.get_or_fetch_many(keys, slow_load_many))
+            )
+            for keys in (["a", "b"], ["b", "a"], ["a"], ["b", "a"])
+        ]
+        # The others start once the first one is loading both keys
+        threads[0].start()
+        deadline = time.monotonic() + 5
+        while not loaded and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(loaded, [["a", "b"]])
+        self.assertEqual(sorted(map(len, results)), [1, 2, 2, 2])
+        self.assertTrue(all(value == f"{key}-1" for result in results for key, value in result.items()))
+        self.assertEqual(self.forecast_cache.stats()["coalesced"], 5)
+
+    def test_many_waits_for_other_worker_holding_a_lock(self):
+        loaded = []
+
+        def load_many(keys):
+            loaded.append(keys)
+            return [f"{key}-mine" for key in keys]
+
+        other_worker = ForecastCache(clock=lambda: self.now)
+        cache.add("b:lock", 1)
+        threading.Timer(0.1, lambda: other_worker._store("b", "b-other")).start()
+
+        self.assertEqual(
+            self.forecast_cache.get_or_fetch_many(["a", "b", "c"], load_many), {"a": "a-mine", "b": "b-other", "c": "c-mine"}
+        )
+        self.assertEqual(loaded, [["a", "c"]])
+
+    def test_concurrent_misses_are_collapsed(self):
+        release = threading.Event()
+
+        def slow_loader():
+            release.wait(5)
+            return self.loader()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.forecast_cache.get_or_fetch("k", slow_loader)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{"call": 1}] * 8)
+
+    def test_waits_for_other_worker_holding_the_lock(self):
+        """
+        When another worker holds the shared lock, the value it publishes is used instead of calling upstream
+        """
+        other_worker = ForecastCache(clock=lambda: self.now)
+        cache.add("k:lock", 1)
+        threading.Timer(0.1, lambda: other_worker._store("k", {"call": "other"})).start()
+
+        self.assertEqual(self.forecast_cache.get_or_fetch("k", self.loader), {"call": "other"})
+        self.assertEqual(self.calls, 0)
+
+    def test_stale_refresh_contended_by_other_worker(self):
+        """
+        A miss that joins a background refresh which lost the shared lock to another worker gets that worker's value
+        """
+        self.forecast_cache.get_or_fetch("k", self.loader)
+        other_worker = ForecastCache(clock=lambda: self.now)
+        cache.add("k:lock", 1)
+        lock_attempted = threading.Event()
+        published = threading.Event()
+        add = LocMemCache.add
+
+        def slow_add(backend, *args, **kwargs):
+            # Hold the background refresh until the miss has joined it and the other worker has published
+            if threading.current_thread() is not threading.main_thread():
+                lock_attempted.set()
+                published.wait(5)
+            return add(backend, *args, **kwargs)
+
+        def publish():
+            lock_attempted.wait(5)
+            other_worker._store("k", {"call": "other"})
+            published.set()
+
+        with mock.patch.object(LocMemCache, "add", slow_add):
+            self.now += 90
+            self.assertEqual(self.forecast_cache.get_or_fetch("k", self.loader), {"call": 1})
+            threading.Timer(0.1, publish).start()
+            self.now += 500
+            self.assertEqual(self.forecast_cache.get_or_fetch("k", self.loader), {"call": "other"})
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.forecast_cache.stats().get("refreshes", 0), 0)
+
+    def test_async_concurrent_misses_are_collapsed(self):
+        async def slow_loader():
+            await asyncio.sleep(0.05)
+            return self.loader()
+
+        async def fetch_many():
+            return await asyncio.gather(*(self.forecast_cache.aget_or_fetch("k", slow_loader) for _ in range(50)))
+
+        results = async_to_sync(fetch_many)()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{"call": 1}] * 50)
+
+    def test_async_stale_refresh_contended_by_other_worker(self):
+        async def loader():
+            return self.loader()
+
+        other_worker = ForecastCache(clock=lambda: self.now)
+        published = asyncio.Event()
+        aadd = LocMemCache.aadd
+        refreshing = []
+
+        async def slow_aadd(backend, *args, **kwargs):
+            # Hold the background refresh (the first lock attempt) until the other worker has published
+            if not refreshing:
+                refreshing.append(True)
+                await published.wait()
+            return await aadd(backend, *args, **kwargs)
+
+        async def race():
+            await self.forecast_cache.aget_or_fetch("k", loader)
+            cache.add("k:lock", 1)
+            with mock.patch.object(LocMemCache, "aadd", slow_aadd):
+                self.now += 90
+                self.assertEqual(await self.forecast_cache.aget_or_fetch("k", loader), {"call": 1})
+                self.now += 500
+                miss = asyncio.ensure_future(self.forecast_cache.aget_or_fetch("k", loader))
+                await asyncio.sleep(0.05)
+                other_worker._store("k", {"call": "other"})
+                published.set()
+                return await miss
+
+        self.assertEqual(async_to_sync(race)(), {"call": "other"})
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.forecast_cache.stats().get("refreshes", 0), 0)
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_per_process_cache(self):
+        with override_settings(DEBUG=False):
+            warnings = check_shared_caches(None)
+        self.assertEqual([warning.id for warning in warnings], ["triptuner.W001"] * 3)
+        self.assertIn("WEATHER_UPSTREAM uses the 'default' cache", warnings[1].msg)
+
+        with override_settings(DEBUG=True):
+            self.assertEqual(check_shared_caches(None), [])
+
+    def test_shared_cache(self):
+        caches = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://redis"}}
+        with override_settings(DEBUG=False, CACHES=caches):
+            self.assertEqual(check_shared_caches(None), [])
+
+
+class UpstreamStub:
+    """
+    Local HTTP server standing in for Open-Meteo. Replies with the given (status, payload) responses in turn,
+    repeating the last one.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(parse_qs(urlparse(self.path).query))
+                status_code, payload = stub.responses.pop(0) if len(stub.responses) > 1 else stub.responses[0]
+                body = json.dumps(payload).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/v1/forecast" % self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class AsyncWeatherClientTests(SimpleTestCase):
+    async def fetch(self, client, params):
+        try:
+            return await client.get(params)
+        finally:
+            await client.aclose()
+
+    def test_retries_unavailable_responses(self):
+        with UpstreamStub((502, {}), (503, {}), (200, {"hourly": {}})) as upstream:
+            client = AsyncWeatherClient(url=upstream.url, retries=2, backoff=0)
+
+            self.assertEqual(async_to_sync(self.fetch)(client, {"latitude": 1, "longitude": 2}), {"hourly": {}})
+            self.assertEqual(len(upstream.requests), 3)
+
+    def test_gives_up_after_retries(self):
+        with UpstreamStub((503, {})) as upstream:
+            client = AsyncWeatherClient(url=upstream.url, retries=1, backoff=0)
+
+            with self.assertRaises(aiohttp.ClientResponseError):
+                async_to_sync(self.fetch)(client, {"latitude": 1, "longitude": 2})
+            self.assertEqual(len(upstream.requests), 2)
+
+    def test_drops_empty_params(self):
+        with UpstreamStub((200, {})) as upstream:
+            client = AsyncWeatherClient(url=upstream.url)
+            async_to_sync(self.fetch)(client, {"latitude": 1, "longitude": 2, "start": None})
+
+        self.assertEqual(upstream.requests[0], {"latitude": ["1"], "longitude": ["2"]})
+
+    def test_throttled_responses_open_the_circuit(self):
+        guard = UpstreamGuard(key="test:upstream")
+        self.addCleanup(guard.reset)
+        with UpstreamStub((429, {}), (200, {})) as upstream:
+            client = AsyncWeatherClient(url=upstream.url, retries=2, backoff=0, guard=guard)
+
+            for _ in range(2):
+                with self.assertRaises(UpstreamUnavailable):
+                    async_to_sync(self.fetch)(client, {"latitude": 1, "longitude": 2})
+        # The second call did not reach the upstream
+        self.assertEqual(len(upstream.requests), 1)
+
+
+@override_settings(WEATHER_UPSTREAM={"RATE": 10, "BURST": 2, "MAX_WAIT": 1, "PREFETCH_RESERVE": 1, "FAILURE_THRESHOLD": 2})
+class UpstreamGuardTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.clear()
+        # Sleeping doesn't move the clock, as if all calls were made at once
+        self.now = 1000.0
+        self.sleeps = []
+        self.guard = UpstreamGuard(clock=lambda: self.now, sleep=self.sleeps.append)
+
+    def test_token_bucket(self):
+        """
+        Calls beyond the burst wait for their token, up to MAX_WAIT seconds
+        """
+        for _ in range(12):
+            self.guard.before()
+        self.assertEqual([round(wait, 2) for wait in self.sleeps], [0, 0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1])
+
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            self.guard.before()
+        self.assertEqual(raised.exception.reason, "rate_limited")
+
+        # Tokens are added back over time
+        self.now += 2
+        self.guard.before()
+        self.assertIn('triptuner_upstream_queue_depth{priority="interactive"} 0', metrics.render())
+        self.assertIn('triptuner_upstream_wait_seconds_count{priority="interactive"} 14', metrics.render())
+
+    @override_settings(WEATHER_UPSTREAM={"RATE": 10, "BURST": 2, "PREFETCH_RESERVE": 1, "PREFETCH_MAX_WAIT": 0})
+    def test_prefetch_leaves_tokens_to_requests(self):
+        with upstream_priority(PREFETCH):
+            self.guard.before()
+            with self.assertRaises(UpstreamUnavailable):
+                self.guard.before()
+        self.guard.before()
+        self.assertEqual(self.sleeps, [0, 0])
+
+    def test_circuit_breaker(self):
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            self.guard.after(429, retry_after=7)
+        self.assertEqual(raised.exception.retry_after, 7)
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            self.guard.before()
+        self.assertEqual((raised.exception.reason, raised.exception.retry_after), ("circuit_open", 7))
+
+        # Closed again after the delay, and opened by FAILURE_THRESHOLD failures in a row
+        self.now += 7
+        self.guard.before()
+        self.guard.after(200)
+        self.guard.after(503)
+        self.guard.after(200)
+        self.guard.after(503)
+        self.guard.before()
+        self.guard.after(None)
+        with self.assertRaises(UpstreamUnavailable):
+            self.guard.before()
+
+    def test_failures_expire_after_the_last_one(self):
+        with mock.patch.object(time, "time", return_value=1000.0):
+            self.guard.after(503)
+        with mock.patch.object(time, "time", return_value=1025.0):
+            self.guard.after(503)
+            async_to_sync(self.guard.aafter)(503)
+        # RESET_TIMEOUT (30s) after the first failure, but not after the last one
+        with mock.patch.object(time, "time", return_value=1040.0):
+            self.assertEqual(cache.get(self.guard.failures_key), 3)
+        with mock.patch.object(time, "time", return_value=1056.0):
+            self.assertIsNone(cache.get(self.guard.failures_key))
+
+
+class AsyncItineraryDestinationWeatherViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        forecast_cache.clear()
+
+        self.destination = Destination.objects.create(name="Test City", type="city", latitude=51.5074, longitude=-0.1278)
+        self.itinerary = Itinerary.objects.create(name="Test Itinerary", start_date="2024-09-20", end_date="2024-09-25")
+        ItineraryDestination.objects.create(itinerary=self.itinerary, destination=self.destination, visit_order=1)
+        self.url = reverse(
+            "get_itinerary_destination_weather_async",
+            kwargs={"itinerary_id": self.itinerary.id, "itinerary_destination_order": 1},
+        )
+
+    async def test_get_weather_success(self):
+        forecast = {"hourly": {"temperature_2m": [15.0, 16.0, 17.0]}}
+        with UpstreamStub((200, forecast)) as upstream, mock.patch.object(async_weather_client, "url", upstream.url):
+            first = await self.async_client.get(self.url)
+            second = await self.async_client.get(self.url)
+            await async_weather_client.aclose()
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.json(), forecast)
+        self.assertEqual(second.json(), forecast)
+        # The second request is served from the forecast cache
+        self.assertEqual(len(upstream.requests), 1)
+
+    async def test_get_weather_beyond_a_week(self):
+        today = timezone.now().date()
+        self.itinerary.start_date = today + datetime.timedelta(days=10)
+        self.itinerary.end_date = today + datetime.timedelta(days=12)
+        await self.itinerary.asave()
+        forecast = hourly_forecast(today + datetime.timedelta(days=8), today + datetime.timedelta(days=15))
+        with UpstreamStub((200, forecast)) as upstream, mock.patch.object(async_weather_client, "url", upstream.url):
+            response = await self.async_client.get(self.url)
+            await async_weather_client.aclose()
+
+        self.assertEqual(response.json()["daily"]["temperature_2m_mean"], [20.0] * 3)
+        self.assertLessEqual(upstream.requests[0]["start_date"][0], self.itinerary.start_date.isoformat())
+        self.assertGreaterEqual(upstream.requests[0]["end_date"][0], self.itinerary.end_date.isoformat())
+
+    async def test_get_weather_at_zero_coordinates(self):
+        self.destination.latitude, self.destination.longitude = 0, 0
+        await self.destination.asave()
+        forecast = {"hourly": {"temperature_2m": [25.0]}}
+        with UpstreamStub((200, forecast)) as upstream, mock.patch.object(async_weather_client, "url", upstream.url):
+            response = await self.async_client.get(self.url)
+            await async_weather_client.aclose()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(upstream.requests[0]["latitude"], ["0.0"])
+
+    async def test_get_weather_not_found(self):
+        url = reverse(
+            "get_itinerary_destination_weather_async",
+            kwargs={"itinerary_id": self.itinerary.id, "itinerary_destination_order": 2},
+        )
+
+        response = await self.async_client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_get_weather_upstream_error(self):
+        with UpstreamStub((500, {})) as upstream, mock.patch.object(async_weather_client, "url", upstream.url):
+            response = await self.async_client.get(self.url)
+            await async_weather_client.aclose()
+
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.json()["error"], "Failed to fetch weather data")
+
+    async def test_get_weather_throttled(self):
+        self.addCleanup(upstream_guard.reset)
+        with UpstreamStub((429, {})) as upstream, mock.patch.object(async_weather_client, "url", upstream.url):
+            response = await self.async_client.get(self.url)
+            await async_weather_client.aclose()
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "30")
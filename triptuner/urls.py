@@ -17,10 +17,20 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import include, path
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from drf_spectacular.views import SpectacularRedocView, SpectacularSwaggerView
 from rest_framework import routers
+from rest_framework.authtoken.views import obtain_auth_token
 
-from triptuner.views import DestinationViewSet, ItineraryDestinationWeatherView, ItineraryViewSet, UserViewSet
+from triptuner.views import (
+    AsyncItineraryDestinationWeatherView,
+    DestinationViewSet,
+    ItineraryDestinationWeatherView,
+    ItineraryViewSet,
+    MetricsView,
+    SchemaView,
+    UserViewSet,
+    WeatherCacheStatsView,
+)
 
 # Routers provide an easy way of automatically determining the URL conf.
 router = routers.DefaultRouter()
@@ -33,9 +43,10 @@ urlpatterns = [
     # include login URLs for the browsable API
     path("api/", include(router.urls)),
     path("api-auth/", include("rest_framework.urls", namespace="rest_framework")),
+    path("api/auth/token/", obtain_auth_token, name="api_token"),
     path("admin/", admin.site.urls),
     # Swagger/Redoc documentation
-    path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
+    path("api/schema/", SchemaView.as_view(), name="schema"),
     path(
         "api/schema/swagger-ui/",
         SpectacularSwaggerView.as_view(url_name="schema"),
@@ -51,4 +62,11 @@ urlpatterns = [
         ItineraryDestinationWeatherView.as_view(),
         name="get_itinerary_destination_weather",
     ),
+    path(
+        "api/itineraries/<int:itinerary_id>/<int:itinerary_destination_order>/weather/async/",
+        AsyncItineraryDestinationWeatherView.as_view(),
+        name="get_itinerary_destination_weather_async",
+    ),
+    path("api/weather/cache-stats/", WeatherCacheStatsView.as_view(), name="weather_cache_stats"),
+    path("api/_metrics/", MetricsView.as_view(), name="metrics"),
 ]
@@ -1,37 +1,685 @@
+import asyncio
+import datetime
+import hashlib
+import io
+import json
+import math
+
+import aiohttp
+import numpy as np
 import requests
 from django.contrib.auth.models import User
-from django.http import JsonResponse
-from rest_framework import viewsets
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import CharField, F, Func, Prefetch
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views import View
+from django_filters.rest_framework import DjangoFilterBackend
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView
+from rest_framework import serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import RetrieveAPIView
-from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import SAFE_METHODS, AllowAny, DjangoModelPermissionsOrAnonReadOnly, IsAdminUser
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+
+from triptuner.catalogue import CONTENT_TYPES, FORMATS, export_lines, guess_format, import_destinations
+from triptuner.filters import (
+    DestinationSearchFilter,
+    DestinationWithinFilter,
+    ItineraryBoundingBoxFilter,
+    ItineraryVisitsFilter,
+    KeysetOrderingFilter,
+)
+from triptuner.forecasts import local_forecast, parse_bound
+from triptuner.geo import bounding_box_filter, haversine_expression, haversine_matrix
+from triptuner.models import Destination, DestinationClosure, Itinerary, ItineraryDestination
+from triptuner.profiling import metrics
+from triptuner.ranking import score_weather, stack_series
+from triptuner.renderers import render_json
+from triptuner.routers import replica_reads
+from triptuner.routing import optimize_route, route_length, route_optimizer_settings
+from triptuner.schema import accepted_encoding, precomputed_schema
+from triptuner.serializers import (
+    DestinationSerializer,
+    InsertStopSerializer,
+    ItinerarySerializer,
+    MoveStopSerializer,
+    NearbyDestinationSerializer,
+    NearbyQuerySerializer,
+    OptimizeRouteSerializer,
+    RankByWeatherSerializer,
+    RankedDestinationSerializer,
+    RemoveStopSerializer,
+    UserSerializer,
+    destination_rows,
+    itinerary_rows,
+    load_summaries,
+    update_itinerary,
+)
+from triptuner.visits import astop_window, destination_zone, forecast_dates, local_bounds, stop_window, visit_windows
+from triptuner.weather import aget_forecast, forecast_cache, get_forecast, get_forecasts
+from triptuner.weather_client import UpstreamUnavailable
+
+
+class ReplicaReadMixin:
+    """
+    Read from a replica while handling safe requests (GET, HEAD, OPTIONS), see triptuner/routers.py
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self.adispatch(request, *args, **kwargs)
+        with replica_reads(request.method in SAFE_METHODS):
+            return super().dispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        with replica_reads(request.method in SAFE_METHODS):
+            return await super().dispatch(request, *args, **kwargs)
+
+
+class QueryPlanMixin:
+    """
+    Build the queryset from a declared plan of related rows to load for each action, so serializers
+    never query once per row. Plans are keyed by action name, with "default" used for other actions.
+    """
+
+    select_related_plan = {}
+    prefetch_related_plan = {}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        select_related = self.select_related_plan.get(self.action, self.select_related_plan.get("default", []))
+        prefetch_related = self.prefetch_related_plan.get(self.action, self.prefetch_related_plan.get("default", []))
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
+class NDJSONExportMixin:
+    """
+    An `export/` action that streams the whole filtered queryset as newline-delimited JSON.
+    Rows are read with a server-side cursor and serialized a chunk at a time, so memory use stays flat.
+    """
+
+    export_chunk_size = 2000
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        # Rows are streamed after the view returns, so keep the database picked while handling the request
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.using(queryset.db)
+        if not queryset.query.order_by:
+            queryset = queryset.order_by(*getattr(self, "pagination_ordering", ["id"]))
+
+        response = StreamingHttpResponse(self.export_lines(queryset), content_type="application/x-ndjson")
+        response["Content-Disposition"] = f'attachment; filename="{self.basename}.ndjson"'
+        return response
+
+    def export_lines(self, queryset):
+        chunk = []
+        for row in queryset.iterator(chunk_size=self.export_chunk_size):
+            chunk.append(row)
+            if len(chunk) == self.export_chunk_size:
+                yield self.render_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield self.render_chunk(chunk)
+
+    def render_chunk(self, rows):
+        data = self.get_serializer(rows, many=True).data
+        return "".join(json.dumps(item, cls=JSONEncoder, ensure_ascii=False) + "\n" for item in data)
+
+
+# `updated_at` in UTC as text, see ConditionalGetMixin.version()
+updated_at_version = Func(
+    F("updated_at"),
+    template="to_char(%(expressions)s AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US')",
+    output_field=CharField(),
+)
+
+
+class ConditionalGetMixin:
+    """
+    `ETag` validators for `retrieve` and `list`, derived from the ids and `updated_at` of the rows rather than from
+    the rendered body, and `Last-Modified` for single objects. Requests with `If-None-Match` or `If-Modified-Since`
+    first fetch just these two columns of the rows they would return, and get an empty 304 when nothing changed,
+    before related rows are loaded or the serializer runs.
+
+    Pages only get an ETag, which also covers the ids on the page: removing a row doesn't change the latest
+    `updated_at`. The page includes the extra row the paginator looks ahead to, which decides the `next` link.
+    Pages fetch `updated_at` as text formatted by the database (`updated_at_version`), which is much cheaper
+    than loading the datetimes.
+    """
+
+    @staticmethod
+    def version(updated_at):
+        """
+        The text of `updated_at` hashed into ETags, the same as `updated_at_version` computes
+        """
+        return updated_at.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+    @staticmethod
+    def is_conditional(request):
+        return "HTTP_IF_NONE_MATCH" in request.META or "HTTP_IF_MODIFIED_SINCE" in request.META
+
+    def make_etag(self, versions):
+        key = repr((self.request.accepted_renderer.format, list(versions)))
+        return f'W/"{hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()}"'
+
+    @staticmethod
+    def add_validators(response, etag, last_modified=None):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
+
+    def not_modified(self, etag, last_modified=None):
+        """
+        A 304 response if the conditions of the request match the validators, else None
+        """
+        timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+        response = get_conditional_response(self.request, etag=etag, last_modified=timestamp)
+        return response and self.add_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.is_conditional(request):
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+            try:
+                version = queryset.filter(**{self.lookup_field: lookup}).values_list("pk", "updated_at").first()
+            except (TypeError, ValueError, ValidationError):
+                version = None
+            # Missing objects are left to get_object()
+            if version is not None:
+                pk, updated_at = version
+                response = self.not_modified(self.make_etag([(pk, self.version(updated_at))]), updated_at)
+                if response is not None:
+                    return response
+
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        etag = self.make_etag([(instance.pk, self.version(instance.updated_at))])
+        return self.add_validators(response, etag, instance.updated_at)
+
+    def list(self, request, *args, **kwargs):
+        page_queryset = getattr(self.paginator, "page_queryset", None)
+        if page_queryset is None:
+            return super().list(request, *args, **kwargs)
+
+        if self.is_conditional(request):
+            page = page_queryset(self.filter_queryset(self.get_queryset()), request, view=self)
+            response = self.not_modified(self.make_etag(page.prefetch_related(None).values_list("pk", updated_at_version)))
+            if response is not None:
+                return response
+
+        response = super().list(request, *args, **kwargs)
+        # Rows are dicts with their version when the page was served by FastListMixin
+        versions = [
+            (row["id"], row["updated_at_version"]) if isinstance(row, dict) else (row.pk, self.version(row.updated_at))
+            for row in self.paginator.fetched_rows
+        ]
+        return self.add_validators(response, self.make_etag(versions))
 
-from triptuner.models import Destination, Itinerary, ItineraryDestination
-from triptuner.serializers import DestinationSerializer, ItinerarySerializer, UserSerializer
+
+class FastListMixin:
+    """
+    A read-only fast path for `list` in plain JSON: the page is fetched with `.values()` instead of model instances,
+    turned into the serializer's representation by `fast_list_rows`, and rendered with orjson, skipping the
+    serializer fields. The body is the same, byte for byte, as the one of the serializer and `JSONRenderer`.
+
+    Other formats (e.g. the browsable API, or JSON with `indent`) use the serializer. Views set the columns to
+    fetch with `fast_list_values`, and expressions to fetch along with `fast_list_expressions`. The paginator must
+    support `page_queryset`.
+    """
+
+    fast_list = True
+    fast_list_values = []
+    fast_list_expressions = {}
+    fast_list_rows = None
+
+    def use_fast_list(self, request):
+        return (
+            self.fast_list
+            and request.accepted_renderer.format == "json"
+            and "indent" not in request.accepted_media_type
+            and hasattr(self.paginator, "page_queryset")
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list(request):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        ordering = [self.paginator.field_name(field) for field in self.paginator.get_ordering(queryset, self)]
+        values = [*self.fast_list_values, *(field for field in ordering if field not in self.fast_list_values)]
+        queryset = queryset.values(*values, **self.fast_list_expressions)
+        rows = self.paginator.paginate_queryset(queryset, request, view=self)
+        data = self.paginator.get_paginated_data(self.fast_list_rows(rows))
+        return HttpResponse(render_json(data), content_type="application/json")
 
 
 # ViewSets define the view behavior.
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ReplicaReadMixin, NDJSONExportMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     filterset_fields = ["is_staff", "is_active"]
+    pagination_ordering = ["id"]
 
 
-class DestinationViewSet(viewsets.ModelViewSet):
+class DestinationViewSet(ReplicaReadMixin, ConditionalGetMixin, FastListMixin, NDJSONExportMixin, viewsets.ModelViewSet):
     queryset = Destination.objects.all()
     serializer_class = DestinationSerializer
-    filterset_fields = ["type", "latitude", "longitude"]
+    filter_backends = [DjangoFilterBackend, DestinationWithinFilter, DestinationSearchFilter]
+    filterset_fields = ["type", "parent", "latitude", "longitude"]
+    pagination_ordering = ["id"]
+    fast_list_values = ["id", "external_id", "name", "description", "type", "parent", "latitude", "longitude"]
+    fast_list_expressions = {"updated_at_version": updated_at_version}
+    fast_list_rows = staticmethod(destination_rows)
+
+    # Upper bound on the number of destinations ranked in one request
+    rank_max_candidates = 1000
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # Deleting the destination deletes its stops, which changes the itineraries visiting it, and leaves the
+        # destinations inside it without a parent
+        now = timezone.now()
+        Itinerary.objects.filter(destinations=instance).update(updated_at=now)
+        instance.children.update(parent=None, updated_at=now)
+        instance.delete()
+
+    @action(detail=True, methods=["get"])
+    def ancestors(self, request, pk=None):
+        """
+        The destinations this destination is inside of, from the broadest (e.g. its country) to its parent.
+        They are read from the closure table of the hierarchy with one query, whatever the depth.
+        """
+        try:
+            paths = list(DestinationClosure.objects.filter(descendant_id=pk).select_related("ancestor").order_by("-depth"))
+        except (TypeError, ValueError):
+            paths = []
+        # The last path is the one of the destination itself, at depth 0
+        if not paths:
+            raise NotFound()
+        return Response(self.get_serializer([path.ancestor for path in paths[:-1]], many=True).data)
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """
+        Stream the filtered destinations as NDJSON, or with `?file_format=csv|ndjson|geojson` in the format read by
+        the bulk import
+        """
+        file_format = request.query_params.get("file_format")
+        if file_format is None:
+            return super().export(request)
+        if file_format not in FORMATS:
+            return Response(
+                {"error": f"Unknown file format, use one of: {', '.join(FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lines = export_lines(queryset.using(queryset.db), file_format, chunk_size=self.export_chunk_size)
+        response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[file_format])
+        response["Content-Disposition"] = f'attachment; filename="{self.basename}.{file_format}"'
+        return response
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser],
+    )
+    def import_catalogue(self, request):
+        """
+        Import destinations from an uploaded CSV, NDJSON or GeoJSON `file`, upserting them on `external_id`.
+        The format is given with `file_format`, or guessed from the file extension. The file is read as a stream
+        and written with COPY a chunk at a time, see triptuner/catalogue.py.
+        """
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            file_format = request.data.get("file_format") or guess_format(upload.name)
+            stream = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+            summary = import_destinations(stream, file_format)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary)
+
+    @action(detail=False, methods=["get"])
+    def nearby(self, request):
+        """
+        Destinations within `radius_km` of `lat`/`lon`, nearest first.
+        Candidates are pruned with the indexed bounding box before exact distances are ranked by the database.
+        """
+        params = NearbyQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        lat, lon, radius_km, limit = (params.validated_data[name] for name in ("lat", "lon", "radius_km", "limit"))
 
+        queryset = (
+            self.filter_queryset(self.get_queryset())
+            .filter(bounding_box_filter(lat, lon, radius_km))
+            .annotate(distance_km=haversine_expression(lat, lon))
+            .filter(distance_km__lte=radius_km)
+            .order_by("distance_km", "id")[:limit]
+        )
+        return Response(NearbyDestinationSerializer(queryset, many=True).data)
 
-class ItineraryViewSet(viewsets.ModelViewSet):
+    # A query sent as POST for its body, so it is open to the same users as the read-only endpoints
+    @action(detail=False, methods=["post"], url_path="rank-by-weather", permission_classes=[AllowAny])
+    def rank_by_weather(self, request):
+        """
+        Candidate destinations scored by how well their forecast between `start_date` and `end_date` matches the
+        preferred temperature range and rain limit, best first. Candidates are the given `destinations` ids, or the
+        destinations matching the query parameter filters. Destinations without coordinates are left out.
+        Forecasts of all candidates are fetched with batched multi-location calls and scored together.
+        """
+        params = RankByWeatherSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        preferences = params.validated_data
+
+        queryset = self.filter_queryset(self.get_queryset()).filter(latitude__isnull=False, longitude__isnull=False)
+        if "destinations" in preferences:
+            queryset = queryset.filter(id__in=preferences["destinations"])
+        limit = self.rank_max_candidates
+        candidates = list(queryset.order_by("id")[:limit])
+
+        try:
+            forecasts = get_forecasts(
+                [(destination.latitude, destination.longitude) for destination in candidates],
+                hourly="temperature_2m,precipitation",
+                start_date=preferences["start_date"].isoformat(),
+                end_date=preferences["end_date"].isoformat(),
+            )
+        except UpstreamUnavailable as e:
+            return upstream_unavailable(e)
+        except requests.RequestException as e:
+            return Response(
+                {"error": "Failed to fetch weather data", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        scores = score_weather(
+            stack_series([forecast.get("hourly", {}).get("temperature_2m", []) for forecast in forecasts]),
+            stack_series([forecast.get("hourly", {}).get("precipitation", []) for forecast in forecasts]),
+            min_temperature=preferences["min_temperature"],
+            max_temperature=preferences["max_temperature"],
+            max_daily_precipitation=preferences["max_daily_precipitation"],
+        )
+        # A stable sort of the candidates, which are ordered by id, so ties are broken by id
+        ranked = []
+        for index in np.argsort(-scores["score"], kind="stable")[: preferences["limit"]]:
+            destination = candidates[index]
+            for name, values in scores.items():
+                value = values[index]
+                setattr(destination, name, None if np.isnan(value) else round(float(value), 4))
+            ranked.append(destination)
+        return Response(RankedDestinationSerializer(ranked, many=True).data)
+
+
+class ItineraryViewSet(
+    ReplicaReadMixin, ConditionalGetMixin, FastListMixin, QueryPlanMixin, NDJSONExportMixin, viewsets.ModelViewSet
+):
     queryset = Itinerary.objects.all()
     serializer_class = ItinerarySerializer
-    filterset_fields = ["name", "start_date", "end_date"]
+    filter_backends = [DjangoFilterBackend, ItineraryVisitsFilter, ItineraryBoundingBoxFilter, KeysetOrderingFilter]
+    filterset_fields = {
+        "name": ["exact"],
+        "start_date": ["exact"],
+        "end_date": ["exact"],
+        "stop_count": ["exact", "gte", "lte"],
+        "route_distance_km": ["gte", "lte"],
+    }
+    pagination_ordering = ["start_date", "id"]
+    keyset_ordering_fields = ["start_date", "stop_count", "route_distance_km"]
+    fast_list_values = ["id", "name", "description", "start_date", "end_date", "version", *Itinerary.SUMMARY_FIELDS]
+    fast_list_expressions = {"updated_at_version": updated_at_version}
+    fast_list_rows = staticmethod(itinerary_rows)
+
+    # The serializer only needs the destination ids, so destinations are only joined by actions that use them
+    prefetch_related_plan = {
+        "default": [Prefetch("itinerarydestination_set", queryset=ItineraryDestination.objects.order_by("visit_order"))],
+        "weather": [
+            Prefetch(
+                "itinerarydestination_set",
+                queryset=ItineraryDestination.objects.select_related("destination").order_by("visit_order"),
+            )
+        ],
+        "optimize_route": [
+            Prefetch(
+                "itinerarydestination_set",
+                queryset=ItineraryDestination.objects.select_related("destination").order_by("visit_order"),
+            )
+        ],
+        "destroy": [],
+    }
 
     # Restrict allowed HTTP methods
-    http_method_names = ["get", "post", "delete"]
+    http_method_names = ["get", "post", "put", "patch", "delete"]
+
+    # Upper bound on the number of itineraries in one bulk request
+    bulk_max_itineraries = 1000
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        """
+        Create many itineraries in one request, e.g. for partner imports.
+        All itineraries and their stops are validated together and written in a single transaction.
+        """
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.bulk_max_itineraries)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def change_stops(self, request, serializer_class, change):
+        """
+        Validate the request with `serializer_class`, call `change(stops, params)` to edit the list of stops of the
+        itinerary in visit order (existing stops as `{"id": ...}`, new ones as `{"destination_id": ...}`), and save
+        them numbered from 1. Only the stops whose visit order changed are written, see `update_itinerary`.
+        """
+        params = serializer_class(data=request.data)
+        params.is_valid(raise_exception=True)
+        itinerary = self.get_object()
+        stops = [{"id": stop.id} for stop in itinerary.itinerarydestination_set.all()]
+        change(stops, params.validated_data)
+        for visit_order, stop in enumerate(stops, start=1):
+            stop["visit_order"] = visit_order
+
+        update_itinerary(itinerary, {"version": params.validated_data["version"], "itinerarydestination_set": stops})
+        return Response(self.get_serializer(itinerary).data)
 
+    @staticmethod
+    def stop_index(stops, stop_id):
+        for index, stop in enumerate(stops):
+            if stop["id"] == stop_id:
+                return index
+        raise serializers.ValidationError({"stop": [f"Stop {stop_id} is not part of this itinerary."]})
+
+    @action(detail=True, methods=["post"], url_path="move-stop")
+    def move_stop(self, request, pk=None):
+        """
+        Move the `stop` with this id to `position` (from 1) in the visit order
+        """
+
+        def move(stops, params):
+            stops.insert(params["position"] - 1, stops.pop(self.stop_index(stops, params["stop"])))
+
+        return self.change_stops(request, MoveStopSerializer, move)
+
+    @action(detail=True, methods=["post"], url_path="insert-stop")
+    def insert_stop(self, request, pk=None):
+        """
+        Add a stop at `destination`, at `position` (from 1) in the visit order or at the end
+        """
+
+        def insert(stops, params):
+            stops.insert(params.get("position", len(stops) + 1) - 1, {"destination_id": params["destination"]})
+
+        return self.change_stops(request, InsertStopSerializer, insert)
+
+    @action(detail=True, methods=["post"], url_path="remove-stop")
+    def remove_stop(self, request, pk=None):
+        """
+        Remove the `stop` with this id, the later stops move up
+        """
+
+        def remove(stops, params):
+            stops.pop(self.stop_index(stops, params["stop"]))
+
+        return self.change_stops(request, RemoveStopSerializer, remove)
+
+    @action(detail=True, methods=["post"], url_path="optimize-route")
+    def optimize_route(self, request, pk=None):
+        """
+        Reorder the stops of the itinerary along the shortest route between them (great-circle distances,
+        no return to the first stop), and save the new visit orders in one bulk update.
+        """
+        params = OptimizeRouteSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        itinerary = self.get_object()
+        stops = list(itinerary.itinerarydestination_set.all())
+
+        missing = [
+            stop.destination_id for stop in stops if stop.destination.latitude is None or stop.destination.longitude is None
+        ]
+        if missing:
+            return Response(
+                {"error": "Destinations without coordinates can not be routed", "destinations": missing},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        distances = haversine_matrix(
+            [stop.destination.latitude for stop in stops], [stop.destination.longitude for stop in stops]
+        )
+        options = route_optimizer_settings()
+        route, method = optimize_route(
+            distances,
+            fix_start=params.validated_data["fix_start"],
+            exact_max_stops=options["EXACT_MAX_STOPS"],
+            time_budget=options["TIME_BUDGET"],
+        )
+
+        previous_distance_km = route_length(distances, range(len(stops)))
+        stops = [stops[index] for index in route]
+        for visit_order, stop in enumerate(stops, start=1):
+            stop.visit_order = visit_order
+        with transaction.atomic(savepoint=False):
+            ItineraryDestination.objects.bulk_update(stops, ["visit_order"])
+            # Updates made from the version before the new route are rejected
+            itinerary.updated_at = timezone.now()
+            Itinerary.objects.filter(pk=itinerary.pk).update(version=F("version") + 1, updated_at=itinerary.updated_at)
+            itinerary.version += 1
+            load_summaries([itinerary])
+
+        # Serialize the stops in their new order without fetching them again
+        itinerary._prefetched_objects_cache["itinerarydestination_set"] = stops
+        return Response(
+            {
+                **self.get_serializer(itinerary).data,
+                "route": {
+                    "method": method,
+                    "distance_km": route_length(distances, route),
+                    "previous_distance_km": previous_distance_km,
+                },
+            }
+        )
+
+    # Named explicitly, the generated name is taken by ItineraryDestinationWeatherView
+    @extend_schema(operation_id="itineraries_stops_weather_retrieve")
+    @action(detail=True, methods=["get"])
+    def weather(self, request, pk=None):
+        """
+        Forecasts for every stop of the itinerary, in visit order, in the local time of each destination.
+        The itinerary's days are shared out between the stops in visit order, and each stop gets the daily minimum,
+        maximum and mean temperature of its days, and the hourly series too with `?hourly=true`.
+        Stops are loaded in one query and their forecasts fetched with batched multi-location calls.
+        """
+        itinerary = self.get_object()
+        stops = list(itinerary.itinerarydestination_set.all())
+        windows = visit_windows(itinerary.start_date, itinerary.end_date, len(stops))
+        located = [
+            stop for stop in stops if stop.destination.latitude is not None and stop.destination.longitude is not None
+        ]
+
+        start_date, end_date = forecast_dates(itinerary.start_date, itinerary.end_date)
+        try:
+            forecasts = get_forecasts(
+                [(stop.destination.latitude, stop.destination.longitude) for stop in located],
+                hourly="temperature_2m",
+                start_date=start_date.isoformat(),
+                end_date=end_date.isoformat(),
+            )
+        except UpstreamUnavailable as e:
+            return upstream_unavailable(e)
+        except requests.RequestException as e:
+            return Response(
+                {"error": "Failed to fetch weather data", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        forecasts_by_stop = {stop.id: forecast for stop, forecast in zip(located, forecasts)}
+        hourly = include_hourly(request)
+        destinations = []
+        for stop, (first_day, last_day) in zip(stops, windows):
+            item = {
+                "visit_order": stop.visit_order,
+                "destination": stop.destination_id,
+                "start_date": first_day,
+                "end_date": last_day,
+            }
+            if stop.id in forecasts_by_stop:
+                zone = destination_zone(stop.destination.latitude, stop.destination.longitude)
+                start, end = local_bounds(first_day, last_day, zone)
+                item["forecast"] = local_forecast(forecasts_by_stop[stop.id], zone, start, end, hourly=hourly)
+            else:
+                item["error"] = "Invalid coordinates for this destination"
+            destinations.append(item)
+
+        return Response(
+            {
+                "itinerary": itinerary.id,
+                "start_date": itinerary.start_date,
+                "end_date": itinerary.end_date,
+                "destinations": destinations,
+            }
+        )
+
+
+def include_hourly(request):
+    """
+    Whether the hourly series were asked for with `?hourly=true`, along with the daily aggregates
+    """
+    return request.GET.get("hourly", "").lower() in {"1", "true", "yes", "on"}
+
+
+def upstream_unavailable(error, response_class=Response):
+    """
+    A 503 response for an `UpstreamUnavailable` error, with the seconds to wait before retrying in `Retry-After`
+    """
+    response = response_class({"error": "Weather provider unavailable", "details": str(error)}, status=503)
+    response["Retry-After"] = str(math.ceil(error.retry_after))
+    return response
+
+
+class ItineraryDestinationWeatherView(ReplicaReadMixin, RetrieveAPIView):
+    """
+    The forecast of a stop in the local time of its destination: the daily minimum, maximum and mean temperature,
+    and the hourly series too with `?hourly=true`. It covers the stop's days of the itinerary (see
+    triptuner/visits.py), or the range given with `start`/`end` ISO dates or datetimes (UTC unless they have an
+    offset).
+    """
 
-class ItineraryDestinationWeatherView(RetrieveAPIView):
     queryset = ItineraryDestination.objects.all()
     permission_classes = [DjangoModelPermissionsOrAnonReadOnly]
 
@@ -40,7 +688,7 @@ class ItineraryDestinationWeatherView(RetrieveAPIView):
         itinerary_destination_order = kwargs.get("itinerary_destination_order")
 
         try:
-            itinerary_destination = ItineraryDestination.objects.get(
+            itinerary_destination = ItineraryDestination.objects.select_related("destination", "itinerary").get(
                 itinerary_id=itinerary_id, visit_order=itinerary_destination_order
             )
         except ItineraryDestination.DoesNotExist:
@@ -50,23 +698,117 @@ class ItineraryDestinationWeatherView(RetrieveAPIView):
         latitude = destination.latitude
         longitude = destination.longitude
 
-        if not latitude or not longitude:
+        if latitude is None or longitude is None:
             return JsonResponse({"error": "Invalid coordinates for this destination"}, status=400)
 
-        # Open-Meteo API call
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "hourly": "temperature_2m",
-            "start": request.GET.get("start"),  # optionally pass start time
-            "end": request.GET.get("end"),  # optionally pass end time
-        }
+        try:
+            start, end = parse_bound(request.GET.get("start")), parse_bound(request.GET.get("end"), end=True)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        zone = destination_zone(latitude, longitude)
+        if start is None and end is None:
+            start, end = local_bounds(*stop_window(itinerary_destination), zone)
 
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
+            forecast = get_forecast(latitude, longitude, hourly="temperature_2m", start=start, end=end)
+        except UpstreamUnavailable as e:
+            return upstream_unavailable(e, JsonResponse)
         except requests.RequestException as e:
             return JsonResponse({"error": "Failed to fetch weather data", "details": str(e)}, status=500)
 
-        return JsonResponse(response.json())
+        return JsonResponse(local_forecast(forecast, zone, start, end, hourly=include_hourly(request)))
+
+
+class AsyncItineraryDestinationWeatherView(ReplicaReadMixin, View):
+    """
+    Async version of `ItineraryDestinationWeatherView`, for deployments served through ASGI.
+    Upstream calls go through a shared connection pool, so a worker does not block a thread per lookup.
+    """
+
+    # Read-only, so anonymous access matches DjangoModelPermissionsOrAnonReadOnly
+    http_method_names = ["get"]
+
+    async def get(self, request, *args, **kwargs):
+        itinerary_id = kwargs.get("itinerary_id")
+        itinerary_destination_order = kwargs.get("itinerary_destination_order")
+
+        try:
+            itinerary_destination = await ItineraryDestination.objects.select_related("destination", "itinerary").aget(
+                itinerary_id=itinerary_id, visit_order=itinerary_destination_order
+            )
+        except ItineraryDestination.DoesNotExist:
+            return JsonResponse({"error": "Itinerary destination not found"}, status=404)
+
+        destination = itinerary_destination.destination
+        latitude = destination.latitude
+        longitude = destination.longitude
+
+        if latitude is None or longitude is None:
+            return JsonResponse({"error": "Invalid coordinates for this destination"}, status=400)
+
+        try:
+            start, end = parse_bound(request.GET.get("start")), parse_bound(request.GET.get("end"), end=True)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        zone = destination_zone(latitude, longitude)
+        if start is None and end is None:
+            start, end = local_bounds(*await astop_window(itinerary_destination), zone)
+
+        try:
+            forecast = await aget_forecast(latitude, longitude, hourly="temperature_2m", start=start, end=end)
+        except UpstreamUnavailable as e:
+            return upstream_unavailable(e, JsonResponse)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return JsonResponse({"error": "Failed to fetch weather data", "details": str(e)}, status=500)
+
+        return JsonResponse(local_forecast(forecast, zone, start, end, hourly=include_hourly(request)))
+
+
+class WeatherCacheStatsView(APIView):
+    """
+    Hit/miss/stale counters for the forecast cache of this worker
+    """
+
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(responses={200: {"type": "object", "additionalProperties": {"type": "integer"}}})
+    def get(self, request, *args, **kwargs):
+        return Response(forecast_cache.stats())
+
+
+class MetricsView(APIView):
+    """
+    Per-route request metrics collected by the request profiling middleware, in Prometheus text format
+    """
+
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(operation_id="metrics_retrieve", tags=["metrics"], responses={(200, "text/plain"): OpenApiTypes.STR})
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class SchemaView(SpectacularAPIView):
+    """
+    The OpenAPI schema, served precomputed and pre-compressed (see triptuner/schema.py). Requests for another
+    language or API version are generated on the fly by drf-spectacular.
+    """
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        if request.GET.get("lang") or request.GET.get("version") or request.version:
+            return super().get(request, *args, **kwargs)
+
+        renderer = request.accepted_renderer
+        variant = precomputed_schema.variants()[renderer.format]
+        response = get_conditional_response(request, etag=variant["etag"])
+        if response is None:
+            encoding = accepted_encoding(request.headers.get("Accept-Encoding", ""))
+            content_type = f"{renderer.media_type}; charset={renderer.charset}" if renderer.charset else renderer.media_type
+            response = HttpResponse(variant[encoding], content_type=content_type)
+            if encoding != "identity":
+                response["Content-Encoding"] = encoding
+            response["Content-Disposition"] = f'inline; filename="{self._get_filename(request, None)}"'
+        response["ETag"] = variant["etag"]
+        patch_vary_headers(response, ["Accept", "Accept-Encoding"])
+        return response
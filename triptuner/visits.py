@@ -0,0 +1,124 @@
+"""
+When and where the stops of an itinerary are visited.
+
+The days of an itinerary are shared out between its stops in visit order, and each stop's days are taken in the
+local time of its destination. Time zones are looked up offline from the coordinates, with the time zone boundaries
+bundled with `timezonefinder`, so no geocoding service is called.
+"""
+
+import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from django.db.models import Count, Q
+from timezonefinder import TimezoneFinder
+
+from triptuner.models import ItineraryDestination
+
+
+@lru_cache(maxsize=None)
+def timezone_finder():
+    """
+    The shared `TimezoneFinder`, created on first use as it loads the boundary data
+    """
+    return TimezoneFinder()
+
+
+@lru_cache(maxsize=4096)
+def _zone_at(latitude, longitude):
+    # Points at sea get the nautical zone (Etc/GMT±N) of their longitude
+    name = timezone_finder().timezone_at(lat=latitude, lng=longitude) or "UTC"
+    return ZoneInfo(name)
+
+
+def destination_zone(latitude, longitude, precision=2):
+    """
+    The time zone at a location. Coordinates are rounded to `precision` decimals (about a kilometre for 2), as for
+    the forecast buckets, so lookups are cached per bucket.
+    """
+    return _zone_at(round(float(latitude), precision), round(float(longitude), precision))
+
+
+def visit_window(start_date, end_date, index, count):
+    """
+    The first and last day of the visit of the stop at `index` (from 0) of `count` stops, sharing the days from
+    `start_date` to `end_date` evenly in visit order. With more stops than days, consecutive stops share a day.
+    """
+    days = (end_date - start_date).days + 1
+    first = index * days // count
+    last = max((index + 1) * days // count - 1, first)
+    return start_date + datetime.timedelta(days=first), start_date + datetime.timedelta(days=last)
+
+
+def visit_windows(start_date, end_date, count):
+    return [visit_window(start_date, end_date, index, count) for index in range(count)]
+
+
+def local_bounds(first_day, last_day, zone):
+    """
+    The UTC datetimes of the first and last moment of the days from `first_day` to `last_day` in `zone`
+    """
+    start = datetime.datetime.combine(first_day, datetime.time(), tzinfo=zone)
+    end = datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time(), tzinfo=zone)
+    end -= datetime.timedelta(microseconds=1)
+    return start.astimezone(datetime.timezone.utc), end.astimezone(datetime.timezone.utc)
+
+
+def forecast_dates(start_date, end_date):
+    """
+    The UTC dates of the forecasts to fetch for an itinerary, padded by a day on both ends, so the local days of
+    its stops are covered in any time zone (offsets are within ±14 hours)
+    """
+    return start_date - datetime.timedelta(days=1), end_date + datetime.timedelta(days=1)
+
+
+def position_aggregates(visit_order):
+    """
+    Aggregates of the stops of an itinerary giving the index (from 0) of the stop at `visit_order`, and the count
+    """
+    return {"index": Count("id", filter=Q(visit_order__lt=visit_order)), "count": Count("id")}
+
+
+def stop_window(stop):
+    """
+    The visit window of an `ItineraryDestination` (with its itinerary loaded), from its position among the stops
+    """
+    stops = ItineraryDestination.objects.filter(itinerary_id=stop.itinerary_id)
+    position = stops.aggregate(**position_aggregates(stop.visit_order))
+    return visit_window(stop.itinerary.start_date, stop.itinerary.end_date, position["index"], position["count"])
+
+
+async def astop_window(stop):
+    stops = ItineraryDestination.objects.filter(itinerary_id=stop.itinerary_id)
+    position = await stops.aaggregate(**position_aggregates(stop.visit_order))
+    return visit_window(stop.itinerary.start_date, stop.itinerary.end_date, position["index"], position["count"])
+
+
+def utc_offsets(times, zone):
+    """
+    The UTC offsets in seconds of `zone` at the sorted UTC datetime64 `times`.
+
+    Offsets change months apart (daylight saving time), so a forecast spans at most one change. It is found by
+    bisection, with a handful of lookups instead of one per hour.
+    """
+    count = len(times)
+    if not count:
+        return np.zeros(0, dtype=np.int64)
+
+    def offset(index):
+        moment = times[index].astype("datetime64[s]").astype(datetime.datetime).replace(tzinfo=datetime.timezone.utc)
+        return int(moment.astimezone(zone).utcoffset().total_seconds())
+
+    first, last = offset(0), offset(count - 1)
+    if first == last:
+        return np.full(count, first, dtype=np.int64)
+    # offset(low) is the first offset and offset(high) the last one
+    low, high = 0, count - 1
+    while high - low > 1:
+        middle = (low + high) // 2
+        if offset(middle) == first:
+            low = middle
+        else:
+            high = middle
+    return np.where(np.arange(count) < high, first, last).astype(np.int64)
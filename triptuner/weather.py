@@ -0,0 +1,775 @@
+"""
+Open-Meteo forecast fetching and caching.
+
+Forecasts are cached in two tiers: a small in-process LRU in front of a shared Django cache backend.
+Entries are keyed on rounded latitude/longitude buckets plus the query parameters, so nearby destinations
+share one upstream call. Expired entries are still served for a grace period while they are refreshed in
+the background (stale-while-revalidate), and concurrent misses for the same key are collapsed into a single
+upstream call, both within a process and across workers sharing the cache backend.
+
+Behind the cache, single-location forecasts are kept in the persistent forecast store (see `triptuner.forecasts`):
+at least a week of a location's forecast is fetched at once, and requested ranges are sliced from the stored series.
+
+`get_forecast` is the blocking entry point used by the WSGI views. `aget_forecast` is its async counterpart
+for ASGI views: it shares the same cache, and fetches through one keep-alive `aiohttp` connection pool per
+event loop with bounded concurrency, timeouts and retries with backoff.
+
+Upstream calls are rate limited and guarded by a circuit breaker (see `triptuner.weather_client`). While the
+provider is throttling us or down, the last cached or stored forecasts are served for up to `STALE_IF_ERROR_TTL`
+seconds (stale-if-error), and lookups with nothing to serve raise `UpstreamUnavailable`.
+"""
+
+import asyncio
+import contextvars
+import datetime
+import logging
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from triptuner.forecasts import (
+    asave_forecast,
+    astored_forecast,
+    astored_rows,
+    covers,
+    parse_bound,
+    render_forecast,
+    save_forecast,
+    series_end,
+    stored_forecast,
+    stored_forecasts,
+    stored_rows,
+)
+from triptuner.profiling import record_cache
+from triptuner.weather_client import (
+    PREFETCH,
+    UpstreamUnavailable,
+    async_weather_client,
+    http_client_settings,
+    upstream_priority,
+    weather_client,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SETTINGS = {
+    "CACHE_ALIAS": "default",
+    "TTL": 15 * 60,
+    "STALE_TTL": 60 * 60,
+    "MAX_ENTRIES": 1024,
+    "COORDINATE_PRECISION": 2,
+    "LOCK_TIMEOUT": 10,
+    "REQUEST_TIMEOUT": 10,
+    "BATCH_SIZE": 50,
+    "STORE_MAX_AGE": 60 * 60,
+    "STALE_IF_ERROR_TTL": 24 * 60 * 60,
+}
+
+# Cache outcomes of lookups made by requests, recorded by the request profiler
+REQUEST_OUTCOMES = {"hits", "misses", "stale", "coalesced", "stale_if_error"}
+
+# Result of a background refresh that found another worker holding the shared lock. Requests that joined that
+# refresh wait for the other worker's value themselves.
+CONTENDED = object()
+
+
+def cache_settings():
+    return {**DEFAULT_CACHE_SETTINGS, **getattr(settings, "WEATHER_FORECAST_CACHE", {})}
+
+
+def bucket_coordinate(value, precision):
+    """
+    Round a coordinate to the cache bucket it falls in
+    """
+    return round(float(value), precision)
+
+
+def forecast_key(latitude, longitude, precision=2, hourly="temperature_2m", **params):
+    """
+    Build the cache key for a forecast query, from the bucketed coordinates and the other query parameters
+    """
+    latitude = bucket_coordinate(latitude, precision)
+    longitude = bucket_coordinate(longitude, precision)
+    params["hourly"] = hourly
+    query = "&".join(f"{name}={value}" for name, value in sorted(params.items()) if value is not None)
+    return f"forecast:{latitude:.{precision}f}:{longitude:.{precision}f}:{query}"
+
+
+class ForecastCache:
+    """
+    Two-tier forecast cache with stale-while-revalidate, stale-if-error and single-flight loading
+    """
+
+    def __init__(
+        self,
+        cache_alias="default",
+        ttl=900,
+        stale_ttl=3600,
+        max_entries=1024,
+        lock_timeout=10,
+        error_ttl=0,
+        clock=time.time,
+    ):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.lock_timeout = lock_timeout
+        self.poll_interval = 0.05
+        self.clock = clock
+
+        self._local = OrderedDict()
+        self._inflight = {}
+        self._async_inflight = weakref.WeakKeyDictionary()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    @property
+    def backend(self):
+        return caches[self.cache_alias]
+
+    def get_or_fetch(self, key, loader):
+        """
+        Return the cached value for `key`, calling `loader()` to fetch it when missing or expired
+        """
+        now = self.clock()
+        entry = self._get_local(key)
+        if entry is None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is not None and now < entry["fresh_until"]:
+            self._count("hits")
+            return entry["data"]
+
+        if entry is not None and now < entry["stale_until"]:
+            self._count("stale")
+            self._refresh_in_background(key, loader)
+            return entry["data"]
+
+        self._count("misses")
+        try:
+            return self._load(key, loader)
+        except UpstreamUnavailable:
+            return self._serve_on_error(entry, now)
+
+    def get_or_fetch_many(self, keys, loader):
+        """
+        Return a dict with the cached values for `keys`, calling `loader(missing_keys)` once for all keys that
+        are missing or expired. The loader returns the values in the same order as the keys it was given.
+        Stale values are served and refreshed together in the background. Like `get_or_fetch`, keys another thread
+        or worker is already loading are waited for rather than loaded again.
+        """
+        now = self.clock()
+        entries = {}
+        for key in keys:
+            entry = self._get_local(key)
+            if entry is not None:
+                entries[key] = entry
+        shared = self.backend.get_many([key for key in keys if key not in entries])
+        for key, entry in shared.items():
+            self._remember(key, entry)
+        entries.update(shared)
+
+        found, stale, missing = {}, [], []
+        for key in keys:
+            entry = entries.get(key)
+            if entry is not None and now < entry["fresh_until"]:
+                found[key] = entry["data"]
+            elif entry is not None and now < entry["stale_until"]:
+                found[key] = entry["data"]
+                stale.append(key)
+            else:
+                missing.append(key)
+
+        self._count("hits", len(found) - len(stale))
+        self._count("stale", len(stale))
+        self._count("misses", len(missing))
+
+        if stale:
+            self._refresh_many_in_background(stale, loader)
+        if missing:
+            try:
+                found.update(self._load_many(missing, loader))
+            except UpstreamUnavailable:
+                for key in missing:
+                    found[key] = self._serve_on_error(entries.get(key), now)
+        return found
+
+    async def aget_or_fetch(self, key, loader):
+        """
+        Async variant of `get_or_fetch`, where `loader` is a coroutine function
+        """
+        now = self.clock()
+        entry = self._get_local(key)
+        if entry is None:
+            entry = await self.backend.aget(key)
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is not None and now < entry["fresh_until"]:
+            self._count("hits")
+            return entry["data"]
+
+        if entry is not None and now < entry["stale_until"]:
+            self._count("stale")
+            self._arefresh_in_background(key, loader)
+            return entry["data"]
+
+        self._count("misses")
+        try:
+            return await self._aload(key, loader)
+        except UpstreamUnavailable:
+            return self._serve_on_error(entry, now)
+
+    def count_upstream_calls(self, amount=1):
+        """
+        Count the calls loaders made to Open-Meteo, as opposed to the values they served from the forecast store
+        """
+        self._count("upstream_calls", amount)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["local_entries"] = len(self._local)
+        for name in ("hits", "misses", "stale"):
+            stats.setdefault(name, 0)
+        return stats
+
+    def clear(self):
+        """
+        Drop the in-process entries and counters (the shared backend is left untouched)
+        """
+        with self._lock:
+            self._local.clear()
+            self._stats.clear()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+        if name in REQUEST_OUTCOMES and amount:
+            record_cache(name, amount)
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                self._local.move_to_end(key)
+            return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    @property
+    def entry_timeout(self):
+        # Entries are kept in the shared cache for as long as they may be served
+        return self.ttl + max(self.stale_ttl, self.error_ttl)
+
+    def _new_entry(self, data):
+        now = self.clock()
+        return {
+            "data": data,
+            "fetched_at": now,
+            "fresh_until": now + self.ttl,
+            "stale_until": now + self.ttl + self.stale_ttl,
+            "error_until": now + self.ttl + self.error_ttl,
+        }
+
+    def _serve_on_error(self, entry, now):
+        """
+        The data of an expired entry, served as the upstream is unavailable, or re-raise if there is none.
+        Called from an `except UpstreamUnavailable` block.
+        """
+        if entry is None or now >= entry.get("error_until", entry["stale_until"]):
+            raise
+        self._count("stale_if_error")
+        return entry["data"]
+
+    def _store(self, key, data):
+        entry = self._new_entry(data)
+        self.backend.set(key, entry, timeout=self.entry_timeout)
+        self._remember(key, entry)
+        return entry
+
+    def _store_many(self, values):
+        entries = {key: self._new_entry(data) for key, data in values.items()}
+        self.backend.set_many(entries, timeout=self.entry_timeout)
+        for key, entry in entries.items():
+            self._remember(key, entry)
+        return values
+
+    async def _astore(self, key, data):
+        entry = self._new_entry(data)
+        await self.backend.aset(key, entry, timeout=self.entry_timeout)
+        self._remember(key, entry)
+        return entry
+
+    def _start_flight(self, key):
+        """
+        Register an in-flight load for `key`. Returns the future and whether this caller owns the load.
+        """
+        with self._lock:
+            flight = self._inflight.get(key)
+            if flight is not None:
+                return flight, False
+            flight = Future()
+            self._inflight[key] = flight
+            return flight, True
+
+    def _finish_flight(self, key, flight, data=None, error=None):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(data)
+
+    def _load(self, key, loader):
+        flight, leader = self._start_flight(key)
+        if not leader:
+            self._count("coalesced")
+            data = flight.result()
+            if data is CONTENDED:
+                return self._load_shared(key, loader, wait=True)
+            return data
+
+        try:
+            data = self._load_shared(key, loader, wait=True)
+        except Exception as error:
+            self._finish_flight(key, flight, error=error)
+            raise
+        self._finish_flight(key, flight, data=data)
+        return data
+
+    def _load_shared(self, key, loader, wait):
+        """
+        Call the loader, unless another worker already holds the shared lock for this key.
+        In that case wait for it to publish the value (or return `CONTENDED` immediately if `wait` is False).
+        """
+        lock_key = f"{key}:lock"
+        if self.backend.add(lock_key, 1, timeout=self.lock_timeout):
+            try:
+                return self._store(key, loader())["data"]
+            finally:
+                self.backend.delete(lock_key)
+
+        if not wait:
+            return CONTENDED
+
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            entry = self.backend.get(key)
+            if entry is not None and self.clock() < entry["fresh_until"]:
+                self._remember(key, entry)
+                self._count("coalesced")
+                return entry["data"]
+
+        # The other worker did not finish in time, fetch it ourselves
+        return self._store(key, loader())["data"]
+
+    def _load_many(self, keys, loader):
+        """
+        The values of `keys`, with one `loader` call for the keys this caller gets to load. Keys another thread
+        is loading are waited for, as in `_load`.
+        """
+        flights, joined = {}, {}
+        for key in keys:
+            flight, leader = self._start_flight(key)
+            (flights if leader else joined)[key] = flight
+
+        values = {}
+        if flights:
+            try:
+                values.update(self._load_many_shared(list(flights), loader))
+            except Exception as error:
+                for key, flight in flights.items():
+                    self._finish_flight(key, flight, error=error)
+                raise
+            for key, flight in flights.items():
+                self._finish_flight(key, flight, data=values[key])
+
+        for key, flight in joined.items():
+            self._count("coalesced")
+            data = flight.result()
+            if data is CONTENDED:
+                data = self._load_shared(key, lambda key=key: loader([key])[0], wait=True)
+            values[key] = data
+        return values
+
+    def _load_many_shared(self, keys, loader):
+        """
+        Call the loader once for the keys whose shared lock this worker gets. The keys other workers hold the lock
+        of are waited for, and loaded together if they don't publish them in time.
+        """
+        locked = [key for key in keys if self.backend.add(f"{key}:lock", 1, timeout=self.lock_timeout)]
+        values = {}
+        if locked:
+            try:
+                values.update(self._store_many(dict(zip(locked, loader(locked)))))
+            finally:
+                self.backend.delete_many([f"{key}:lock" for key in locked])
+
+        contended = [key for key in keys if key not in values]
+        deadline = time.monotonic() + self.lock_timeout
+        while contended and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            for key, entry in self.backend.get_many(contended).items():
+                if self.clock() < entry["fresh_until"]:
+                    self._remember(key, entry)
+                    self._count("coalesced")
+                    values[key] = entry["data"]
+            contended = [key for key in contended if key not in values]
+
+        # The other workers did not finish in time, fetch them ourselves
+        if contended:
+            values.update(self._store_many(dict(zip(contended, loader(contended)))))
+        return values
+
+    def _refresh_in_background(self, key, loader):
+        flight, leader = self._start_flight(key)
+        if not leader:
+            return
+
+        def refresh():
+            try:
+                with upstream_priority(PREFETCH):
+                    data = self._load_shared(key, loader, wait=False)
+            except Exception as error:
+                logger.warning("Background forecast refresh failed for %s: %s", key, error)
+                self._count("refresh_errors")
+                self._finish_flight(key, flight, error=error)
+                return
+            if data is not CONTENDED:
+                self._count("refreshes")
+            self._finish_flight(key, flight, data=data)
+
+        threading.Thread(target=refresh, name=f"forecast-refresh-{key}", daemon=True).start()
+
+    def _refresh_many_in_background(self, keys, loader):
+        flights = {}
+        for key in keys:
+            flight, leader = self._start_flight(key)
+            if leader:
+                flights[key] = flight
+        if not flights:
+            return
+
+        def refresh():
+            keys = list(flights)
+            try:
+                with upstream_priority(PREFETCH):
+                    values = self._store_many(dict(zip(keys, loader(keys))))
+            except Exception as error:
+                logger.warning("Background forecast refresh failed for %d keys: %s", len(keys), error)
+                self._count("refresh_errors")
+                for key, flight in flights.items():
+                    self._finish_flight(key, flight, error=error)
+                return
+            self._count("refreshes", len(keys))
+            for key, flight in flights.items():
+                self._finish_flight(key, flight, data=values[key])
+
+        threading.Thread(target=refresh, name="forecast-refresh-batch", daemon=True).start()
+
+    def _astart_flight(self, key):
+        """
+        Async variant of `_start_flight`. In-flight loads are tracked per event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            flights = self._async_inflight.setdefault(loop, {})
+            flight = flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = loop.create_future()
+            flights[key] = flight
+            return flight, True
+
+    def _afinish_flight(self, key, flight, data=None, error=None):
+        with self._lock:
+            self._async_inflight.get(asyncio.get_running_loop(), {}).pop(key, None)
+        if error is not None:
+            flight.set_exception(error)
+            # Waiters re-raise the error themselves, don't warn about it going unretrieved
+            flight.exception()
+        else:
+            flight.set_result(data)
+
+    async def _aload(self, key, loader):
+        flight, leader = self._astart_flight(key)
+        if not leader:
+            self._count("coalesced")
+            data = await asyncio.shield(flight)
+            if data is CONTENDED:
+                return await self._aload_shared(key, loader, wait=True)
+            return data
+
+        try:
+            data = await self._aload_shared(key, loader, wait=True)
+        except Exception as error:
+            self._afinish_flight(key, flight, error=error)
+            raise
+        self._afinish_flight(key, flight, data=data)
+        return data
+
+    async def _aload_shared(self, key, loader, wait):
+        lock_key = f"{key}:lock"
+        if await self.backend.aadd(lock_key, 1, timeout=self.lock_timeout):
+            try:
+                return (await self._astore(key, await loader()))["data"]
+            finally:
+                await self.backend.adelete(lock_key)
+
+        if not wait:
+            return CONTENDED
+
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            entry = await self.backend.aget(key)
+            if entry is not None and self.clock() < entry["fresh_until"]:
+                self._remember(key, entry)
+                self._count("coalesced")
+                return entry["data"]
+
+        # The other worker did not finish in time, fetch it ourselves
+        return (await self._astore(key, await loader()))["data"]
+
+    def _arefresh_in_background(self, key, loader):
+        flight, leader = self._astart_flight(key)
+        if not leader:
+            return
+
+        async def refresh():
+            try:
+                with upstream_priority(PREFETCH):
+                    data = await self._aload_shared(key, loader, wait=False)
+            except Exception as error:
+                logger.warning("Background forecast refresh failed for %s: %s", key, error)
+                self._count("refresh_errors")
+                self._afinish_flight(key, flight, error=error)
+                return
+            if data is not CONTENDED:
+                self._count("refreshes")
+            self._afinish_flight(key, flight, data=data)
+
+        # Keep a reference to the task so it is not garbage collected before it finishes. It runs outside the
+        # context of the request that triggered it, so it is not profiled as part of that request.
+        task = asyncio.get_running_loop().create_task(refresh(), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+def build_forecast_cache():
+    config = cache_settings()
+    return ForecastCache(
+        cache_alias=config["CACHE_ALIAS"],
+        ttl=config["TTL"],
+        stale_ttl=config["STALE_TTL"],
+        max_entries=config["MAX_ENTRIES"],
+        lock_timeout=config["LOCK_TIMEOUT"],
+        error_ttl=config["STALE_IF_ERROR_TTL"],
+    )
+
+
+forecast_cache = build_forecast_cache()
+
+
+def fetch_forecast(latitude, longitude, hourly="temperature_2m", start_date=None, end_date=None, url=None):
+    """
+    Fetch a forecast from Open-Meteo, bypassing the cache. `start_date` and `end_date` are ISO dates (in UTC), by
+    default the next 7 days are returned.
+    """
+    url = url or http_client_settings()["URL"]
+    params = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "hourly": hourly,
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+    return weather_client.get(url, params, timeout=cache_settings()["REQUEST_TIMEOUT"])
+
+
+def fetch_forecasts(locations, url=None, **params):
+    """
+    Fetch forecasts for many (latitude, longitude) pairs in one Open-Meteo multi-location call,
+    bypassing the cache. Forecasts are returned in the same order as the locations.
+    """
+    url = url or http_client_settings()["URL"]
+    params = {
+        "latitude": ",".join(str(latitude) for latitude, _ in locations),
+        "longitude": ",".join(str(longitude) for _, longitude in locations),
+        **params,
+    }
+    forecasts = weather_client.get(url, params, timeout=cache_settings()["REQUEST_TIMEOUT"])
+    # Open-Meteo only returns a list when more than one location was requested
+    return forecasts if isinstance(forecasts, list) else [forecasts]
+
+
+async def afetch_forecast(latitude, longitude, hourly="temperature_2m", start_date=None, end_date=None):
+    """
+    Async variant of `fetch_forecast`
+    """
+    params = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "hourly": hourly,
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+    return await async_weather_client.get(params)
+
+
+# Days fetched at least, Open-Meteo's default
+FETCHED_DAYS = 7
+
+
+def fetch_dates(start=None, end=None, rows=None):
+    """
+    The UTC `start_date` and `end_date` to fetch to cover `start` to `end`: at least `FETCHED_DAYS` days from the
+    first one (today without `start`), so nearby ranges are served from the store too. The range is widened to that
+    of the stored series `rows` of the location, which the fetched ones replace.
+    """
+    today = timezone.now().date()
+    first = start.astimezone(datetime.timezone.utc).date() if start is not None else today
+    last = end.astimezone(datetime.timezone.utc).date() if end is not None else first
+    first = min(first, last)
+    last = max(last, first + datetime.timedelta(days=FETCHED_DAYS - 1))
+    for row in rows or []:
+        first = min(first, row.start.astimezone(datetime.timezone.utc).date())
+        last = max(last, (series_end(row) - datetime.timedelta(microseconds=1)).astimezone(datetime.timezone.utc).date())
+    return first.isoformat(), last.isoformat()
+
+
+def load_forecast(latitude, longitude, hourly="temperature_2m", start=None, end=None):
+    """
+    Return a forecast from the forecast store. When it is missing, older than `STORE_MAX_AGE` or doesn't cover `start`
+    to `end`, the forecast of the location is fetched into the store first (see `fetch_dates`), so nearby ranges
+    are later sliced from it without an upstream call. While the upstream is unavailable, the stored forecast is
+    served whatever its age.
+    """
+    variables = hourly.split(",")
+    rows = stored_rows(latitude, longitude, variables, max_age=cache_settings()["STORE_MAX_AGE"])
+    if rows is not None and covers(rows, start, end):
+        return render_forecast(latitude, longitude, rows, start, end)
+
+    forecast_cache.count_upstream_calls()
+    try:
+        response = fetch_forecast(latitude, longitude, hourly, *fetch_dates(start, end, rows))
+    except UpstreamUnavailable:
+        # Serve the stored forecast however old it is, rather than nothing
+        forecast = stored_forecast(latitude, longitude, variables, start, end, max_age=None)
+        if forecast is None:
+            raise
+        record_cache("stale_if_error")
+        return forecast
+    rows = save_forecast(latitude, longitude, response)
+    # Responses without an hourly time axis can't be stored or sliced, and are passed through
+    return render_forecast(latitude, longitude, rows, start, end) if rows else response
+
+
+async def aload_forecast(latitude, longitude, hourly="temperature_2m", start=None, end=None):
+    """
+    Async variant of `load_forecast`
+    """
+    variables = hourly.split(",")
+    rows = await astored_rows(latitude, longitude, variables, max_age=cache_settings()["STORE_MAX_AGE"])
+    if rows is not None and covers(rows, start, end):
+        return render_forecast(latitude, longitude, rows, start, end)
+
+    forecast_cache.count_upstream_calls()
+    try:
+        response = await afetch_forecast(latitude, longitude, hourly, *fetch_dates(start, end, rows))
+    except UpstreamUnavailable:
+        forecast = await astored_forecast(latitude, longitude, variables, start, end, max_age=None)
+        if forecast is None:
+            raise
+        record_cache("stale_if_error")
+        return forecast
+    rows = await asave_forecast(latitude, longitude, response)
+    return render_forecast(latitude, longitude, rows, start, end) if rows else response
+
+
+def get_forecast(latitude, longitude, hourly="temperature_2m", start=None, end=None):
+    """
+    Return the forecast for a location, served from the forecast cache or store where possible.
+    `start` and `end` are ISO dates or datetimes bounding the hours returned, and raise ValueError when invalid.
+    The upstream call is made for the bucketed coordinates, so the result is valid for the whole bucket.
+    """
+    precision = cache_settings()["COORDINATE_PRECISION"]
+    latitude = bucket_coordinate(latitude, precision)
+    longitude = bucket_coordinate(longitude, precision)
+    start, end = parse_bound(start), parse_bound(end, end=True)
+    key = forecast_key(
+        latitude, longitude, precision, hourly=hourly, start=start and start.isoformat(), end=end and end.isoformat()
+    )
+
+    return forecast_cache.get_or_fetch(key, lambda: load_forecast(latitude, longitude, hourly, start, end))
+
+
+def get_forecasts(locations, hourly="temperature_2m", start_date=None, end_date=None):
+    """
+    Return the forecasts for many (latitude, longitude) pairs, in the same order.
+    Locations are bucketed and deduplicated. The ones missing from the cache are sliced from the forecast store
+    when it covers the dates (e.g. after they were prefetched, see triptuner/prefetch.py), and the others are
+    fetched with Open-Meteo's multi-location queries, `BATCH_SIZE` locations per upstream call.
+    """
+    config = cache_settings()
+    precision = config["COORDINATE_PRECISION"]
+    params = {"hourly": hourly, "start_date": start_date, "end_date": end_date}
+
+    buckets = [(bucket_coordinate(lat, precision), bucket_coordinate(lon, precision)) for lat, lon in locations]
+    keys = {location: forecast_key(*location, precision, **params) for location in buckets}
+    locations_by_key = {key: location for location, key in keys.items()}
+
+    def load(missing_keys):
+        missing = [locations_by_key[key] for key in missing_keys]
+        stored = stored_forecasts(
+            missing,
+            hourly.split(","),
+            parse_bound(start_date),
+            parse_bound(end_date, end=True),
+            max_age=config["STORE_MAX_AGE"],
+        )
+        unstored = [location for location in missing if location not in stored]
+        batch_size = config["BATCH_SIZE"]
+        fetched = {}
+        for start in range(0, len(unstored), batch_size):
+            end = start + batch_size
+            batch = unstored[start:end]
+            forecast_cache.count_upstream_calls()
+            fetched.update(zip(batch, fetch_forecasts(batch, **params)))
+        return [stored[location] if location in stored else fetched[location] for location in missing]
+
+    forecasts = forecast_cache.get_or_fetch_many(list(locations_by_key), load)
+    return [forecasts[keys[location]] for location in buckets]
+
+
+async def aget_forecast(latitude, longitude, hourly="temperature_2m", start=None, end=None):
+    """
+    Async variant of `get_forecast`
+    """
+    precision = cache_settings()["COORDINATE_PRECISION"]
+    latitude = bucket_coordinate(latitude, precision)
+    longitude = bucket_coordinate(longitude, precision)
+    start, end = parse_bound(start), parse_bound(end, end=True)
+    key = forecast_key(
+        latitude, longitude, precision, hourly=hourly, start=start and start.isoformat(), end=end and end.isoformat()
+    )
+
+    return await forecast_cache.aget_or_fetch(key, lambda: aload_forecast(latitude, longitude, hourly, start, end))
@@ -0,0 +1,447 @@
+"""
+Open-Meteo clients, rate limited and guarded by a circuit breaker shared by all workers.
+
+Every upstream call first passes an `UpstreamGuard`, whose state lives in the Django cache so that all processes
+see it:
+
+- A token bucket caps the rate of calls to what the provider allows. Interactive calls (made while handling a
+  request) take a token ahead of time when the bucket is empty, and sleep until it is due, as long as that is
+  within `MAX_WAIT` seconds. Prefetching and background refreshes only take spare tokens, leaving
+  `PREFETCH_RESERVE` of them to interactive calls, so they queue behind interactive calls.
+- A circuit breaker stops calling the provider once it throttled us (a 429, for as long as its `Retry-After`
+  asks) or failed `FAILURE_THRESHOLD` times in a row, for `RESET_TIMEOUT` seconds. Meanwhile calls fail fast with
+  `UpstreamUnavailable`, and the forecast cache and store serve the forecasts they have, however stale.
+
+The depth of the token queue, the time spent in it and the calls given up on are exported as metrics on
+`/api/_metrics/`. Calls run with the priority set by `upstream_priority()`, interactive by default.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import time
+import weakref
+
+import aiohttp
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+from triptuner.profiling import DURATION_BUCKETS, metrics, upstream_call
+
+OPEN_METEO_FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+
+DEFAULT_HTTP_CLIENT_SETTINGS = {
+    "URL": OPEN_METEO_FORECAST_URL,
+    "MAX_CONNECTIONS": 100,
+    "MAX_CONCURRENCY": 100,
+    "TIMEOUT": 10,
+    "RETRIES": 2,
+    "BACKOFF": 0.2,
+}
+
+DEFAULT_UPSTREAM_SETTINGS = {
+    "CACHE_ALIAS": "default",
+    "RATE": 10,
+    "BURST": 20,
+    "MAX_WAIT": 5,
+    "PREFETCH_RESERVE": 10,
+    "PREFETCH_MAX_WAIT": 60,
+    "FAILURE_THRESHOLD": 5,
+    "RESET_TIMEOUT": 30,
+}
+
+# Upstream responses worth retrying. Throttled (429) responses open the circuit breaker instead.
+RETRY_STATUS_CODES = {502, 503, 504}
+
+INTERACTIVE = "interactive"
+PREFETCH = "prefetch"
+
+current_priority = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+
+
+def http_client_settings():
+    return {**DEFAULT_HTTP_CLIENT_SETTINGS, **getattr(settings, "WEATHER_HTTP_CLIENT", {})}
+
+
+def upstream_settings():
+    return {**DEFAULT_UPSTREAM_SETTINGS, **getattr(settings, "WEATHER_UPSTREAM", {})}
+
+
+@contextlib.contextmanager
+def upstream_priority(priority):
+    """
+    Run the upstream calls made within the block with `priority` (INTERACTIVE or PREFETCH)
+    """
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    The provider is throttling us or down, or the rate limit queue is full. Try again in `retry_after` seconds.
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason, retry_after)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f"Weather provider unavailable ({self.reason}), retry in {self.retry_after:.0f}s"
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a `Retry-After` header (delay in seconds or HTTP date), or None
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamGuard:
+    """
+    Shared token bucket and circuit breaker in front of upstream calls, see the module docstring.
+    Settings are read on every call.
+    """
+
+    lock_timeout = 1
+    lock_poll_interval = 0.005
+
+    def __init__(self, key="weather:upstream", clock=time.time, sleep=time.sleep):
+        self.tokens_key = f"{key}:tokens"
+        self.lock_key = f"{key}:tokens:lock"
+        self.open_key = f"{key}:open-until"
+        self.failures_key = f"{key}:failures"
+        self.clock = clock
+        self.sleep = sleep
+
+    def limits(self, config, priority):
+        """
+        The fewest tokens a call of `priority` may leave in the bucket (negative for tokens taken ahead of
+        time), and how long it may wait
+        """
+        if priority == INTERACTIVE:
+            return -config["RATE"] * config["MAX_WAIT"], config["MAX_WAIT"]
+        return config["PREFETCH_RESERVE"], config["PREFETCH_MAX_WAIT"]
+
+    def take_token(self, state, now, config, floor):
+        """
+        The bucket after taking a token from `state`, or None if that would leave fewer than `floor` tokens
+        """
+        tokens = config["BURST"] if state is None else state["tokens"] + (now - state["updated"]) * config["RATE"]
+        tokens = min(tokens, config["BURST"]) - 1
+        return {"tokens": tokens, "updated": now} if tokens >= floor else None
+
+    def reserve(self, backend, config, floor):
+        """
+        Take a token, under a lock shared through the cache. Returns the tokens left, or None if there weren't
+        enough or the lock was held for too long.
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        while not backend.add(self.lock_key, 1, timeout=self.lock_timeout):
+            if time.monotonic() > deadline:
+                return None
+            self.sleep(self.lock_poll_interval)
+        try:
+            state = self.take_token(backend.get(self.tokens_key), self.clock(), config, floor)
+            if state is None:
+                return None
+            backend.set(self.tokens_key, state, timeout=None)
+            return state["tokens"]
+        finally:
+            backend.delete(self.lock_key)
+
+    async def areserve(self, backend, config, floor):
+        deadline = time.monotonic() + self.lock_timeout
+        while not await backend.aadd(self.lock_key, 1, timeout=self.lock_timeout):
+            if time.monotonic() > deadline:
+                return None
+            await asyncio.sleep(self.lock_poll_interval)
+        try:
+            state = self.take_token(await backend.aget(self.tokens_key), self.clock(), config, floor)
+            if state is None:
+                return None
+            await backend.aset(self.tokens_key, state, timeout=None)
+            return state["tokens"]
+        finally:
+            await backend.adelete(self.lock_key)
+
+    def check_circuit(self, open_until):
+        now = self.clock()
+        if open_until is not None and now < open_until:
+            self.reject("circuit_open", open_until - now)
+
+    def reject(self, reason, retry_after):
+        metrics.count("triptuner_upstream_rejected_total", {"reason": reason, "priority": current_priority.get()})
+        raise UpstreamUnavailable(reason, retry_after)
+
+    def next_wait(self, tokens, config, priority, started, max_wait):
+        """
+        Seconds to sleep before calling, or before trying to take a token again. Raises when out of time.
+        """
+        if tokens is not None:
+            return max(-tokens, 0) / config["RATE"]
+        waited = time.monotonic() - started
+        # Interactive calls that can't take a token ahead of time would wait longer than MAX_WAIT anyway
+        if priority == INTERACTIVE or waited >= max_wait:
+            self.reject("rate_limited", config["MAX_WAIT"])
+        return None
+
+    def before(self):
+        """
+        Fail fast while the circuit is open, then wait for a token
+        """
+        config = upstream_settings()
+        backend = caches[config["CACHE_ALIAS"]]
+        self.check_circuit(backend.get(self.open_key))
+        if not config["RATE"]:
+            return
+
+        priority = current_priority.get()
+        floor, max_wait = self.limits(config, priority)
+        labels = {"priority": priority}
+        started = time.monotonic()
+        metrics.gauge("triptuner_upstream_queue_depth", labels, 1)
+        try:
+            while True:
+                tokens = self.reserve(backend, config, floor)
+                wait = self.next_wait(tokens, config, priority, started, max_wait)
+                if wait is not None:
+                    self.sleep(wait)
+                    break
+                self.sleep(1 / config["RATE"])
+        finally:
+            metrics.gauge("triptuner_upstream_queue_depth", labels, -1)
+            metrics.observe("triptuner_upstream_wait_seconds", labels, time.monotonic() - started, DURATION_BUCKETS)
+
+    async def abefore(self):
+        config = upstream_settings()
+        backend = caches[config["CACHE_ALIAS"]]
+        self.check_circuit(await backend.aget(self.open_key))
+        if not config["RATE"]:
+            return
+
+        priority = current_priority.get()
+        floor, max_wait = self.limits(config, priority)
+        labels = {"priority": priority}
+        started = time.monotonic()
+        metrics.gauge("triptuner_upstream_queue_depth", labels, 1)
+        try:
+            while True:
+                tokens = await self.areserve(backend, config, floor)
+                wait = self.next_wait(tokens, config, priority, started, max_wait)
+                if wait is not None:
+                    await asyncio.sleep(wait)
+                    break
+                await asyncio.sleep(1 / config["RATE"])
+        finally:
+            metrics.gauge("triptuner_upstream_queue_depth", labels, -1)
+            metrics.observe("triptuner_upstream_wait_seconds", labels, time.monotonic() - started, DURATION_BUCKETS)
+
+    @staticmethod
+    def failed(status_code):
+        # Connection errors and timeouts are recorded as a None status
+        return status_code is None or status_code == 429 or status_code >= 500
+
+    def open_for(self, config, status_code, failures, retry_after):
+        """
+        Seconds to open the circuit for after the `failures`-th failure in a row, or None
+        """
+        if status_code == 429:
+            return retry_after or config["RESET_TIMEOUT"]
+        return config["RESET_TIMEOUT"] if failures >= config["FAILURE_THRESHOLD"] else None
+
+    def after(self, status_code, retry_after=None):
+        """
+        Record the outcome of a call, opening the circuit when the provider throttled us or kept failing.
+        Failures in a row are counted in the cache, and forgotten after `RESET_TIMEOUT` seconds without one.
+        """
+        config = upstream_settings()
+        backend = caches[config["CACHE_ALIAS"]]
+        if not self.failed(status_code):
+            backend.delete(self.failures_key)
+            return
+        if backend.add(self.failures_key, 1, timeout=config["RESET_TIMEOUT"]):
+            failures = 1
+        else:
+            try:
+                failures = backend.incr(self.failures_key)
+            except ValueError:  # Expired in the meantime
+                failures = 1
+            else:
+                # incr keeps the expiry set by add, push it back so failures expire RESET_TIMEOUT after the last one
+                backend.touch(self.failures_key, config["RESET_TIMEOUT"])
+        seconds = self.open_for(config, status_code, failures, retry_after)
+        if seconds is not None:
+            backend.set(self.open_key, self.clock() + seconds, timeout=seconds)
+        self.opened(status_code, seconds)
+
+    async def aafter(self, status_code, retry_after=None):
+        config = upstream_settings()
+        backend = caches[config["CACHE_ALIAS"]]
+        if not self.failed(status_code):
+            await backend.adelete(self.failures_key)
+            return
+        if await backend.aadd(self.failures_key, 1, timeout=config["RESET_TIMEOUT"]):
+            failures = 1
+        else:
+            try:
+                failures = await backend.aincr(self.failures_key)
+            except ValueError:
+                failures = 1
+            else:
+                await backend.atouch(self.failures_key, config["RESET_TIMEOUT"])
+        seconds = self.open_for(config, status_code, failures, retry_after)
+        if seconds is not None:
+            await backend.aset(self.open_key, self.clock() + seconds, timeout=seconds)
+        self.opened(status_code, seconds)
+
+    def opened(self, status_code, seconds):
+        if seconds is not None:
+            metrics.count("triptuner_upstream_circuit_opened_total", {})
+        if status_code == 429:
+            self.reject("throttled", seconds)
+
+    def reset(self):
+        """
+        Close the circuit, refill the token bucket and forget the failures
+        """
+        backend = caches[upstream_settings()["CACHE_ALIAS"]]
+        backend.delete_many([self.open_key, self.tokens_key, self.failures_key])
+
+
+upstream_guard = UpstreamGuard()
+
+
+class WeatherClient:
+    """
+    Blocking Open-Meteo client, with one keep-alive `requests` session shared by the threads of a worker
+    """
+
+    def __init__(self, guard=None):
+        self.guard = guard
+        self.session = requests.Session()
+
+    def get(self, url, params, timeout):
+        if self.guard is not None:
+            self.guard.before()
+        try:
+            with upstream_call() as call:
+                response = self.session.get(url, params=params, timeout=timeout)
+                call.status = response.status_code
+        except (requests.ConnectionError, requests.Timeout):
+            if self.guard is not None:
+                self.guard.after(None)
+            raise
+        if self.guard is not None:
+            self.guard.after(response.status_code, parse_retry_after(response.headers.get("Retry-After")))
+        response.raise_for_status()
+        return response.json()
+
+
+weather_client = WeatherClient(guard=upstream_guard)
+
+
+class AsyncWeatherClient:
+    """
+    Async Open-Meteo client sharing one keep-alive connection pool per event loop
+    """
+
+    def __init__(
+        self,
+        url=OPEN_METEO_FORECAST_URL,
+        max_connections=100,
+        max_concurrency=100,
+        timeout=10,
+        retries=2,
+        backoff=0.2,
+        guard=None,
+    ):
+        self.url = url
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.guard = guard
+
+        # aiohttp sessions and semaphores are bound to the event loop they were created on
+        self._pools = weakref.WeakKeyDictionary()
+
+    def _pool(self):
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None or pool[0].closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            pool = self._pools[loop] = (session, asyncio.Semaphore(self.max_concurrency))
+        return pool
+
+    async def get(self, params):
+        """
+        GET the forecast endpoint, retrying connection errors, timeouts and unavailable responses with exponential
+        backoff. Every attempt passes the guard.
+        """
+        session, semaphore = self._pool()
+        params = {name: str(value) for name, value in params.items() if value is not None}
+
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                last_attempt = attempt == self.retries
+                if self.guard is not None:
+                    await self.guard.abefore()
+                try:
+                    with upstream_call() as call:
+                        async with session.get(self.url, params=params) as response:
+                            call.status = response.status
+                            if self.guard is not None:
+                                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                                await self.guard.aafter(response.status, retry_after)
+                            if response.status not in RETRY_STATUS_CODES or last_attempt:
+                                response.raise_for_status()
+                                return await response.json()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if self.guard is not None:
+                        await self.guard.aafter(None)
+                    if last_attempt:
+                        raise
+                await asyncio.sleep(self.backoff * 2**attempt)
+
+    async def aclose(self):
+        """
+        Close the connection pool of the running event loop
+        """
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            await pool[0].close()
+
+
+def build_async_weather_client():
+    config = http_client_settings()
+    return AsyncWeatherClient(
+        url=config["URL"],
+        max_connections=config["MAX_CONNECTIONS"],
+        max_concurrency=config["MAX_CONCURRENCY"],
+        timeout=config["TIMEOUT"],
+        retries=config["RETRIES"],
+        backoff=config["BACKOFF"],
+        guard=upstream_guard,
+    )
+
+
+async_weather_client = build_async_weather_client()